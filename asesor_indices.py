@@ -0,0 +1,129 @@
+"""
+Asesor de índices del catálogo
+Corre explain() sobre consultas representativas de buscar_propiedades (las
+mismas que arma el agente: filtros, orden y límite de página) y marca las que
+recorren la colección completa (COLLSCAN), ordenan en memoria (SORT) o
+examinan muchos más documentos de los que devuelven.
+
+Uso:
+  python asesor_indices.py
+  python asesor_indices.py --consultas consultas.jsonl   # un JSON de parámetros por línea
+Sale con código 1 si alguna consulta hace COLLSCAN.
+"""
+
+import os
+import sys
+import json
+import argparse
+from typing import Dict, List
+
+from pymongo import MongoClient
+
+from catalogo import ORDEN_BUSQUEDA, PROYECCION_RESUMEN, TAMANO_PAGINA, filtros_busqueda
+
+# Variables de entorno
+MONGO_URI = os.getenv("MONGO_URI", "tu-mongo-uri-aqui")
+MONGO_DB = os.getenv("MONGO_DB", "inmobiliaria")
+
+# Parámetros típicos que Claude manda a buscar_propiedades
+CONSULTAS_REPRESENTATIVAS = [
+    {},
+    {"operacion": "alquiler"},
+    {"tipo": "departamento", "operacion": "alquiler"},
+    {"tipo": "casa", "operacion": "venta", "precio_max": 200000},
+    {"operacion": "venta", "precio_min": 50000, "precio_max": 150000},
+    {"tipo": "departamento", "operacion": "alquiler", "habitaciones": 2, "precio_max": 800},
+    {"tipo": "departamento", "operacion": "alquiler", "ubicacion": "Rosario"},
+    {"operacion": "alquiler", "ubicacion": "centro rosario", "precio_max": 1000},
+    {"ubicacion": "Fisherton"},
+    {"tipo": "local", "precio_min": 1000},
+]
+
+# Más de esta proporción de documentos examinados por documento devuelto es sospechosa
+MAX_EXAMINADOS_POR_DEVUELTO = 10
+
+
+def etapas(plan: Dict) -> List[Dict]:
+    """Etapas de un plan de ejecución, de la raíz a las hojas"""
+    resultado = [plan]
+    for hijo in [plan.get("inputStage")] + list(plan.get("inputStages", [])):
+        if hijo:
+            resultado.extend(etapas(hijo))
+    return resultado
+
+
+def analizar(coleccion, parametros: Dict) -> Dict:
+    """Plan ganador y estadísticas de ejecución de una búsqueda"""
+    filtros = filtros_busqueda(parametros)
+    explicacion = (
+        coleccion.find(filtros, PROYECCION_RESUMEN)
+        .sort(ORDEN_BUSQUEDA)
+        .limit(TAMANO_PAGINA + 1)
+        .explain()
+    )
+    planificador = explicacion["queryPlanner"]
+    # Con el motor SBE (MongoDB 7+) el plan clásico viene dentro de "queryPlan"
+    plan = planificador["winningPlan"].get("queryPlan", planificador["winningPlan"])
+    ejecucion = explicacion.get("executionStats", {})
+
+    nombres = [etapa.get("stage") for etapa in etapas(plan)]
+    indices = [etapa["indexName"] for etapa in etapas(plan) if etapa.get("indexName")]
+    devueltos = ejecucion.get("nReturned", 0)
+    examinados = ejecucion.get("totalDocsExamined", 0)
+
+    alertas = []
+    if "COLLSCAN" in nombres:
+        alertas.append("COLLSCAN")
+    if "SORT" in nombres:
+        alertas.append("SORT en memoria")
+    if examinados > max(devueltos, 1) * MAX_EXAMINADOS_POR_DEVUELTO:
+        alertas.append(f"{examinados} docs examinados para {devueltos}")
+
+    return {
+        "parametros": parametros,
+        "etapas": " → ".join(nombres),
+        "indices": ", ".join(indices) or "-",
+        "claves": ejecucion.get("totalKeysExamined", 0),
+        "documentos": examinados,
+        "devueltos": devueltos,
+        "ms": ejecucion.get("executionTimeMillis", 0),
+        "alertas": alertas,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--consultas", help="JSONL con parámetros de buscar_propiedades (p. ej. sacados de los logs)")
+    args = parser.parse_args()
+
+    consultas = CONSULTAS_REPRESENTATIVAS
+    if args.consultas:
+        with open(args.consultas, encoding="utf-8") as archivo:
+            consultas = [json.loads(linea) for linea in archivo if linea.strip()]
+
+    client = MongoClient(MONGO_URI)
+    coleccion = client[MONGO_DB].propiedades
+    print(f"📊 {coleccion.estimated_document_count()} propiedades; índices: {', '.join(coleccion.index_information())}\n")
+
+    con_collscan = 0
+    for consulta in consultas:
+        resultado = analizar(coleccion, consulta)
+        marca = "⚠️ " if resultado["alertas"] else "✅"
+        print(f"{marca} {json.dumps(resultado['parametros'], ensure_ascii=False)}")
+        print(f"   plan: {resultado['etapas']}  índice: {resultado['indices']}")
+        print(f"   claves={resultado['claves']} docs={resultado['documentos']} "
+              f"devueltos={resultado['devueltos']} {resultado['ms']}ms")
+        if resultado["alertas"]:
+            print(f"   alertas: {'; '.join(resultado['alertas'])}")
+        con_collscan += "COLLSCAN" in resultado["alertas"]
+
+    client.close()
+    if con_collscan:
+        print(f"\n⚠️  {con_collscan} consultas recorren la colección completa: revisar INDICES_BUSQUEDA en catalogo.py")
+        return 1
+    print("\n✅ Ninguna consulta recorre la colección completa")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+"""Benchmarks y scripts de medición (ejecutar con `python -m benchmarks.<nombre>`)"""
@@ -0,0 +1,138 @@
+"""
+Benchmark: arranque de workers y latencia del primer pedido
+Levanta Anthropic y Green API falsos y `gunicorn main:app` en dos
+configuraciones:
+  - perezoso:    sin --preload ni precalentamiento; cada worker importa la
+                 app y abre MongoDB, Anthropic y Green API con el primer
+                 mensaje (como antes de gunicorn.conf.py);
+  - precalentado: --preload y precalentamiento en post_worker_init.
+Para cada una mide el tiempo hasta que los N workers responden /live y, con
+un solo worker, la latencia del primer webhook contra la mediana de los
+siguientes (webhook síncrono, Claude falso con latencia fija).
+
+Requiere MongoDB local. Uso:
+  python -m benchmarks.arranque --workers 4 --repeticiones 3
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+import statistics
+import subprocess
+from typing import Dict
+
+import requests
+
+from benchmarks.capacidad import RAIZ, puerto_libre, sembrar_base
+from benchmarks.carga import BASE_BENCHMARK
+from benchmarks.falsos import crear_servicios, parsear_guion
+
+CONFIGURACIONES = {
+    "perezoso": {"GUNICORN_PRELOAD": "false", "PRECALENTAR": "false"},
+    "precalentado": {"GUNICORN_PRELOAD": "true", "PRECALENTAR": "true"},
+}
+
+
+def webhook(telefono: str) -> Dict:
+    return {
+        "typeWebhook": "incomingMessageReceived",
+        "idMessage": uuid.uuid4().hex.upper(),
+        "senderData": {"chatId": f"{telefono}@c.us", "sender": f"{telefono}@c.us"},
+        "messageData": {"typeMessage": "textMessage",
+                        "textMessageData": {"textMessage": "Busco departamento en alquiler en Rosario"}},
+    }
+
+
+def levantar(entorno: Dict, workers: int, puerto: int) -> subprocess.Popen:
+    comando = ["gunicorn", "main:app", "--workers", str(workers), "--bind", f"127.0.0.1:{puerto}",
+               "--timeout", "120", "--log-level", "warning"]
+    return subprocess.Popen(comando, cwd=RAIZ, env={**os.environ, **entorno},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def medir_arranque(entorno: Dict, workers: int) -> float:
+    """Segundos desde el lanzamiento hasta que los N workers respondieron /live"""
+    puerto = puerto_libre()
+    inicio = time.monotonic()
+    proceso = levantar(entorno, workers, puerto)
+    pids = set()
+    try:
+        while len(pids) < workers:
+            if time.monotonic() - inicio > 60:
+                raise RuntimeError("Los workers no arrancaron en 60s")
+            try:
+                # Conexión nueva por pedido para repartirlos entre workers
+                pids.add(requests.get(f"http://127.0.0.1:{puerto}/live", timeout=1).json()["pid"])
+            except requests.RequestException:
+                time.sleep(0.02)
+        return time.monotonic() - inicio
+    finally:
+        proceso.terminate()
+        proceso.wait(timeout=30)
+
+
+def medir_primer_pedido(entorno: Dict, siguientes: int):
+    """(latencia del primer webhook, mediana de los siguientes) con un worker"""
+    puerto = puerto_libre()
+    proceso = levantar(entorno, 1, puerto)
+    url = f"http://127.0.0.1:{puerto}"
+    try:
+        while True:
+            try:
+                requests.get(f"{url}/live", timeout=1)
+                break
+            except requests.RequestException:
+                time.sleep(0.02)
+        latencias = []
+        for i in range(siguientes + 1):
+            inicio = time.monotonic()
+            requests.post(f"{url}/webhook", json=webhook(f"54934140{i:05d}"), timeout=120).raise_for_status()
+            latencias.append(time.monotonic() - inicio)
+        return latencias[0], statistics.median(latencias[1:])
+    finally:
+        proceso.terminate()
+        proceso.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--siguientes", type=int, default=10, help="pedidos después del primero")
+    parser.add_argument("--latencia-claude", type=float, default=0.2)
+    parser.add_argument("--mongo", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    args = parser.parse_args()
+
+    anthropic, green = crear_servicios(parsear_guion("buscar_propiedades;texto"), args.latencia_claude, 0.0)
+    base = {
+        "ANTHROPIC_API_KEY": "sk-ant-falsa",
+        "ANTHROPIC_BASE_URL": anthropic.url,
+        "GREEN_API_HOST": green.url,
+        "GREEN_API_INSTANCE": "1101000001",
+        "GREEN_API_TOKEN": "token-falso",
+        "GREEN_API_ENVIOS_POR_SEGUNDO": "1000",
+        "GREEN_API_RAFAGA": "1000",
+        "MONGO_URI": args.mongo,
+        "MONGO_DB": BASE_BENCHMARK,
+        "WEBHOOK_ASINCRONO": "false",
+    }
+    sembrar_base(args.mongo)
+
+    print(f"{'configuración':<14} {'arranque ' + str(args.workers) + 'w':>12} {'primer pedido':>14} {'siguientes':>11}")
+    for nombre, variables in CONFIGURACIONES.items():
+        entorno = {**base, **variables}
+        arranques, primeros, siguientes = [], [], []
+        for _ in range(args.repeticiones):
+            arranques.append(medir_arranque(entorno, args.workers))
+            primero, resto = medir_primer_pedido(entorno, args.siguientes)
+            primeros.append(primero)
+            siguientes.append(resto)
+        print(f"{nombre:<14} {statistics.median(arranques) * 1000:>10.0f}ms "
+              f"{statistics.median(primeros) * 1000:>12.0f}ms {statistics.median(siguientes) * 1000:>9.0f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
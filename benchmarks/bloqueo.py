@@ -0,0 +1,142 @@
+"""
+Benchmark: bloqueo por conversación entre procesos (bloqueo.py)
+Simula turnos con la misma forma que procesar_mensaje: leer la conversación,
+"pensar" (la llamada a Claude, un sleep), y escribir el resumen con
+read-modify-write más el mensaje nuevo. Cada worker es un proceso con su
+propio MongoClient, como un worker de gunicorn o una réplica.
+  - mismo teléfono: N procesos golpean una sola conversación, con y sin
+    bloqueo; cuenta turnos perdidos (escrituras pisadas) y turnos que
+    leyeron el mismo estado;
+  - teléfonos distintos: throughput con 1, 2, 4, ... procesos, que con
+    bloqueo debería crecer linealmente.
+
+Requiere MongoDB local. Uso:
+  python -m benchmarks.bloqueo --procesos 8 --turnos 25 --trabajo 0.02
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from datetime import datetime
+from typing import Dict, Optional
+
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+
+from bloqueo import BloqueoConversaciones, filtro_fencing
+
+BASE_BENCHMARK = "benchmark_inmobiliaria"
+
+
+def turno(db, bloqueos, telefono: str, trabajo: float) -> bool:
+    """Un turno simulado; False si el fencing rechazó la escritura"""
+    arrendamiento = bloqueos.adquirir(telefono) if bloqueos else None
+    token = arrendamiento.token if arrendamiento else None
+    try:
+        conversacion = db.conversaciones.find_one({"telefono": telefono}) or {}
+        turnos = conversacion.get("turnos", 0)
+        time.sleep(trabajo)
+
+        actualizacion = {"$set": {"turnos": turnos + 1, "ultima_actualizacion": datetime.now()}}
+        if token is not None:
+            actualizacion["$set"]["token_bloqueo"] = token
+        try:
+            db.conversaciones.update_one(filtro_fencing(telefono, token), actualizacion, upsert=True)
+        except DuplicateKeyError:
+            return False
+        db.mensajes.insert_one({"telefono": telefono, "ts": datetime.now(), "visto": turnos, "role": "user"})
+        return True
+    finally:
+        if arrendamiento is not None:
+            bloqueos.liberar(arrendamiento)
+
+
+def worker(mongo: str, telefono: str, turnos: int, trabajo: float, con_bloqueo: bool) -> Dict:
+    """Proceso que corre `turnos` turnos seguidos sobre un teléfono"""
+    client = MongoClient(mongo)
+    db = client[BASE_BENCHMARK]
+    bloqueos = BloqueoConversaciones(db.bloqueos, db.conversaciones, duracion=30, espera_max=120) if con_bloqueo else None
+    rechazados = 0
+    inicio = time.monotonic()
+    for _ in range(turnos):
+        rechazados += not turno(db, bloqueos, telefono, trabajo)
+    duracion = time.monotonic() - inicio
+    client.close()
+    return {"rechazados": rechazados, "segundos": duracion,
+            "bloqueo": bloqueos.estadisticas() if bloqueos else None}
+
+
+def limpiar(mongo: str):
+    """Base de benchmark vacía, con los índices que usa el bloqueo"""
+    client = MongoClient(mongo)
+    db = client[BASE_BENCHMARK]
+    for coleccion in ("conversaciones", "mensajes", "bloqueos"):
+        db[coleccion].drop()
+    BloqueoConversaciones(db.bloqueos, db.conversaciones).crear_indices()
+    client.close()
+
+
+def correr(args, procesos: int, telefono: Optional[str], con_bloqueo: bool) -> Dict:
+    """Corre `procesos` workers en paralelo; con `telefono` todos usan el mismo"""
+    limpiar(args.mongo)
+    contexto = multiprocessing.get_context("spawn")
+    with contexto.Pool(procesos) as pool:
+        resultados = pool.starmap(worker, [
+            (args.mongo, telefono or f"5493410{i:06d}", args.turnos, args.trabajo, con_bloqueo)
+            for i in range(procesos)
+        ])
+    # Sin contar el arranque de los procesos: el más lento marca la duración
+    duracion = max(r["segundos"] for r in resultados)
+
+    db = MongoClient(args.mongo)[BASE_BENCHMARK]
+    intentados = procesos * args.turnos
+    guardados = sum(c.get("turnos", 0) for c in db.conversaciones.find({}, {"turnos": 1}))
+    mensajes = db.mensajes.count_documents({})
+    # Dos turnos que leyeron el mismo estado de una conversación: uno no vio al otro
+    repetidos = mensajes - len(list(db.mensajes.aggregate([
+        {"$group": {"_id": {"telefono": "$telefono", "visto": "$visto"}}}
+    ])))
+    return {
+        "procesos": procesos,
+        "intentados": intentados,
+        "guardados": guardados,
+        "perdidos": mensajes - guardados,
+        "mismo_estado": repetidos,
+        "rechazados": sum(r["rechazados"] for r in resultados),
+        "turnos_por_segundo": intentados / duracion,
+        "espera_media_ms": (sum(r["bloqueo"]["espera_media_ms"] for r in resultados) / procesos
+                            if con_bloqueo else 0.0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--procesos", type=int, default=8, help="workers contra el mismo teléfono")
+    parser.add_argument("--turnos", type=int, default=25, help="turnos por worker")
+    parser.add_argument("--trabajo", type=float, default=0.02, help="segundos de 'llamada a Claude' por turno")
+    parser.add_argument("--mongo", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    args = parser.parse_args()
+
+    print(f"Mismo teléfono, {args.procesos} procesos × {args.turnos} turnos:")
+    print(f"{'modo':<12} {'intentados':>10} {'guardados':>10} {'perdidos':>9} {'mismo estado':>13} "
+          f"{'rechazados':>11} {'turnos/s':>9}")
+    for con_bloqueo in (False, True):
+        r = correr(args, args.procesos, "5493411111111", con_bloqueo)
+        print(f"{'con bloqueo' if con_bloqueo else 'sin bloqueo':<12} {r['intentados']:>10} {r['guardados']:>10} "
+              f"{r['perdidos']:>9} {r['mismo_estado']:>13} {r['rechazados']:>11} {r['turnos_por_segundo']:>9.1f}")
+
+    print(f"\nTeléfonos distintos, con bloqueo:")
+    print(f"{'procesos':>8} {'turnos/s':>9} {'por proceso':>12} {'espera lease':>13} {'perdidos':>9}")
+    procesos = 1
+    while procesos <= args.procesos:
+        r = correr(args, procesos, None, True)
+        print(f"{procesos:>8} {r['turnos_por_segundo']:>9.1f} {r['turnos_por_segundo'] / procesos:>12.1f} "
+              f"{r['espera_media_ms']:>11.1f}ms {r['perdidos']:>9}")
+        procesos *= 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Benchmark: conversaciones simultáneas por GB de RAM, servidor síncrono vs asíncrono
+Levanta Anthropic y Green API falsos (benchmarks/falsos.py) y, en un
+subproceso, la app como se despliega:
+  - sincrono:  gunicorn main:app con N workers sync (el Procfile actual)
+  - asincrono: uvicorn main_async:app en un solo proceso
+Luego mantiene C conversaciones a la vez (un teléfono por cliente, webhook
+síncrono: cada request espera la respuesta) y mide cuántas llamadas a Claude
+llegan a estar en vuelo, el throughput y la memoria (PSS del árbol de
+procesos del servidor, que no cuenta dos veces lo compartido tras el fork).
+
+Requiere MongoDB local (los dos servidores corren en otros procesos) y Linux
+(lee /proc).
+
+Uso:
+  python -m benchmarks.capacidad --modo sincrono --workers 4 --clientes 200
+  python -m benchmarks.capacidad --modo asincrono --clientes 200
+  python -m benchmarks.capacidad --modo ambos --clientes 300 --latencia-claude 3
+"""
+
+import os
+import sys
+import time
+import uuid
+import socket
+import argparse
+import threading
+import subprocess
+from typing import Dict, List
+
+import requests
+from pymongo import MongoClient
+
+from benchmarks.carga import BASE_BENCHMARK, percentiles
+from benchmarks.falsos import crear_servicios, parsear_guion
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def puerto_libre() -> int:
+    """Puerto TCP libre en localhost"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def memoria_kb(pid: int) -> int:
+    """PSS (o RSS si no hay smaps_rollup) de un proceso, en KB"""
+    for ruta, campo in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+        try:
+            with open(ruta) as archivo:
+                for linea in archivo:
+                    if linea.startswith(campo):
+                        return int(linea.split()[1])
+        except OSError:
+            continue
+    return 0
+
+
+def arbol(pid: int) -> List[int]:
+    """El proceso y todos sus descendientes"""
+    hijos: Dict[int, List[int]] = {}
+    for entrada in os.listdir("/proc"):
+        if not entrada.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entrada}/stat") as archivo:
+                ppid = int(archivo.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        hijos.setdefault(ppid, []).append(int(entrada))
+    resultado, pendientes = [], [pid]
+    while pendientes:
+        actual = pendientes.pop()
+        resultado.append(actual)
+        pendientes.extend(hijos.get(actual, []))
+    return resultado
+
+
+def sembrar_base(mongo_uri: str):
+    """Base de benchmark limpia con el catálogo de ejemplo"""
+    from cache import incrementar_version_catalogo
+    from catalogo import campos_ubicacion
+    from init_db import PROPIEDADES_EJEMPLO
+
+    db = MongoClient(mongo_uri)[BASE_BENCHMARK]
+    for coleccion in ("propiedades", "conversaciones", "mensajes", "webhooks_procesados", "clientes", "visitas"):
+        db[coleccion].delete_many({})
+    db.propiedades.insert_many([{**prop, **campos_ubicacion(prop["ubicacion"])} for prop in PROPIEDADES_EJEMPLO])
+    incrementar_version_catalogo(db.meta)
+
+
+def levantar_servidor(modo: str, workers: int, puerto: int, entorno: Dict) -> subprocess.Popen:
+    """Arranca el servidor en un subproceso y espera a que responda"""
+    if modo == "sincrono":
+        comando = ["gunicorn", "main:app", "--workers", str(workers), "--bind", f"127.0.0.1:{puerto}",
+                   "--timeout", "300", "--log-level", "warning"]
+    else:
+        comando = ["uvicorn", "main_async:app", "--host", "127.0.0.1", "--port", str(puerto),
+                   "--log-level", "warning"]
+    proceso = subprocess.Popen(comando, cwd=RAIZ, env={**os.environ, **entorno},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        try:
+            requests.get(f"http://127.0.0.1:{puerto}/", timeout=1)
+            return proceso
+        except requests.RequestException:
+            time.sleep(0.3)
+    proceso.kill()
+    raise RuntimeError(f"El servidor {modo} no arrancó")
+
+
+def medir(modo: str, args, anthropic) -> Dict:
+    """Corre C clientes concurrentes contra un servidor y devuelve las mediciones"""
+    puerto = puerto_libre()
+    entorno = {
+        "ANTHROPIC_API_KEY": "sk-ant-falsa",
+        "ANTHROPIC_BASE_URL": anthropic.url,
+        "GREEN_API_HOST": args.url_green,
+        "GREEN_API_INSTANCE": "1101000001",
+        "GREEN_API_TOKEN": "token-falso",
+        "GREEN_API_ENVIOS_POR_SEGUNDO": "1000",
+        "GREEN_API_RAFAGA": "1000",
+        "MONGO_URI": args.mongo,
+        "MONGO_DB": BASE_BENCHMARK,
+        "WEBHOOK_ASINCRONO": "false",
+    }
+    sembrar_base(args.mongo)
+    proceso = levantar_servidor(modo, args.workers, puerto, entorno)
+    url = f"http://127.0.0.1:{puerto}/webhook"
+
+    memoria_base = sum(memoria_kb(pid) for pid in arbol(proceso.pid))
+    anthropic.max_en_vuelo = 0
+    latencias: List[float] = []
+    errores = [0]
+    lock = threading.Lock()
+    fin = time.monotonic() + args.duracion
+    pico = [memoria_base]
+
+    def cliente(indice: int):
+        session = requests.Session()
+        telefono = f"54934130{indice:05d}"
+        while time.monotonic() < fin:
+            payload = {
+                "typeWebhook": "incomingMessageReceived",
+                "idMessage": uuid.uuid4().hex.upper(),
+                "senderData": {"chatId": f"{telefono}@c.us", "sender": f"{telefono}@c.us"},
+                "messageData": {"typeMessage": "textMessage",
+                                "textMessageData": {"textMessage": "Busco departamento en alquiler en Rosario"}},
+            }
+            inicio = time.monotonic()
+            try:
+                ok = session.post(url, json=payload, timeout=600).status_code == 200
+            except requests.RequestException:
+                ok = False
+            with lock:
+                if ok:
+                    latencias.append(time.monotonic() - inicio)
+                else:
+                    errores[0] += 1
+
+    def muestrear():
+        while time.monotonic() < fin:
+            pico[0] = max(pico[0], sum(memoria_kb(pid) for pid in arbol(proceso.pid)))
+            time.sleep(0.5)
+
+    hilos = [threading.Thread(target=cliente, args=(i,), daemon=True) for i in range(args.clientes)]
+    hilos.append(threading.Thread(target=muestrear, daemon=True))
+    inicio = time.monotonic()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.monotonic() - inicio
+
+    proceso.terminate()
+    proceso.wait(timeout=30)
+
+    en_vuelo = anthropic.max_en_vuelo
+    gb = pico[0] / (1024 * 1024)
+    return {
+        "modo": modo,
+        "procesos": args.workers + 1 if modo == "sincrono" else 1,
+        "turnos": len(latencias),
+        "errores": errores[0],
+        "turnos_por_segundo": len(latencias) / duracion,
+        "latencia": percentiles(latencias),
+        "claude_en_vuelo": en_vuelo,
+        "memoria_base_mb": memoria_base / 1024,
+        "memoria_pico_mb": pico[0] / 1024,
+        "conversaciones_por_gb": en_vuelo / gb if gb else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modo", choices=["sincrono", "asincrono", "ambos"], default="ambos")
+    parser.add_argument("--workers", type=int, default=4, help="workers de gunicorn en modo síncrono")
+    parser.add_argument("--clientes", type=int, default=200, help="conversaciones simultáneas ofrecidas")
+    parser.add_argument("--duracion", type=float, default=30.0, help="segundos de carga por modo")
+    parser.add_argument("--latencia-claude", type=float, default=2.0, help="segundos por llamada a Claude")
+    parser.add_argument("--guion", default="buscar_propiedades;texto",
+                        help="pasos del tool loop separados por ';'")
+    parser.add_argument("--mongo", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    args = parser.parse_args()
+
+    anthropic, green = crear_servicios(parsear_guion(args.guion), args.latencia_claude, 0.02)
+    args.url_green = green.url
+
+    modos = ["sincrono", "asincrono"] if args.modo == "ambos" else [args.modo]
+    resultados = []
+    for modo in modos:
+        print(f"Midiendo {modo} con {args.clientes} conversaciones simultáneas durante {args.duracion:g}s ...")
+        resultados.append(medir(modo, args, anthropic))
+
+    print(f"\n{'modo':<10} {'procesos':>8} {'en vuelo':>9} {'turnos/s':>9} {'RAM pico':>9} {'conv/GB':>8}  latencia")
+    for r in resultados:
+        print(f"{r['modo']:<10} {r['procesos']:>8} {r['claude_en_vuelo']:>9} {r['turnos_por_segundo']:>9.2f} "
+              f"{r['memoria_pico_mb']:>7.0f}MB {r['conversaciones_por_gb']:>8.0f}  {r['latencia']}"
+              + (f"  errores={r['errores']}" if r["errores"] else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""
+Prueba de carga sin red: el bot completo contra servicios falsos
+Levanta Anthropic y Green API falsos (benchmarks/falsos.py), corre la app
+Flask en este proceso contra una base MongoDB local (o en memoria con
+mongomock) y reproduce webhooks a una tasa fija. Reporta latencias p50/p95/p99
+de recepción y de punta a punta (webhook → primer mensaje en Green API),
+throughput y un desglose por etapa.
+
+Las variables de entorno de la app (WEBHOOK_ASINCRONO, COLA_VENTANA_FUSION,
+STREAMING_RESPUESTAS, ...) se respetan, así que cada modo se puede medir.
+
+mongomock no evalúa el filtro de ubicación (`$all` con regex): con --mongo
+memoria las búsquedas guionadas van sin `ubicacion`, así devuelven filas
+reales, y sus tiempos no incluyen ese filtro. Antes de la carga se verifica
+que la búsqueda guionada encuentre propiedades en el catálogo sembrado.
+
+Uso:
+  python -m benchmarks.carga --rps 5 --duracion 30 --telefonos 40
+  python -m benchmarks.carga --mongo memoria --latencia-claude 0.5 \\
+      --guion "buscar_propiedades+buscar_propiedades;obtener_detalle_propiedad;texto"
+  python -m benchmarks.carga --url http://127.0.0.1:5000   # app ya levantada
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+
+from benchmarks.falsos import ENTRADAS_HERRAMIENTAS, crear_servicios, parsear_guion
+
+RUTA_WEBHOOKS = os.path.join(os.path.dirname(__file__), "webhooks_ejemplo.jsonl")
+BASE_BENCHMARK = "benchmark_inmobiliaria"
+
+# Búsqueda guionada con mongomock, que no evalúa `ubicacion_tokens: {"$all": [regex]}`
+BUSQUEDA_MEMORIA = {
+    k: v for k, v in ENTRADAS_HERRAMIENTAS["buscar_propiedades"].items() if k != "ubicacion"
+}
+
+
+def percentiles(muestras: List[float]) -> str:
+    """p50/p95/p99 en milisegundos"""
+    if not muestras:
+        return "sin datos"
+    ordenadas = sorted(muestras)
+
+    def p(q):
+        return ordenadas[min(len(ordenadas) - 1, int(q / 100 * len(ordenadas)))] * 1000
+
+    return f"p50={p(50):.0f}ms p95={p(95):.0f}ms p99={p(99):.0f}ms (n={len(ordenadas)})"
+
+
+def cargar_plantillas(ruta: str) -> List[Dict]:
+    """Webhooks de ejemplo a reproducir"""
+    with open(ruta, encoding="utf-8") as archivo:
+        return [json.loads(linea) for linea in archivo if linea.strip()]
+
+
+def entradas_guion(args) -> Dict:
+    """Entradas de herramientas que usa el Anthropic falso según la base"""
+    if args.mongo == "memoria":
+        return {"buscar_propiedades": BUSQUEDA_MEMORIA}
+    return {}
+
+
+def preparar_app(args, url_anthropic: str, url_green: str) -> str:
+    """Configura el entorno, importa la app y la sirve en un hilo; devuelve su URL"""
+    os.environ.update({
+        "ANTHROPIC_API_KEY": "sk-ant-falsa",
+        "ANTHROPIC_BASE_URL": url_anthropic,
+        "GREEN_API_HOST": url_green,
+        "GREEN_API_INSTANCE": "1101000001",
+        "GREEN_API_TOKEN": "token-falso",
+        "MONGO_DB": BASE_BENCHMARK,
+    })
+    # Sin cuota real que respetar: el límite de envío no debe ser el cuello de botella
+    os.environ.setdefault("GREEN_API_ENVIOS_POR_SEGUNDO", "1000")
+    os.environ.setdefault("GREEN_API_RAFAGA", "1000")
+
+    if args.mongo == "memoria":
+        import mongomock
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+        os.environ["MONGO_URI"] = "mongodb://memoria"
+    else:
+        os.environ["MONGO_URI"] = args.mongo
+
+    import main
+    from cache import incrementar_version_catalogo
+    from catalogo import campos_ubicacion, filtros_busqueda
+    from init_db import PROPIEDADES_EJEMPLO
+
+    # Base de benchmark limpia y con el catálogo de ejemplo
+    for coleccion in ("propiedades", "conversaciones", "mensajes", "webhooks_procesados", "clientes", "visitas"):
+        main.db[coleccion].delete_many({})
+    main.propiedades_col.insert_many([
+        {**prop, **campos_ubicacion(prop["ubicacion"])} for prop in PROPIEDADES_EJEMPLO
+    ])
+    incrementar_version_catalogo(main.meta_col)
+
+    # Sin filas, los tiempos y la caché de búsqueda medirían páginas vacías
+    busqueda = entradas_guion(args).get("buscar_propiedades", ENTRADAS_HERRAMIENTAS["buscar_propiedades"])
+    if not main.propiedades_col.count_documents(filtros_busqueda(busqueda)):
+        raise SystemExit(f"La búsqueda guionada {busqueda} no encuentra propiedades en {args.mongo}")
+
+    from werkzeug.serving import make_server
+    servidor = make_server("127.0.0.1", 0, main.app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{servidor.server_port}"
+
+
+def generar_carga(url: str, plantillas: List[Dict], rps: float, duracion: float, telefonos: int):
+    """Envía webhooks a tasa fija (lazo abierto) y registra cada envío"""
+    sesiones = threading.local()
+    envios = []
+    lock = threading.Lock()
+
+    def enviar(indice: int, programado: float):
+        plantilla = plantillas[indice % len(plantillas)]
+        telefono = f"54934120{indice % telefonos:05d}"
+        payload = {
+            **plantilla,
+            "idMessage": uuid.uuid4().hex.upper(),
+            "timestamp": int(time.time()),
+            "senderData": {**plantilla["senderData"], "chatId": f"{telefono}@c.us", "sender": f"{telefono}@c.us"},
+        }
+        if not hasattr(sesiones, "session"):
+            sesiones.session = requests.Session()
+        inicio = time.monotonic()
+        try:
+            estado = sesiones.session.post(f"{url}/webhook", json=payload, timeout=120).status_code
+        except requests.RequestException:
+            estado = 0
+        with lock:
+            envios.append({
+                "telefono": telefono,
+                "enviado": inicio,
+                "retraso": inicio - programado,
+                "recepcion": time.monotonic() - inicio,
+                "estado": estado,
+            })
+
+    total = int(rps * duracion)
+    inicio = time.monotonic()
+    with ThreadPoolExecutor(max_workers=256) as ejecutor:
+        for i in range(total):
+            programado = inicio + i / rps
+            espera = programado - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            ejecutor.submit(enviar, i, programado)
+    return envios, inicio
+
+
+def esperar_respuestas(green, envios: List[Dict], timeout: float):
+    """Espera a que cada teléfono haya recibido al menos una respuesta posterior a su último envío"""
+    ultimos = {}
+    for envio in envios:
+        ultimos[envio["telefono"]] = max(ultimos.get(envio["telefono"], 0), envio["enviado"])
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        respondidos = {e["telefono"] for e in green.enviados_desde(0) if e["instante"] >= ultimos.get(e["telefono"], 0)}
+        if len(respondidos) >= len(ultimos):
+            return
+        time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=5.0, help="webhooks por segundo")
+    parser.add_argument("--duracion", type=float, default=30.0, help="segundos de carga")
+    parser.add_argument("--telefonos", type=int, default=40, help="teléfonos distintos")
+    parser.add_argument("--webhooks", default=RUTA_WEBHOOKS, help="JSONL con webhooks de ejemplo")
+    parser.add_argument("--mongo", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+                        help="URI de MongoDB local, o 'memoria' para usar mongomock")
+    parser.add_argument("--url", help="URL de una app ya levantada (apuntada a estos servicios falsos)")
+    parser.add_argument("--puerto-anthropic", type=int, default=0, help="puerto fijo (útil con --url)")
+    parser.add_argument("--puerto-green", type=int, default=0, help="puerto fijo (útil con --url)")
+    parser.add_argument("--latencia-claude", type=float, default=0.8, help="segundos por llamada a Claude")
+    parser.add_argument("--latencia-green", type=float, default=0.05)
+    parser.add_argument("--error-green", type=float, default=0.0, help="proporción de envíos con 500")
+    parser.add_argument("--guion", default="buscar_propiedades;obtener_detalle_propiedad;texto",
+                        help="pasos del tool loop separados por ';', herramientas paralelas con '+'")
+    parser.add_argument("--espera", type=float, default=120.0, help="segundos para drenar respuestas")
+    args = parser.parse_args()
+
+    anthropic, green = crear_servicios(
+        parsear_guion(args.guion), args.latencia_claude, args.latencia_green, args.error_green,
+        args.puerto_anthropic, args.puerto_green, entradas_guion(args)
+    )
+    print(f"Anthropic falso: {anthropic.url}  Green API falso: {green.url}")
+    if args.mongo == "memoria":
+        print(f"Aviso: con mongomock las búsquedas van sin filtro de ubicación ({BUSQUEDA_MEMORIA})")
+
+    url = args.url or preparar_app(args, anthropic.url, green.url)
+    plantillas = cargar_plantillas(args.webhooks)
+
+    print(f"Enviando {int(args.rps * args.duracion)} webhooks a {args.rps:g} rps contra {url} ...")
+    envios, inicio = generar_carga(url, plantillas, args.rps, args.duracion, args.telefonos)
+    fin_carga = time.monotonic()
+    esperar_respuestas(green, envios, args.espera)
+    fin = time.monotonic()
+
+    # Punta a punta: del webhook al primer mensaje saliente posterior para ese teléfono
+    respuestas = defaultdict(list)
+    for enviado in green.enviados_desde(0):
+        respuestas[enviado["telefono"]].append(enviado["instante"])
+    punta_a_punta = []
+    sin_respuesta = 0
+    for envio in envios:
+        posteriores = [t for t in respuestas[envio["telefono"]] if t >= envio["enviado"]]
+        if posteriores:
+            punta_a_punta.append(min(posteriores) - envio["enviado"])
+        else:
+            sin_respuesta += 1
+
+    estados = defaultdict(int)
+    for envio in envios:
+        estados[envio["estado"]] += 1
+    enviados = green.enviados_desde(0)
+
+    print("\nResultados")
+    print(f"  webhooks:           {len(envios)} en {fin_carga - inicio:.1f}s, estados HTTP {dict(estados)}")
+    print(f"  retraso del emisor: {percentiles([e['retraso'] for e in envios])}")
+    print(f"  recepción webhook:  {percentiles([e['recepcion'] for e in envios])}")
+    print(f"  punta a punta:      {percentiles(punta_a_punta)}  sin respuesta: {sin_respuesta}")
+    print(f"  throughput:         {len(envios) / (fin_carga - inicio):.2f} webhooks/s, "
+          f"{len(enviados) / (fin - inicio):.2f} mensajes salientes/s")
+
+    llamadas = anthropic.llamadas
+    print("\nDesglose por etapa")
+    print(f"  Claude:    {len(llamadas)} llamadas, {percentiles([l['duracion'] for l in llamadas])}")
+    print(f"  Green API: {len(enviados)} mensajes, {green.escribiendo} 'escribiendo', {green.errores} errores simulados")
+    try:
+        stats = requests.get(f"{url}/stats", timeout=5).json()
+        print(f"  App /stats: {json.dumps(stats, ensure_ascii=False)}")
+    except (requests.RequestException, ValueError):
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
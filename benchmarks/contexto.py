@@ -0,0 +1,61 @@
+"""
+Benchmark: tamaño del request a Claude a medida que crece una conversación
+Compara el historial completo (comportamiento anterior) contra la ventana
+acotada de GestorContexto. No usa red: el resumidor es un stub local.
+
+Uso: python -m benchmarks.contexto [turnos]
+"""
+
+import sys
+import json
+
+from contexto import GestorContexto, estimar_tokens
+
+
+def resumidor_local(resumen_previo: str, transcripcion: str) -> str:
+    """Resumen simulado de tamaño acotado (como el de Claude)"""
+    return (resumen_previo + "\n" + transcripcion)[-1200:]
+
+
+def simular_turno(n: int):
+    """Mensajes de un turno típico: pregunta, búsqueda, resultado y respuesta"""
+    propiedades = [
+        {"_id": f"{n:06d}{i:018d}", "titulo": "Departamento moderno en el centro",
+         "precio": 750 + i, "ubicacion": "Centro, Rosario",
+         "descripcion": "Excelente departamento de 2 dormitorios en pleno centro. " * 3}
+        for i in range(8)
+    ]
+    return [
+        {"role": "user", "content": f"Busco un departamento en alquiler, consulta {n}"},
+        {"role": "assistant", "content": [
+            {"type": "tool_use", "id": f"tool_{n}", "name": "buscar_propiedades",
+             "input": {"tipo": "departamento", "operacion": "alquiler"}},
+        ]},
+        {"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": f"tool_{n}",
+             "content": json.dumps({"success": True, "propiedades": propiedades}, ensure_ascii=False)},
+        ]},
+        {"role": "assistant", "content": "Encontré estas opciones para vos. " * 12},
+    ]
+
+
+def main():
+    turnos = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    gestor = GestorContexto(resumidor_local)
+
+    historial, resumen = [], ""
+    total = 0
+    print(f"{'turno':>6} {'historial completo':>20} {'ventana acotada':>17}")
+    for n in range(1, turnos + 1):
+        turno = simular_turno(n)
+        historial.append(turno[0])
+        total += estimar_tokens(turno)
+        mensajes, resumen, plegados = gestor.construir(historial, resumen)
+        del historial[:plegados]
+        if n == 1 or n % 10 == 0:
+            print(f"{n:>6} {total:>20} {estimar_tokens(mensajes):>17}")
+        historial.extend(turno[1:])
+
+
+if __name__ == "__main__":
+    main()
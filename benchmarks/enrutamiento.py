@@ -0,0 +1,85 @@
+"""
+Benchmark: enrutamiento de modelos (enrutador.py)
+Clasifica los mensajes de webhooks_ejemplo.jsonl más un conjunto de consultas
+complejas y estima el costo por turno con ruteo contra usar siempre el modelo
+grande. Los tokens por turno son un perfil típico (system y herramientas
+cacheados, una búsqueda por turno simple); el costo real sale de
+agente_costo_usd_total en /metrics. No usa red.
+
+Uso: python -m benchmarks.enrutamiento [repeticiones]
+"""
+
+import os
+import sys
+import json
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from enrutador import Enrutador, clasificar, costo
+
+MODELO_CHICO = "claude-3-5-haiku-20241022"
+MODELO_GRANDE = "claude-sonnet-4-20250514"
+
+CONSULTAS_COMPLEJAS = [
+    "¿Qué diferencia hay entre la casa de Funes y el depto de Fisherton?",
+    "¿Cuál me conviene para invertir y alquilar después?",
+    "Comparame los dos departamentos del centro, ¿cuál tiene mejores expensas?",
+    "¿Aceptan crédito hipotecario? ¿Cuánto sería la cuota aproximada?",
+]
+
+# Perfil de tokens por llamada: (input sin caché, lectura de caché, output) y llamadas por turno
+PERFILES = {
+    "saludo": ((150, 2500, 60), 1),
+    "simple": ((900, 2500, 250), 2),
+    "compleja": ((1800, 2500, 600), 3),
+}
+
+
+def mensajes_ejemplo():
+    ruta = os.path.join(os.path.dirname(__file__), "webhooks_ejemplo.jsonl")
+    with open(ruta, encoding="utf-8") as archivo:
+        for linea in archivo:
+            yield json.loads(linea)["messageData"]["textMessageData"]["textMessage"]
+    yield from CONSULTAS_COMPLEJAS
+
+
+def costo_turno(modelo: str, clase: str) -> float:
+    (entrada, lectura, salida), llamadas = PERFILES[clase]
+    usage = SimpleNamespace(input_tokens=entrada, output_tokens=salida,
+                            cache_read_input_tokens=lectura, cache_creation_input_tokens=0)
+    return costo(modelo, usage) * llamadas
+
+
+def main():
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    mensajes = list(mensajes_ejemplo())
+    enrutador = Enrutador(MODELO_CHICO, MODELO_GRANDE)
+
+    print(f"{'ruta':<9} {'modelo':<27} {'tokens':>6}  mensaje")
+    for texto in mensajes:
+        ruta = enrutador.elegir(texto)
+        print(f"{ruta.nombre:<9} {ruta.modelo:<27} {ruta.max_tokens:>6}  {texto}")
+
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for texto in mensajes:
+            clasificar(texto)
+    duracion = time.perf_counter() - inicio
+    print(f"\nClasificación: {duracion / (repeticiones * len(mensajes)) * 1e6:.1f} µs por mensaje")
+
+    clases = Counter(clasificar(texto) for texto in mensajes)
+    con_ruteo = sum(
+        costo_turno(MODELO_GRANDE if clase == "compleja" else MODELO_CHICO, clase) * n
+        for clase, n in clases.items()
+    )
+    sin_ruteo = sum(costo_turno(MODELO_GRANDE, clase) * n for clase, n in clases.items())
+    print(f"Rutas: {dict(clases)}")
+    print(f"Costo estimado por 1000 turnos: siempre {MODELO_GRANDE} US${sin_ruteo / len(mensajes) * 1000:.2f}, "
+          f"con ruteo US${con_ruteo / len(mensajes) * 1000:.2f} ({1 - con_ruteo / sin_ruteo:.0%} menos, "
+          f"sin contar escaladas)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Benchmark: escritura diferida de leads, visitas y mensajes (escritura.py)
+Simula las escrituras de N turnos concurrentes con la forma de _procesar:
+guardar_lead (siempre) y agendar_visita (uno de cada tres turnos) en el tool
+loop, la llamada a Claude que sigue (un sleep) y el guardado: update_one de
+la conversación y los mensajes del turno. Compara:
+  - directo:  insert_one por herramienta e insert_many (como antes);
+  - turno:    todo encolado y un vaciado antes de responder (ESCRITURA_MODO=turno);
+  - diferida: todo en segundo plano (ESCRITURA_MODO=diferida).
+Reporta idas y vueltas a MongoDB antes de responder por turno, bulk_write
+totales, tiempo que el turno pasó escribiendo (sin contar Claude) y leads por
+teléfono.
+
+Con --mongo memoria usa mongomock y --latencia-mongo como costo de cada ida y
+vuelta. Uso:
+  python -m benchmarks.escritura --turnos 400 --hilos 16
+  python -m benchmarks.escritura --mongo memoria --latencia-mongo 0.002
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Tuple
+
+from bson.objectid import ObjectId
+from pymongo import InsertOne, MongoClient
+
+from benchmarks.carga import BASE_BENCHMARK
+from escritura import EscrituraDiferida, crear_indice_leads, operacion_lead
+
+ESCRITURAS = {"insert_one", "insert_many", "update_one", "bulk_write"}
+
+
+class ColeccionMedida:
+    """Colección que cuenta (por hilo) cada ida y vuelta de escritura y le suma latencia"""
+
+    def __init__(self, coleccion, latencia: float, contador: threading.local):
+        self._coleccion = coleccion
+        self._latencia = latencia
+        self._contador = contador
+        self.name = coleccion.name
+
+    def __getattr__(self, atributo: str):
+        metodo = getattr(self._coleccion, atributo)
+        if atributo not in ESCRITURAS:
+            return metodo
+
+        def medido(*args, **kwargs):
+            self._contador.idas = getattr(self._contador, "idas", 0) + 1
+            if self._latencia:
+                time.sleep(self._latencia)
+            return metodo(*args, **kwargs)
+        return medido
+
+
+def turno(modo: str, cols: Dict, escritura: EscrituraDiferida, telefono: str, numero: int,
+          contador, claude: float) -> Tuple[int, float]:
+    """Escrituras de un turno; devuelve (idas y vueltas antes de responder, segundos escribiendo)"""
+    contador.idas = 0
+    inicio = time.perf_counter()
+    lead = operacion_lead({"nombre": f"Cliente {telefono}", "telefono": telefono, "email": f"{telefono}@mail.com"})
+    visita = {"_id": ObjectId(), "telefono": telefono, "propiedad_id": "p1", "estado": "pendiente"}
+    con_visita = numero % 3 == 0
+    encoladas = []
+    if modo == "directo":
+        # Lo que hacía la versión anterior: insert_one por lead, sin upsert
+        cols["clientes"].insert_one({"nombre": f"Cliente {telefono}", "telefono": telefono})
+        if con_visita:
+            cols["visitas"].insert_one(visita)
+    else:
+        encoladas += escritura.agregar(cols["clientes"], lead)
+        if con_visita:
+            encoladas += escritura.agregar(cols["visitas"], InsertOne(visita))
+    escribiendo = time.perf_counter() - inicio
+
+    time.sleep(claude)
+
+    inicio = time.perf_counter()
+    ahora = datetime.now()
+    cols["conversaciones"].update_one({"telefono": telefono}, {"$inc": {"mensajes": 4}}, upsert=True)
+    documentos = [
+        {"telefono": telefono, "ts": ahora + timedelta(milliseconds=i), "role": "user", "content": "hola"}
+        for i in range(4)
+    ]
+    if modo == "directo":
+        cols["mensajes"].insert_many(documentos)
+    else:
+        encoladas += escritura.agregar(cols["mensajes"], *(InsertOne(documento) for documento in documentos))
+        if modo == "turno":
+            escritura.vaciar(encoladas)
+    return contador.idas, escribiendo + time.perf_counter() - inicio
+
+
+def correr(modo: str, db, args) -> Dict:
+    for nombre in ("clientes", "visitas", "conversaciones", "mensajes"):
+        db[nombre].drop()
+    if modo != "directo":
+        crear_indice_leads(db["clientes"])
+    contador = threading.local()
+    cols = {nombre: ColeccionMedida(db[nombre], args.latencia_mongo, contador)
+            for nombre in ("clientes", "visitas", "conversaciones", "mensajes")}
+    escritura = EscrituraDiferida(intervalo=args.intervalo)
+    telefonos = [f"549341{i:07d}" for i in range(args.telefonos)]
+    idas, duraciones = [], []
+    lock = threading.Lock()
+    siguiente = iter(range(args.turnos))
+
+    def hilo():
+        while True:
+            with lock:
+                numero = next(siguiente, None)
+            if numero is None:
+                return
+            hechas, duracion = turno(modo, cols, escritura, random.choice(telefonos), numero, contador, args.claude)
+            with lock:
+                idas.append(hechas)
+                duraciones.append(duracion)
+
+    inicio = time.perf_counter()
+    hilos = [threading.Thread(target=hilo) for _ in range(args.hilos)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    total = time.perf_counter() - inicio
+    escritura.detener()
+
+    duraciones.sort()
+    estadisticas = escritura.estadisticas()
+    return {
+        "idas": statistics.mean(idas),
+        "bulk_writes": estadisticas["bulk_writes"],
+        "compartidos": estadisticas["vaciados_compartidos"],
+        "p50": duraciones[len(duraciones) // 2] * 1000,
+        "p95": duraciones[int(len(duraciones) * 0.95)] * 1000,
+        "turnos_s": args.turnos / total,
+        "leads_por_telefono": db["clientes"].count_documents({}) / len(set(db["clientes"].distinct("telefono"))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turnos", type=int, default=400)
+    parser.add_argument("--hilos", type=int, default=16, help="turnos concurrentes (COLA_WORKERS)")
+    parser.add_argument("--telefonos", type=int, default=50)
+    parser.add_argument("--intervalo", type=float, default=0.5, help="ESCRITURA_INTERVALO")
+    parser.add_argument("--claude", type=float, default=0.8, help="segundos de la llamada a Claude después de las herramientas")
+    parser.add_argument("--latencia-mongo", type=float, default=0.0, help="segundos extra por ida y vuelta")
+    parser.add_argument("--mongo", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+                        help="URI de MongoDB local, o 'memoria' para usar mongomock")
+    args = parser.parse_args()
+
+    if args.mongo == "memoria":
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        client = MongoClient(args.mongo)
+    db = client[BASE_BENCHMARK]
+
+    print(f"{'modo':<9} {'idas/turno':>10} {'bulk_writes':>11} {'compartidos':>11} "
+          f"{'escritura p50':>13} {'p95':>8} {'turnos/s':>9} {'leads/tel':>9}")
+    for modo in ("directo", "turno", "diferida"):
+        r = correr(modo, db, args)
+        print(f"{modo:<9} {r['idas']:>10.2f} {r['bulk_writes']:>11} {r['compartidos']:>11} "
+              f"{r['p50']:>11.1f}ms {r['p95']:>6.1f}ms {r['turnos_s']:>9.0f} {r['leads_por_telefono']:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""
+Servicios externos falsos para correr el bot sin red
+- Anthropic: responde /v1/messages con un guion de tool_use configurable,
+  latencia simulada y soporte de streaming (SSE).
+- Green API: recibe sendMessage/sendTyping, registra cada envío y puede
+  inyectar errores 5xx para ejercitar los reintentos.
+Ambos corren en hilos dentro del proceso del benchmark y atienden también
+los GET del precalentamiento de la app (/v1/models y getStateInstance).
+"""
+
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# Entradas de ejemplo para cada herramienta del agente
+ENTRADAS_HERRAMIENTAS = {
+    "buscar_propiedades": {"tipo": "departamento", "operacion": "alquiler", "ubicacion": "Rosario"},
+    "obtener_detalle_propiedad": {"propiedad_id": None},
+    "agendar_visita": {"propiedad_id": None, "nombre_cliente": "Cliente Benchmark", "telefono": "5493410000000"},
+    "guardar_lead": {"nombre": "Cliente Benchmark", "telefono": "5493410000000"},
+}
+
+RESPUESTA_FINAL = (
+    "¡Hola! 😊 Encontré algunas opciones que pueden interesarte.\n\n"
+    "1. Departamento moderno en el centro - USD 750/mes, 2 dormitorios, Centro, Rosario.\n\n"
+    "2. Monoambiente para estudiantes - USD 450/mes, Pichincha, Rosario.\n\n"
+    "¿Querés que te cuente más de alguna o agendamos una visita?"
+)
+
+
+def parsear_guion(texto: str) -> List[List[str]]:
+    """"buscar_propiedades+buscar_propiedades;obtener_detalle_propiedad;texto" → pasos"""
+    pasos = []
+    for paso in texto.split(";"):
+        paso = paso.strip()
+        if paso and paso != "texto":
+            pasos.append([h.strip() for h in paso.split("+") if h.strip()])
+    return pasos
+
+
+class _Servidor(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Base:
+    """Servidor HTTP en un hilo, con puerto asignado por el sistema"""
+
+    def iniciar(self, puerto: int = 0) -> "_Base":
+        servicio = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                largo = int(self.headers.get("Content-Length", 0))
+                cuerpo = json.loads(self.rfile.read(largo) or b"{}")
+                servicio.atender(self, cuerpo)
+
+            def do_GET(self):
+                servicio.atender_get(self)
+
+        self.servidor = _Servidor(("127.0.0.1", puerto), Handler)
+        self.url = f"http://127.0.0.1:{self.servidor.server_address[1]}"
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        return self
+
+    def detener(self):
+        self.servidor.shutdown()
+
+    def atender_get(self, handler):
+        self.responder_json(handler, 404, {"error": f"ruta no soportada: {handler.path}"})
+
+    @staticmethod
+    def responder_json(handler, estado: int, datos: Dict):
+        cuerpo = json.dumps(datos).encode("utf-8")
+        handler.send_response(estado)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(cuerpo)))
+        handler.end_headers()
+        handler.wfile.write(cuerpo)
+
+
+class AnthropicFalso(_Base):
+    """Imitación de la Messages API con respuestas guionadas"""
+
+    def __init__(self, guion: List[List[str]], latencia: float = 0.8, primer_token: float = 0.3, jitter: float = 0.2,
+                 entradas: Optional[Dict] = None):
+        self.guion = guion
+        # Entradas por herramienta (ENTRADAS_HERRAMIENTAS con lo que se reemplace)
+        self.entradas = {**ENTRADAS_HERRAMIENTAS, **(entradas or {})}
+        self.latencia = latencia
+        self.primer_token = primer_token
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._contador = 0
+        self.llamadas: List[Dict] = []
+        # Llamadas simultáneas en curso y máximo observado
+        self.en_vuelo = 0
+        self.max_en_vuelo = 0
+
+    def _nuevo_id(self, prefijo: str) -> str:
+        with self._lock:
+            self._contador += 1
+            return f"{prefijo}_{self._contador:08d}"
+
+    def _demora(self) -> float:
+        return max(0.0, self.latencia * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _contenido(self, cuerpo: Dict):
+        """Decide la respuesta según el paso del tool loop en que está el turno"""
+        mensajes = cuerpo.get("messages", [])
+
+        # Llamadas sin herramientas (p. ej. el resumidor) responden texto
+        if not cuerpo.get("tools"):
+            return [{"type": "text", "text": "Resumen: el cliente busca departamento en Rosario."}], "end_turn"
+
+        # Paso = cantidad de respuestas del asistente desde el último texto del usuario
+        paso = 0
+        ultimo_resultado = None
+        for mensaje in reversed(mensajes):
+            contenido = mensaje.get("content")
+            if mensaje.get("role") == "assistant":
+                paso += 1
+            elif isinstance(contenido, list) and any(b.get("type") == "tool_result" for b in contenido):
+                ultimo_resultado = ultimo_resultado or contenido
+            else:
+                break
+
+        if paso >= len(self.guion):
+            return [{"type": "text", "text": RESPUESTA_FINAL}], "end_turn"
+
+        propiedad_id = None
+        for bloque in ultimo_resultado or []:
+            try:
+                datos = json.loads(bloque.get("content") or "{}")
+                propiedad_id = datos["propiedades"][0]["id"]
+                break
+            except (ValueError, KeyError, IndexError, TypeError):
+                continue
+
+        bloques = [{"type": "text", "text": "Dejame revisar el catálogo 🔎"}]
+        for nombre in self.guion[paso]:
+            entrada = dict(self.entradas.get(nombre, {}))
+            if "propiedad_id" in entrada:
+                entrada["propiedad_id"] = propiedad_id or "000000000000000000000000"
+            bloques.append({"type": "tool_use", "id": self._nuevo_id("toolu"), "name": nombre, "input": entrada})
+        return bloques, "tool_use"
+
+    def atender(self, handler, cuerpo: Dict):
+        with self._lock:
+            self.en_vuelo += 1
+            self.max_en_vuelo = max(self.max_en_vuelo, self.en_vuelo)
+        try:
+            self._responder(handler, cuerpo)
+        finally:
+            with self._lock:
+                self.en_vuelo -= 1
+
+    def atender_get(self, handler):
+        """GET /v1/models (lo usa el precalentamiento de la app)"""
+        if handler.path.split("?")[0] != "/v1/models":
+            return super().atender_get(handler)
+        self.responder_json(handler, 200, {
+            "data": [{"type": "model", "id": "claude-sonnet-4-20250514", "display_name": "Falso",
+                      "created_at": "2025-05-14T00:00:00Z"}],
+            "has_more": False, "first_id": "claude-sonnet-4-20250514", "last_id": "claude-sonnet-4-20250514",
+        })
+
+    def _responder(self, handler, cuerpo: Dict):
+        inicio = time.monotonic()
+        bloques, stop_reason = self._contenido(cuerpo)
+        tokens_entrada = len(json.dumps(cuerpo)) // 4
+        tokens_salida = len(json.dumps(bloques)) // 4
+        mensaje = {
+            "id": self._nuevo_id("msg"),
+            "type": "message",
+            "role": "assistant",
+            "model": cuerpo.get("model", "falso"),
+            "content": bloques,
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": tokens_entrada,
+                "output_tokens": tokens_salida,
+                "cache_creation_input_tokens": 0,
+                "cache_read_input_tokens": 0,
+            },
+        }
+
+        if cuerpo.get("stream"):
+            self._responder_stream(handler, mensaje)
+        else:
+            time.sleep(self._demora())
+            self.responder_json(handler, 200, mensaje)
+
+        with self._lock:
+            self.llamadas.append({
+                "modelo": cuerpo.get("model"),
+                "stream": bool(cuerpo.get("stream")),
+                "duracion": time.monotonic() - inicio,
+            })
+
+    def _responder_stream(self, handler, mensaje: Dict):
+        """Eventos SSE equivalentes a los de la API real"""
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.close_connection = True
+
+        def evento(tipo: str, datos: Dict):
+            handler.wfile.write(f"event: {tipo}\ndata: {json.dumps({'type': tipo, **datos})}\n\n".encode("utf-8"))
+            handler.wfile.flush()
+
+        demora = self._demora()
+        time.sleep(demora * self.primer_token)
+        inicio = {**mensaje, "content": [], "stop_reason": None,
+                  "usage": {**mensaje["usage"], "output_tokens": 1}}
+        evento("message_start", {"message": inicio})
+
+        fragmentos = []
+        for i, bloque in enumerate(mensaje["content"]):
+            if bloque["type"] == "text":
+                palabras = bloque["text"].split(" ")
+                fragmentos.append((i, bloque, [p + (" " if j < len(palabras) - 1 else "") for j, p in enumerate(palabras)]))
+            else:
+                fragmentos.append((i, bloque, [json.dumps(bloque["input"])]))
+        total = max(1, sum(len(f[2]) for f in fragmentos))
+        pausa = demora * (1 - self.primer_token) / total
+
+        for i, bloque, partes in fragmentos:
+            if bloque["type"] == "text":
+                evento("content_block_start", {"index": i, "content_block": {"type": "text", "text": ""}})
+                for parte in partes:
+                    evento("content_block_delta", {"index": i, "delta": {"type": "text_delta", "text": parte}})
+                    time.sleep(pausa)
+            else:
+                evento("content_block_start", {"index": i, "content_block": {**bloque, "input": {}}})
+                for parte in partes:
+                    evento("content_block_delta", {"index": i, "delta": {"type": "input_json_delta", "partial_json": parte}})
+                    time.sleep(pausa)
+            evento("content_block_stop", {"index": i})
+
+        evento("message_delta", {"delta": {"stop_reason": mensaje["stop_reason"], "stop_sequence": None},
+                                 "usage": {"output_tokens": mensaje["usage"]["output_tokens"]}})
+        evento("message_stop", {})
+
+
+class GreenAPIFalso(_Base):
+    """Sumidero de mensajes salientes de Green API"""
+
+    def __init__(self, latencia: float = 0.05, tasa_error: float = 0.0):
+        self.latencia = latencia
+        self.tasa_error = tasa_error
+        self._lock = threading.Lock()
+        self.enviados: List[Dict] = []
+        self.escribiendo = 0
+        self.errores = 0
+
+    def atender(self, handler, cuerpo: Dict):
+        time.sleep(self.latencia)
+        partes = handler.path.strip("/").split("/")
+        metodo = partes[1] if len(partes) > 1 else ""
+
+        if self.tasa_error and random.random() < self.tasa_error:
+            with self._lock:
+                self.errores += 1
+            self.responder_json(handler, 500, {"error": "falla simulada"})
+            return
+
+        if metodo == "sendMessage":
+            with self._lock:
+                self.enviados.append({
+                    "telefono": cuerpo.get("chatId", "").replace("@c.us", ""),
+                    "mensaje": cuerpo.get("message", ""),
+                    "instante": time.monotonic(),
+                })
+                id_mensaje = f"BAE5{len(self.enviados):012d}"
+            self.responder_json(handler, 200, {"idMessage": id_mensaje})
+        elif metodo == "sendTyping":
+            with self._lock:
+                self.escribiendo += 1
+            self.responder_json(handler, 200, {})
+        else:
+            self.responder_json(handler, 404, {"error": f"método no soportado: {metodo}"})
+
+    def atender_get(self, handler):
+        """getStateInstance (lo usa el precalentamiento de la app)"""
+        partes = handler.path.strip("/").split("/")
+        if len(partes) > 1 and partes[1] == "getStateInstance":
+            self.responder_json(handler, 200, {"stateInstance": "authorized"})
+        else:
+            super().atender_get(handler)
+
+    def enviados_desde(self, indice: int) -> List[Dict]:
+        with self._lock:
+            return list(self.enviados[indice:])
+
+
+def guion_por_defecto() -> List[List[str]]:
+    """Turno típico: búsqueda, detalle de la primera propiedad y respuesta"""
+    return parsear_guion("buscar_propiedades;obtener_detalle_propiedad;texto")
+
+
+def crear_servicios(guion: Optional[List[List[str]]] = None, latencia_claude: float = 0.8,
+                    latencia_green: float = 0.05, error_green: float = 0.0,
+                    puerto_anthropic: int = 0, puerto_green: int = 0, entradas: Optional[Dict] = None):
+    """Arranca Anthropic y Green API falsos y los devuelve"""
+    anthropic = AnthropicFalso(
+        guion if guion is not None else guion_por_defecto(), latencia=latencia_claude, entradas=entradas
+    )
+    green = GreenAPIFalso(latencia=latencia_green, tasa_error=error_green)
+    return anthropic.iniciar(puerto_anthropic), green.iniciar(puerto_green)
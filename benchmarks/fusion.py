@@ -0,0 +1,100 @@
+"""
+Benchmark: llamadas al agente ahorradas fusionando mensajes seguidos
+Reproduce tráfico (sintético o un archivo JSONL de webhooks de Green API con
+su campo `timestamp`) contra ColaMensajes, con y sin ventana de fusión, y
+cuenta cuántos turnos del agente (llamadas a Claude) se ejecutan.
+El procesamiento del agente se simula con una espera fija.
+
+Uso: python -m benchmarks.fusion [webhooks.jsonl] [--ventana 2] [--acelerar 10]
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from typing import List, Tuple
+
+from cola import ColaMensajes
+
+
+def trafico_sintetico(telefonos: int = 50, semilla: int = 7) -> List[Tuple[float, str, str]]:
+    """Ráfagas de 1 a 5 mensajes por teléfono, separadas por pausas largas"""
+    rnd = random.Random(semilla)
+    eventos = []
+    for t in range(telefonos):
+        telefono = f"54934100{t:05d}"
+        instante = rnd.uniform(0, 30)
+        for _ in range(rnd.randint(1, 4)):
+            for _ in range(rnd.choice([1, 1, 2, 3, 4, 5])):
+                eventos.append((instante, telefono, "mensaje"))
+                instante += rnd.uniform(0.3, 2.5)
+            instante += rnd.uniform(20, 60)
+    return sorted(eventos)
+
+
+def trafico_archivo(ruta: str) -> List[Tuple[float, str, str]]:
+    """Eventos (instante, teléfono, texto) de un JSONL de webhooks entrantes"""
+    eventos = []
+    with open(ruta, encoding="utf-8") as archivo:
+        for linea in archivo:
+            if not linea.strip():
+                continue
+            data = json.loads(linea)
+            if data.get("typeWebhook") != "incomingMessageReceived":
+                continue
+            telefono = data.get("senderData", {}).get("chatId", "").replace("@c.us", "")
+            texto = data.get("messageData", {}).get("textMessageData", {}).get("textMessage", "")
+            if telefono and texto:
+                eventos.append((float(data.get("timestamp", 0)), telefono, texto))
+    eventos.sort()
+    inicio = eventos[0][0] if eventos else 0
+    return [(instante - inicio, telefono, texto) for instante, telefono, texto in eventos]
+
+
+def reproducir(eventos, ventana: float, acelerar: float, duracion_turno: float) -> dict:
+    """Reproduce los eventos respetando los tiempos (escalados) y cuenta turnos"""
+    turnos = []
+    lock = threading.Lock()
+
+    def procesar(telefono: str, texto: str):
+        time.sleep(duracion_turno / acelerar)
+        with lock:
+            turnos.append(telefono)
+
+    cola = ColaMensajes(procesar, workers=16, max_pendientes=100000,
+                        max_por_telefono=1000, ventana_fusion=ventana / acelerar)
+    inicio = time.monotonic()
+    for instante, telefono, texto in eventos:
+        espera = inicio + instante / acelerar - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        cola.encolar(telefono, texto)
+    cola.detener(timeout=60)
+    return cola.estadisticas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("archivo", nargs="?", help="JSONL con webhooks de Green API")
+    parser.add_argument("--ventana", type=float, default=2.0, help="ventana de fusión en segundos")
+    parser.add_argument("--acelerar", type=float, default=10.0, help="factor de aceleración del tiempo")
+    parser.add_argument("--turno", type=float, default=4.0, help="duración simulada de un turno (s)")
+    args = parser.parse_args()
+
+    eventos = trafico_archivo(args.archivo) if args.archivo else trafico_sintetico()
+    print(f"{len(eventos)} mensajes de {len({e[1] for e in eventos})} teléfonos")
+
+    sin_fusion = reproducir(eventos, 0.0, args.acelerar, args.turno)
+    con_fusion = reproducir(eventos, args.ventana, args.acelerar, args.turno)
+
+    print(f"  sin fusión:            {sin_fusion['procesados']:>5} llamadas al agente")
+    print(f"  con ventana de {args.ventana:g}s:    {con_fusion['procesados']:>5} llamadas al agente")
+    ahorradas = sin_fusion["procesados"] - con_fusion["procesados"]
+    print(f"  ahorradas:             {ahorradas:>5} ({ahorradas / max(1, sin_fusion['procesados']) * 100:.0f}%)")
+    print(f"  espera p95 con fusión: {con_fusion['espera_p95_ms'] * args.acelerar:.0f} ms (tiempo real)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
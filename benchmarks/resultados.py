@@ -0,0 +1,48 @@
+"""
+Benchmark: tamaño del resultado de buscar_propiedades
+Compara, sobre el catálogo de ejemplo de init_db.py, el resultado que se
+serializaba antes (documentos completos) contra las filas resumidas que se
+obtienen con PROYECCION_RESUMEN. No necesita MongoDB.
+
+Uso: python -m benchmarks.resultados
+"""
+
+from bson.objectid import ObjectId
+
+from catalogo import PROYECCION_RESUMEN, fila_resumen
+from contexto import CARACTERES_POR_TOKEN
+from init_db import PROPIEDADES_EJEMPLO
+from serializacion import codificar_json
+
+
+def serializar(propiedades) -> str:
+    """Resultado de la herramienta tal como se envía a Claude"""
+    resultado = {"success": True, "cantidad": len(propiedades), "propiedades": propiedades}
+    return codificar_json(resultado)
+
+
+def main():
+    documentos = [
+        {"_id": ObjectId(), **prop}
+        for prop in PROPIEDADES_EJEMPLO
+    ]
+
+    completos = [{**doc, "_id": str(doc["_id"])} for doc in documentos]
+    proyectados = [{k: v for k, v in doc.items() if k == "_id" or k in PROYECCION_RESUMEN} for doc in documentos]
+    resumidos = [fila_resumen(doc) for doc in proyectados]
+
+    antes = serializar(completos)
+    despues = serializar(resumidos)
+    bytes_antes = len(antes.encode("utf-8"))
+    bytes_despues = len(despues.encode("utf-8"))
+
+    print(f"Búsqueda con {len(documentos)} resultados")
+    print(f"  documentos completos: {bytes_antes:>6} bytes  ~{len(antes) // CARACTERES_POR_TOKEN:>5} tokens")
+    print(f"  filas resumidas:      {bytes_despues:>6} bytes  ~{len(despues) // CARACTERES_POR_TOKEN:>5} tokens")
+    print(f"  ahorro por búsqueda:  {bytes_antes - bytes_despues:>6} bytes  "
+          f"~{(len(antes) - len(despues)) // CARACTERES_POR_TOKEN:>5} tokens "
+          f"({(1 - bytes_despues / bytes_antes) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark: búsqueda por descripción en memoria (busqueda_semantica.py)
+Arma el índice TF-IDF sobre un catálogo sintético (títulos, descripciones y
+características combinados al azar, como los del catálogo de ejemplo), mide
+el tiempo de construcción, una actualización incremental de 1% del catálogo y
+la latencia de consultas con y sin filtros estructurados. No necesita MongoDB.
+
+Uso: python -m benchmarks.semantica [cantidad]
+"""
+
+import sys
+import time
+import random
+from datetime import datetime, timedelta
+
+from benchmarks.ubicacion import BARRIOS, CIUDADES
+from busqueda_semantica import IndiceSemantico
+from catalogo import campos_ubicacion
+
+CARACTERISTICAS = [
+    "pileta", "quincho", "parrilla", "jardín", "cochera", "balcón", "terraza", "vista al río",
+    "amoblado", "seguridad 24hs", "luminoso", "calefacción", "aire acondicionado", "baulera",
+    "sum", "gimnasio", "apto mascotas", "cocina equipada", "lavadero", "patio", "vidriera",
+    "esquina", "depósito", "apto crédito", "a estrenar", "losa radiante", "doble circulación",
+]
+ADJETIVOS = ["Hermoso", "Amplio", "Luminoso", "Moderno", "Reciclado", "Cómodo", "Espectacular", "Excelente"]
+ENTORNOS = [
+    "cerca del río", "a metros del parque", "frente a la plaza", "en zona residencial tranquila",
+    "sobre avenida", "cerca de colegios y comercios", "con salida a dos calles", "en barrio cerrado",
+]
+TIPOS = ["casa", "departamento", "terreno", "oficina", "local"]
+
+CONSULTAS = [
+    ({"consulta": "con pileta y quincho, cerca del río"}, {}),
+    ({"consulta": "departamento luminoso con balcón y cochera"}, {"operacion": "alquiler"}),
+    ({"consulta": "apto mascotas con patio"}, {"tipo": "casa", "precio_max": 200000}),
+    ({"consulta": "local en esquina con vidriera"}, {"tipo": "local", "ubicacion": "Rosario"}),
+    ({"consulta": "a estrenar con amenities, gimnasio y sum"}, {"operacion": "venta", "habitaciones": 2}),
+    ({"consulta": "vista al río"}, {"ubicacion": "Fisherton", "precio_min": 50000}),
+]
+REPETICIONES = 200
+
+
+def generar_propiedades(cantidad: int, semilla: int = 42):
+    """Propiedades sintéticas con descripciones variadas"""
+    rnd = random.Random(semilla)
+    base = datetime(2024, 1, 1)
+    for i in range(cantidad):
+        tipo = rnd.choice(TIPOS)
+        ubicacion = f"{rnd.choice(BARRIOS)}, {rnd.choice(CIUDADES)}"
+        caracteristicas = rnd.sample(CARACTERISTICAS, rnd.randint(2, 6))
+        yield {
+            "_id": f"{i:024x}",
+            "titulo": f"{rnd.choice(ADJETIVOS)} {tipo} en {ubicacion.split(',')[0]}",
+            "descripcion": (f"{rnd.choice(ADJETIVOS)} {tipo} {rnd.choice(ENTORNOS)}, con "
+                            f"{', '.join(caracteristicas[:2])}. {rnd.choice(ENTORNOS).capitalize()}."),
+            "caracteristicas": caracteristicas,
+            "tipo": tipo,
+            "operacion": rnd.choice(["venta", "alquiler"]),
+            "precio": rnd.randint(300, 400000),
+            "moneda": "USD",
+            "ubicacion": ubicacion,
+            "habitaciones": rnd.randint(0, 4),
+            "banos": rnd.randint(1, 3),
+            "estado": "disponible",
+            "fecha_actualizacion": base + timedelta(seconds=i),
+            **campos_ubicacion(ubicacion),
+        }
+
+
+def milisegundos(muestras, q) -> float:
+    """Percentil q de una lista de duraciones en segundos, en ms"""
+    ordenadas = sorted(muestras)
+    return ordenadas[min(len(ordenadas) - 1, int(q / 100 * len(ordenadas)))] * 1000
+
+
+def main():
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    propiedades = list(generar_propiedades(cantidad))
+    indice = IndiceSemantico()
+
+    inicio = time.perf_counter()
+    indice.actualizar(propiedades)
+    construccion = time.perf_counter() - inicio
+    stats = indice.estadisticas()
+    print(f"Índice de {stats['propiedades']} propiedades, {stats['terminos']} términos, "
+          f"{stats['bytes'] / 1024 / 1024:.1f} MB: construido en {construccion * 1000:.0f} ms")
+
+    # Actualización incremental: 1% modificado y 0,1% dado de baja
+    rnd = random.Random(7)
+    cambios = [dict(p) for p in rnd.sample(propiedades, cantidad // 100)]
+    for propiedad in cambios[: cantidad // 1000]:
+        propiedad["estado"] = "no_disponible"
+    for propiedad in cambios[cantidad // 1000:]:
+        propiedad["descripcion"] += " Reciclado a nuevo, con losa radiante."
+    inicio = time.perf_counter()
+    indice.actualizar(cambios)
+    print(f"Actualización incremental de {len(cambios)} propiedades: "
+          f"{(time.perf_counter() - inicio) * 1000:.0f} ms\n")
+
+    print(f"{'consulta':<45} {'filtros':<38} {'p50':>7} {'p99':>7}  mejor resultado")
+    todas = []
+    for parametros, filtros in CONSULTAS:
+        muestras = []
+        for _ in range(REPETICIONES):
+            inicio = time.perf_counter()
+            resultados = indice.buscar(parametros["consulta"], filtros)
+            muestras.append(time.perf_counter() - inicio)
+        todas.extend(muestras)
+        mejor = f"{resultados[0]['titulo']} ({resultados[0]['relevancia']})" if resultados else "-"
+        print(f"{parametros['consulta'][:45]:<45} {str(filtros)[:38]:<38} "
+              f"{milisegundos(muestras, 50):>5.2f}ms {milisegundos(muestras, 99):>5.2f}ms  {mejor}")
+
+    print(f"\nTodas: p50={milisegundos(todas, 50):.2f}ms p95={milisegundos(todas, 95):.2f}ms "
+          f"p99={milisegundos(todas, 99):.2f}ms (n={len(todas)})")
+
+
+if __name__ == "__main__":
+    main()
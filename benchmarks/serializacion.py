@@ -0,0 +1,87 @@
+"""
+Microbenchmark: serialización de resultados de herramientas (serializacion.py)
+Sobre el catálogo de ejemplo de init_db.py, con los tipos que devuelve
+pymongo (ObjectId, datetime, Decimal128), compara:
+  - json.dumps(ensure_ascii=False): lo que se usaba; falla con datetime;
+  - json.dumps(default=str): el arreglo directo, con espacios y sin orden;
+  - codificar_json: codificador único, compacto y con claves ordenadas.
+Mide también contenido_plano sobre una respuesta típica del tool loop.
+No necesita MongoDB ni red.
+
+Uso: python -m benchmarks.serializacion [repeticiones]
+"""
+
+import sys
+import json
+import time
+from decimal import Decimal
+
+from anthropic.types import TextBlock, ToolUseBlock
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+
+from catalogo import fila_resumen
+from init_db import PROPIEDADES_EJEMPLO
+from serializacion import codificar_json, contenido_plano
+
+
+def medir(funcion, valor, repeticiones: int):
+    """(µs por llamada, bytes) o (None, error) si la función falla"""
+    try:
+        texto = funcion(valor)
+    except TypeError as e:
+        return None, str(e)
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion(valor)
+    return (time.perf_counter() - inicio) / repeticiones * 1e6, len(texto.encode("utf-8"))
+
+
+def main():
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    documentos = [
+        {**prop, "_id": ObjectId(), "precio": Decimal128(Decimal(str(prop["precio"]))), "agente_id": ObjectId()}
+        for prop in PROPIEDADES_EJEMPLO
+    ]
+    casos = {
+        "detalle": {"success": True, "propiedad": documentos[0]},
+        "búsqueda": {"success": True, "cantidad": len(documentos),
+                     "propiedades": [fila_resumen(doc) for doc in documentos]},
+    }
+    codificadores = {
+        "json.dumps": lambda v: json.dumps(v, ensure_ascii=False),
+        "json.dumps(default=str)": lambda v: json.dumps(v, ensure_ascii=False, default=str),
+        "codificar_json": codificar_json,
+    }
+
+    print(f"{'resultado':<10} {'codificador':<25} {'µs':>8} {'bytes':>7}")
+    for caso, valor in casos.items():
+        for nombre, funcion in codificadores.items():
+            tiempo, dato = medir(funcion, valor, repeticiones)
+            if tiempo is None:
+                print(f"{caso:<10} {nombre:<25} {'falla':>8}  ({dato})")
+            else:
+                print(f"{caso:<10} {nombre:<25} {tiempo:>8.1f} {dato:>7}")
+
+    contenido = [
+        TextBlock(type="text", text="Busco opciones en Rosario y te muestro el detalle."),
+        ToolUseBlock(type="tool_use", id="toolu_01", name="buscar_propiedades",
+                     input={"tipo": "departamento", "operacion": "alquiler", "ubicacion": "Rosario"}),
+        ToolUseBlock(type="tool_use", id="toolu_02", name="obtener_detalle_propiedad",
+                     input={"propiedad_id": str(documentos[0]["_id"])}),
+    ]
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        contenido_plano(contenido)
+    plano = (time.perf_counter() - inicio) / repeticiones * 1e6
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        [bloque.model_dump() for bloque in contenido]
+    dump = (time.perf_counter() - inicio) / repeticiones * 1e6
+    print(f"\nBloques del SDK ({len(contenido)}): contenido_plano {plano:.1f} µs, model_dump {dump:.1f} µs")
+    print(f"  guardado: {codificar_json(contenido_plano(contenido))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
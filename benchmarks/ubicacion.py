@@ -0,0 +1,92 @@
+"""
+Benchmark: búsqueda por ubicación con regex libre vs. tokens normalizados
+Carga un catálogo sintético en una base de prueba y compara, para varias
+consultas, el tiempo medio y los documentos examinados (explain) de:
+  - antes:   {"ubicacion": {"$regex": texto, "$options": "i"}}
+  - después: filtro_ubicacion(texto) sobre el índice de `ubicacion_tokens`
+
+Uso: MONGO_URI=mongodb://localhost:27017 python -m benchmarks.ubicacion [cantidad]
+"""
+
+import os
+import sys
+import time
+import random
+
+from pymongo import MongoClient
+
+from catalogo import campos_ubicacion, filtro_ubicacion
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+BASE_BENCHMARK = "benchmark_inmobiliaria"
+
+BARRIOS = ["Centro", "Fisherton", "Pichincha", "Parque España", "Microcentro", "Zona Oeste",
+           "Echesortu", "Alberdi", "Arroyito", "Abasto", "Barrio Martin", "Refinería"]
+CIUDADES = ["Rosario", "Funes", "Roldán", "Córdoba", "Santa Fe", "Paraná", "San Lorenzo"]
+PROVINCIAS = ["Santa Fe", "Córdoba", "Entre Ríos", "Buenos Aires"]
+
+CONSULTAS = ["Rosario", "córdoba", "Parque España", "funes santa fe", "Centro (", "refineria"]
+REPETICIONES = 20
+
+
+def generar_propiedades(cantidad: int):
+    """Propiedades sintéticas con ubicaciones realistas"""
+    rnd = random.Random(42)
+    for i in range(cantidad):
+        ubicacion = f"{rnd.choice(BARRIOS)}, {rnd.choice(CIUDADES)}, {rnd.choice(PROVINCIAS)}"
+        yield {
+            "titulo": f"Propiedad {i}",
+            "tipo": rnd.choice(["casa", "departamento", "terreno", "oficina", "local"]),
+            "operacion": rnd.choice(["venta", "alquiler"]),
+            "precio": rnd.randint(300, 400000),
+            "ubicacion": ubicacion,
+            **campos_ubicacion(ubicacion)
+        }
+
+
+def medir(coleccion, filtro):
+    """Tiempo medio (ms) de la consulta y documentos examinados según explain"""
+    inicio = time.perf_counter()
+    for _ in range(REPETICIONES):
+        list(coleccion.find(filtro, {"_id": 1}).limit(10))
+    promedio = (time.perf_counter() - inicio) / REPETICIONES * 1000
+
+    plan = coleccion.find(filtro).limit(10).explain()
+    examinados = plan["executionStats"]["totalDocsExamined"]
+    return promedio, examinados
+
+
+def main():
+    cantidad = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    client = MongoClient(MONGO_URI)
+    coleccion = client[BASE_BENCHMARK]["propiedades"]
+
+    if coleccion.estimated_document_count() != cantidad:
+        print(f"Cargando {cantidad} propiedades sintéticas...")
+        coleccion.drop()
+        lote = []
+        for prop in generar_propiedades(cantidad):
+            lote.append(prop)
+            if len(lote) == 5000:
+                coleccion.insert_many(lote)
+                lote = []
+        if lote:
+            coleccion.insert_many(lote)
+    coleccion.create_index([("ubicacion", 1)])
+    coleccion.create_index([("ubicacion_tokens", 1)])
+
+    print(f"{'consulta':<18} {'regex ms':>9} {'examinados':>11} {'tokens ms':>10} {'examinados':>11}")
+    for texto in CONSULTAS:
+        try:
+            antes = medir(coleccion, {"ubicacion": {"$regex": texto, "$options": "i"}})
+        except Exception:
+            # Texto con metacaracteres: la regex libre directamente falla
+            antes = (float("nan"), "error")
+        despues = medir(coleccion, filtro_ubicacion(texto))
+        print(f"{texto:<18} {antes[0]:>9.2f} {antes[1]:>11} {despues[0]:>10.2f} {despues[1]:>11}")
+
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Bloqueo por conversación entre workers y réplicas
+Un turno lee la conversación, llama a Claude y escribe el resultado; si dos
+mensajes del mismo teléfono se procesan a la vez en procesos distintos, los
+dos leen el mismo historial y el resumen de uno pisa al del otro. Antes de
+procesar se toma un arrendamiento (lease) del teléfono en la colección
+`bloqueos`:
+  - expira solo si el dueño muere, así nadie queda bloqueado para siempre;
+  - cada toma incrementa un token de fencing, que se guarda con la
+    conversación: una escritura con un token más viejo que el guardado (un
+    dueño cuyo lease venció mientras trabajaba) se rechaza. Por eso el
+    documento del lease no se borra nunca (sin TTL) y, si igual falta, el
+    token se retoma desde el de la conversación;
+  - la espera está acotada, con backoff y jitter.
+Los vencimientos usan el reloj de cada servidor: el lease debe durar mucho
+más que el desfase entre relojes (NTP).
+"""
+
+import time
+import random
+import asyncio
+import logging
+import threading
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+
+class BloqueoOcupado(Exception):
+    """No se consiguió el bloqueo dentro del tiempo máximo de espera"""
+
+
+class BloqueoPerdido(Exception):
+    """El lease venció y otro proceso tomó la conversación (token de fencing viejo)"""
+
+
+class Arrendamiento:
+    """Lease tomado sobre una conversación"""
+
+    __slots__ = ("telefono", "dueno", "token", "expira")
+
+    def __init__(self, telefono: str, dueno: str, token: int, expira: datetime):
+        self.telefono = telefono
+        self.dueno = dueno
+        self.token = token
+        self.expira = expira
+
+
+def filtro_fencing(telefono: str, token: Optional[int]) -> Dict:
+    """
+    Filtro de la conversación que solo coincide si nadie escribió con un token
+    más nuevo. Con upsert y el índice único de `telefono`, una escritura
+    rechazada termina en DuplicateKeyError.
+    """
+    filtro = {"telefono": telefono}
+    if token is not None:
+        filtro["token_bloqueo"] = {"$not": {"$gt": token}}
+    return filtro
+
+
+class BloqueoConversaciones:
+    """Leases por teléfono guardados en MongoDB"""
+
+    def __init__(
+        self,
+        coleccion: Collection,
+        conversaciones: Optional[Collection] = None,
+        duracion: float = 60.0,
+        espera_max: float = 90.0,
+        espera_inicial: float = 0.02,
+        espera_tope: float = 0.5,
+    ):
+        self.coleccion = coleccion
+        self.conversaciones = conversaciones
+        self.duracion = duracion
+        self.espera_max = espera_max
+        self.espera_inicial = espera_inicial
+        self.espera_tope = espera_tope
+        self._indices_creados = False
+
+        # Estadísticas
+        self._lock = threading.Lock()
+        self._tomados = 0
+        self._con_espera = 0
+        self._agotados = 0
+        self._perdidos = 0
+        self._espera_total = 0.0
+
+    def crear_indices(self):
+        """Teléfono único en conversaciones (lo requiere el fencing); borra el TTL de versiones anteriores"""
+        for nombre, indice in self.coleccion.index_information().items():
+            if "expireAfterSeconds" in indice:
+                self.coleccion.drop_index(nombre)
+        if self.conversaciones is not None:
+            try:
+                self.conversaciones.create_index("telefono", unique=True)
+            except Exception as e:
+                logger.error(f"Sin índice único de conversaciones.telefono (¿teléfonos duplicados?): {str(e)}")
+        self._indices_creados = True
+
+    def _operacion_toma(self, telefono: str):
+        """Filtro y actualización que toman el lease si está libre o vencido"""
+        ahora = datetime.now(timezone.utc)
+        dueno = uuid.uuid4().hex
+        filtro = {"_id": telefono, "expira": {"$lte": ahora}}
+        actualizacion = {
+            "$set": {"dueno": dueno, "expira": ahora + timedelta(seconds=self.duracion)},
+            "$inc": {"token": 1},
+        }
+        return dueno, filtro, actualizacion
+
+    def _retomar_token(self, telefono: str, dueno: str, token_conversacion: Optional[int]):
+        """Filtro y actualización que llevan un token recién creado más allá del de la conversación"""
+        if not token_conversacion:
+            return None
+        return {"_id": telefono, "dueno": dueno}, {"$max": {"token": token_conversacion + 1}}
+
+    def _espera(self, intento: int) -> float:
+        """Backoff exponencial con jitter completo"""
+        return random.uniform(0, min(self.espera_tope, self.espera_inicial * 2 ** intento))
+
+    def _registrar_toma(self, inicio: float, intentos: int):
+        with self._lock:
+            self._tomados += 1
+            self._con_espera += intentos > 0
+            self._espera_total += time.monotonic() - inicio
+
+    def _agotado(self, telefono: str) -> BloqueoOcupado:
+        with self._lock:
+            self._agotados += 1
+        return BloqueoOcupado(f"Conversación {telefono} ocupada tras {self.espera_max:.0f}s de espera")
+
+    def adquirir(self, telefono: str) -> Arrendamiento:
+        """Toma el lease del teléfono, esperando como mucho `espera_max` segundos"""
+        if not self._indices_creados:
+            self.crear_indices()
+        inicio = time.monotonic()
+        intento = 0
+        while True:
+            dueno, filtro, actualizacion = self._operacion_toma(telefono)
+            try:
+                # Sin documento lo crea; con uno vigente el upsert choca con el _id
+                documento = self.coleccion.find_one_and_update(
+                    filtro, actualizacion, upsert=True, return_document=ReturnDocument.AFTER
+                )
+                # Documento nuevo (teléfono sin lease o documento borrado): el token no puede retroceder
+                if documento["token"] == 1 and self.conversaciones is not None:
+                    conversacion = self.conversaciones.find_one({"telefono": telefono}, {"token_bloqueo": 1}) or {}
+                    retomar = self._retomar_token(telefono, dueno, conversacion.get("token_bloqueo"))
+                    if retomar:
+                        documento = self.coleccion.find_one_and_update(
+                            *retomar, return_document=ReturnDocument.AFTER
+                        ) or documento
+                self._registrar_toma(inicio, intento)
+                return Arrendamiento(telefono, dueno, documento["token"], documento["expira"])
+            except DuplicateKeyError:
+                pass
+            espera = self._espera(intento)
+            if time.monotonic() + espera - inicio > self.espera_max:
+                raise self._agotado(telefono)
+            time.sleep(espera)
+            intento += 1
+
+    def renovar(self, arrendamiento: Arrendamiento) -> bool:
+        """Extiende el lease; False si ya no es nuestro"""
+        expira = datetime.now(timezone.utc) + timedelta(seconds=self.duracion)
+        resultado = self.coleccion.update_one(
+            {"_id": arrendamiento.telefono, "dueno": arrendamiento.dueno, "token": arrendamiento.token},
+            {"$set": {"expira": expira}}
+        )
+        return self._renovado(arrendamiento, resultado.matched_count, expira)
+
+    def _renovado(self, arrendamiento: Arrendamiento, coincidencias: int, expira: datetime) -> bool:
+        if coincidencias:
+            arrendamiento.expira = expira
+            return True
+        with self._lock:
+            self._perdidos += 1
+        logger.warning(f"Lease de {arrendamiento.telefono} perdido (token {arrendamiento.token})")
+        return False
+
+    def liberar(self, arrendamiento: Arrendamiento):
+        """Devuelve el lease; se conserva el documento para que el token siga creciendo"""
+        try:
+            self.coleccion.update_one(
+                {"_id": arrendamiento.telefono, "dueno": arrendamiento.dueno, "token": arrendamiento.token},
+                {"$set": {"expira": datetime.now(timezone.utc)}}
+            )
+        except Exception as e:
+            # Si falla, el lease vence solo
+            logger.error(f"Error liberando bloqueo de {arrendamiento.telefono}: {str(e)}")
+
+    @contextmanager
+    def tomar(self, telefono: str):
+        """with bloqueos.tomar(telefono) as arrendamiento: ..."""
+        arrendamiento = self.adquirir(telefono)
+        try:
+            yield arrendamiento
+        finally:
+            self.liberar(arrendamiento)
+
+    def perdido(self):
+        """Registra una escritura rechazada por el fencing"""
+        with self._lock:
+            self._perdidos += 1
+
+    def estadisticas(self) -> Dict:
+        """Tomas, esperas, tiempos agotados y leases perdidos"""
+        with self._lock:
+            return {
+                "tomados": self._tomados,
+                "con_espera": self._con_espera,
+                "agotados": self._agotados,
+                "perdidos": self._perdidos,
+                "espera_media_ms": round(self._espera_total / self._tomados * 1000, 1) if self._tomados else 0.0,
+            }
+
+
+class BloqueoConversacionesAsync(BloqueoConversaciones):
+    """Leases por teléfono sobre una colección de motor (driver asíncrono)"""
+
+    async def crear_indices(self):
+        """Teléfono único en conversaciones (lo requiere el fencing); borra el TTL de versiones anteriores"""
+        for nombre, indice in (await self.coleccion.index_information()).items():
+            if "expireAfterSeconds" in indice:
+                await self.coleccion.drop_index(nombre)
+        if self.conversaciones is not None:
+            try:
+                await self.conversaciones.create_index("telefono", unique=True)
+            except Exception as e:
+                logger.error(f"Sin índice único de conversaciones.telefono (¿teléfonos duplicados?): {str(e)}")
+        self._indices_creados = True
+
+    async def adquirir(self, telefono: str) -> Arrendamiento:
+        """Toma el lease del teléfono, esperando como mucho `espera_max` segundos"""
+        if not self._indices_creados:
+            await self.crear_indices()
+        inicio = time.monotonic()
+        intento = 0
+        while True:
+            dueno, filtro, actualizacion = self._operacion_toma(telefono)
+            try:
+                documento = await self.coleccion.find_one_and_update(
+                    filtro, actualizacion, upsert=True, return_document=ReturnDocument.AFTER
+                )
+                if documento["token"] == 1 and self.conversaciones is not None:
+                    conversacion = await self.conversaciones.find_one(
+                        {"telefono": telefono}, {"token_bloqueo": 1}
+                    ) or {}
+                    retomar = self._retomar_token(telefono, dueno, conversacion.get("token_bloqueo"))
+                    if retomar:
+                        documento = await self.coleccion.find_one_and_update(
+                            *retomar, return_document=ReturnDocument.AFTER
+                        ) or documento
+                self._registrar_toma(inicio, intento)
+                return Arrendamiento(telefono, dueno, documento["token"], documento["expira"])
+            except DuplicateKeyError:
+                pass
+            espera = self._espera(intento)
+            if time.monotonic() + espera - inicio > self.espera_max:
+                raise self._agotado(telefono)
+            await asyncio.sleep(espera)
+            intento += 1
+
+    async def renovar(self, arrendamiento: Arrendamiento) -> bool:
+        """Extiende el lease; False si ya no es nuestro"""
+        expira = datetime.now(timezone.utc) + timedelta(seconds=self.duracion)
+        resultado = await self.coleccion.update_one(
+            {"_id": arrendamiento.telefono, "dueno": arrendamiento.dueno, "token": arrendamiento.token},
+            {"$set": {"expira": expira}}
+        )
+        return self._renovado(arrendamiento, resultado.matched_count, expira)
+
+    async def liberar(self, arrendamiento: Arrendamiento):
+        """Devuelve el lease; se conserva el documento para que el token siga creciendo"""
+        try:
+            await self.coleccion.update_one(
+                {"_id": arrendamiento.telefono, "dueno": arrendamiento.dueno, "token": arrendamiento.token},
+                {"$set": {"expira": datetime.now(timezone.utc)}}
+            )
+        except Exception as e:
+            logger.error(f"Error liberando bloqueo de {arrendamiento.telefono}: {str(e)}")
+
+    @asynccontextmanager
+    async def tomar(self, telefono: str):
+        """async with bloqueos.tomar(telefono) as arrendamiento: ..."""
+        arrendamiento = await self.adquirir(telefono)
+        try:
+            yield arrendamiento
+        finally:
+            await self.liberar(arrendamiento)
@@ -0,0 +1,319 @@
+"""
+Búsqueda por descripción sobre el catálogo, en memoria
+Índice TF-IDF (palabras y pares de palabras de título, descripción y
+características) guardado como matriz dispersa en arrays contiguos de NumPy,
+ordenada por término (formato CSC): una consulta solo recorre las columnas de
+sus términos y el coseno se calcula vectorizado. Los filtros estructurados
+(tipo, operación, precio, ubicación, ambientes) se aplican como máscaras sobre
+columnas NumPy de los candidatos.
+
+El índice se actualiza de forma incremental: ante un cambio de versión del
+catálogo (ver cache.VersionCatalogo, que llama a `invalidar`) se leen solo las
+propiedades con `fecha_actualizacion` posterior a la última sincronización, se
+tokenizan y se rearma la matriz con operaciones vectorizadas. Por eso todo lo
+que escribe en `propiedades` (cargar_catalogo.py, init_db.py) actualiza
+`fecha_actualizacion`.
+"""
+
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from catalogo import PALABRAS_VACIAS, PROYECCION_RESUMEN, fila_resumen, palabras
+
+logger = logging.getLogger(__name__)
+
+# Campos que se leen de cada propiedad para el índice
+PROYECCION_INDICE = {
+    **PROYECCION_RESUMEN,
+    "descripcion": 1,
+    "caracteristicas": 1,
+    "tipo": 1,
+    "operacion": 1,
+    "ubicacion_tokens": 1,
+    "estado": 1,
+    "fecha_actualizacion": 1,
+}
+
+# Palabras frecuentes en consultas y avisos que no distinguen propiedades
+PALABRAS_VACIAS_DESCRIPCION = PALABRAS_VACIAS | {
+    "con", "sin", "para", "por", "un", "una", "unos", "unas", "que", "a", "o",
+    "muy", "su", "sus", "se", "lo", "le", "es", "mas", "busco", "quiero",
+}
+
+TIPOS = ("casa", "departamento", "terreno", "oficina", "local")
+OPERACIONES = ("venta", "alquiler")
+
+
+def _raiz(palabra: str) -> str:
+    """Singular aproximado ("piletas" → "pileta", "balcones" → "balcon")"""
+    if len(palabra) > 4 and palabra.endswith("es") and palabra[-3] not in "aeiou":
+        return palabra[:-2]
+    if len(palabra) > 3 and palabra.endswith("s"):
+        return palabra[:-1]
+    return palabra
+
+
+def terminos(texto: str) -> List[str]:
+    """Palabras normalizadas y pares de palabras consecutivas ("vista rio")"""
+    raices = [_raiz(p) for p in palabras(texto) if p not in PALABRAS_VACIAS_DESCRIPCION]
+    return raices + [f"{a} {b}" for a, b in zip(raices, raices[1:])]
+
+
+def texto_indexable(propiedad: Dict) -> str:
+    """Título, descripción y características de una propiedad"""
+    caracteristicas = propiedad.get("caracteristicas") or []
+    # Cada característica por separado: no se forman pares entre una y la siguiente
+    return " . ".join([propiedad.get("titulo") or "", propiedad.get("descripcion") or ""] + list(caracteristicas))
+
+
+class _Documento:
+    """Términos y campos filtrables de una propiedad indexada"""
+
+    __slots__ = ("terminos", "cuentas", "tipo", "operacion", "precio", "habitaciones", "banos",
+                 "ubicacion", "fila")
+
+    def __init__(self, propiedad: Dict, vocabulario: Dict[str, int]):
+        cuentas = Counter(terminos(texto_indexable(propiedad)))
+        for termino in cuentas:
+            vocabulario.setdefault(termino, len(vocabulario))
+        self.terminos = np.fromiter((vocabulario[t] for t in cuentas), dtype=np.int32, count=len(cuentas))
+        self.cuentas = np.fromiter(cuentas.values(), dtype=np.float32, count=len(cuentas))
+        self.tipo = TIPOS.index(propiedad["tipo"]) if propiedad.get("tipo") in TIPOS else -1
+        self.operacion = OPERACIONES.index(propiedad["operacion"]) if propiedad.get("operacion") in OPERACIONES else -1
+        self.precio = float(propiedad["precio"]) if propiedad.get("precio") is not None else math.nan
+        self.habitaciones = -1 if propiedad.get("habitaciones") is None else int(propiedad["habitaciones"])
+        self.banos = -1 if propiedad.get("banos") is None else int(propiedad["banos"])
+        self.ubicacion = propiedad.get("ubicacion_tokens") or []
+        self.fila = fila_resumen(propiedad)
+
+
+class _Matriz:
+    """Foto inmutable del índice: las consultas leen una y la sincronización arma otra"""
+
+    def __init__(self, documentos: List[_Documento], num_terminos: int):
+        n = len(documentos)
+        self.filas = [doc.fila for doc in documentos]
+        self.tipo = np.fromiter((d.tipo for d in documentos), dtype=np.int8, count=n)
+        self.operacion = np.fromiter((d.operacion for d in documentos), dtype=np.int8, count=n)
+        self.precio = np.fromiter((d.precio for d in documentos), dtype=np.float64, count=n)
+        self.habitaciones = np.fromiter((d.habitaciones for d in documentos), dtype=np.int16, count=n)
+        self.banos = np.fromiter((d.banos for d in documentos), dtype=np.int16, count=n)
+
+        # Filas de cada token de ubicación, para filtrar por prefijo como filtro_ubicacion
+        ubicaciones: Dict[str, List[int]] = {}
+        for fila, doc in enumerate(documentos):
+            for token in doc.ubicacion:
+                ubicaciones.setdefault(token, []).append(fila)
+        self.ubicaciones = {token: np.array(filas, dtype=np.int32) for token, filas in ubicaciones.items()}
+
+        # Matriz documento × término en COO, con una entrada por término presente
+        largos = np.fromiter((len(d.terminos) for d in documentos), dtype=np.int64, count=n)
+        columnas = np.concatenate([d.terminos for d in documentos]) if n else np.zeros(0, np.int32)
+        cuentas = np.concatenate([d.cuentas for d in documentos]) if n else np.zeros(0, np.float32)
+        renglones = np.repeat(np.arange(n, dtype=np.int32), largos)
+
+        # TF sublineal × IDF suavizado; cada documento normalizado (coseno = producto punto)
+        frecuencia = np.bincount(columnas, minlength=num_terminos)
+        self.idf = (np.log((1 + n) / (1 + frecuencia)) + 1).astype(np.float32)
+        pesos = (1 + np.log(cuentas)) * self.idf[columnas]
+        normas = np.sqrt(np.bincount(renglones, weights=pesos.astype(np.float64) ** 2, minlength=n))
+        pesos /= np.maximum(normas, 1e-12)[renglones].astype(np.float32)
+
+        # CSC: las entradas de cada término quedan contiguas en documentos/pesos
+        orden = np.argsort(columnas, kind="stable")
+        self.documentos = np.ascontiguousarray(renglones[orden])
+        self.pesos = np.ascontiguousarray(pesos[orden], dtype=np.float32)
+        self.inicio_columna = np.zeros(num_terminos + 1, dtype=np.int64)
+        np.cumsum(frecuencia, out=self.inicio_columna[1:])
+
+    def __len__(self) -> int:
+        return len(self.filas)
+
+    def mascara_ubicacion(self, texto: str) -> Optional[np.ndarray]:
+        """Cada palabra debe ser prefijo de algún token de ubicación (como filtro_ubicacion)"""
+        consulta = palabras(texto)
+        if not consulta:
+            return None
+        mascara = np.ones(len(self), dtype=bool)
+        for palabra in consulta:
+            coincide = np.zeros(len(self), dtype=bool)
+            for token, filas in self.ubicaciones.items():
+                if token.startswith(palabra):
+                    coincide[filas] = True
+            mascara &= coincide
+        return mascara
+
+
+class IndiceSemantico:
+    """Índice de búsqueda por descripción, sincronizado con la colección de propiedades"""
+
+    def __init__(self, resultados: int = 10):
+        self.resultados = resultados
+        self._vocabulario: Dict[str, int] = {}
+        self._documentos: Dict[str, _Documento] = {}
+        self._matriz: Optional[_Matriz] = None
+        self._marca: Optional[datetime] = None
+        self._pendiente = True
+        self._lock = threading.Lock()
+        self._lock_sincronizacion = threading.Lock()
+
+        # Estadísticas
+        self._consultas = 0
+        self._sincronizaciones = 0
+        self._ultima_sincronizacion_ms = 0.0
+
+    def invalidar(self):
+        """El catálogo cambió: la próxima consulta sincroniza (lo llama VersionCatalogo)"""
+        self._pendiente = True
+
+    def consulta_sincronizacion(self) -> Dict:
+        """Filtro de las propiedades a leer: todas la primera vez, luego solo las modificadas"""
+        if self._matriz is None or self._marca is None:
+            return {}
+        return {"fecha_actualizacion": {"$gte": self._marca}}
+
+    def actualizar(self, propiedades: List[Dict]):
+        """Incorpora propiedades nuevas o modificadas (las no disponibles salen) y rearma la matriz"""
+        inicio = time.monotonic()
+        with self._lock:
+            for propiedad in propiedades:
+                clave = str(propiedad["_id"])
+                if propiedad.get("estado", "disponible") != "disponible":
+                    self._documentos.pop(clave, None)
+                else:
+                    self._documentos[clave] = _Documento(propiedad, self._vocabulario)
+                fecha = propiedad.get("fecha_actualizacion")
+                if fecha is not None and (self._marca is None or fecha > self._marca):
+                    self._marca = fecha
+            if propiedades or self._matriz is None:
+                self._matriz = _Matriz(list(self._documentos.values()), len(self._vocabulario))
+            self._sincronizaciones += 1
+            self._ultima_sincronizacion_ms = (time.monotonic() - inicio) * 1000
+
+    def _tomar_sincronizacion(self, bloquear: bool) -> bool:
+        """True si hay que sincronizar y este llamador se encarga"""
+        if not self._pendiente and self._matriz is not None:
+            return False
+        # Si otro ya sincroniza, se sigue usando la matriz anterior (salvo que no haya ninguna)
+        if not self._lock_sincronizacion.acquire(blocking=bloquear and self._matriz is None):
+            return False
+        if not self._pendiente and self._matriz is not None:
+            self._lock_sincronizacion.release()
+            return False
+        self._pendiente = False
+        return True
+
+    def sincronizar(self, coleccion):
+        """Lee de MongoDB lo cambiado desde la última sincronización, si hace falta"""
+        if not self._tomar_sincronizacion(bloquear=True):
+            return
+        try:
+            propiedades = list(coleccion.find(self.consulta_sincronizacion(), PROYECCION_INDICE))
+            self.actualizar(propiedades)
+        except Exception:
+            self._pendiente = True
+            raise
+        finally:
+            self._lock_sincronizacion.release()
+        logger.info(f"Índice semántico: {len(propiedades)} propiedades leídas, "
+                    f"{len(self._documentos)} indexadas en {self._ultima_sincronizacion_ms:.0f} ms")
+
+    async def sincronizar_async(self, coleccion):
+        """Igual que sincronizar, con una colección de motor; la matriz se arma en un hilo"""
+        if not self._tomar_sincronizacion(bloquear=False):
+            return
+        try:
+            propiedades = await coleccion.find(self.consulta_sincronizacion(), PROYECCION_INDICE).to_list(None)
+            await asyncio.to_thread(self.actualizar, propiedades)
+        except Exception:
+            self._pendiente = True
+            raise
+        finally:
+            self._lock_sincronizacion.release()
+        logger.info(f"Índice semántico: {len(propiedades)} propiedades leídas, "
+                    f"{len(self._documentos)} indexadas en {self._ultima_sincronizacion_ms:.0f} ms")
+
+    def _vector_consulta(self, matriz: _Matriz, texto: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Términos de la consulta presentes en la matriz y sus pesos TF-IDF normalizados"""
+        # El vocabulario puede tener términos más nuevos que la matriz en uso
+        num_terminos = len(matriz.idf)
+        cuentas = Counter(t for t in terminos(texto) if self._vocabulario.get(t, num_terminos) < num_terminos)
+        if not cuentas:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        columnas = np.array([self._vocabulario[t] for t in cuentas], dtype=np.int64)
+        pesos = (1 + np.log(np.array(list(cuentas.values()), dtype=np.float32))) * matriz.idf[columnas]
+        return columnas, pesos / np.linalg.norm(pesos)
+
+    def buscar(self, texto: str, parametros: Optional[Dict] = None) -> List[Dict]:
+        """
+        Propiedades más parecidas a `texto` que cumplen los filtros estructurados
+        (mismos parámetros que buscar_propiedades), con su relevancia (coseno).
+        """
+        parametros = parametros or {}
+        matriz = self._matriz
+        self._consultas += 1
+        if matriz is None or not len(matriz):
+            return []
+
+        columnas, pesos_consulta = self._vector_consulta(matriz, texto)
+        if not len(columnas):
+            return []
+
+        puntajes = np.zeros(len(matriz), dtype=np.float32)
+        for columna, peso in zip(columnas, pesos_consulta):
+            desde, hasta = matriz.inicio_columna[columna], matriz.inicio_columna[columna + 1]
+            # Dentro de una columna cada documento aparece una sola vez
+            puntajes[matriz.documentos[desde:hasta]] += peso * matriz.pesos[desde:hasta]
+
+        candidatos = np.flatnonzero(puntajes)
+        candidatos = candidatos[self._filtrar(matriz, candidatos, parametros)]
+        if not len(candidatos):
+            return []
+
+        if len(candidatos) > self.resultados:
+            mejores = np.argpartition(-puntajes[candidatos], self.resultados - 1)[:self.resultados]
+            candidatos = candidatos[mejores]
+        candidatos = candidatos[np.argsort(-puntajes[candidatos], kind="stable")]
+
+        return [{**matriz.filas[i], "relevancia": round(float(puntajes[i]), 3)} for i in candidatos]
+
+    def _filtrar(self, matriz: _Matriz, candidatos: np.ndarray, parametros: Dict) -> np.ndarray:
+        """Máscara de los candidatos que cumplen los filtros estructurados"""
+        mascara = np.ones(len(candidatos), dtype=bool)
+        if parametros.get("tipo") in TIPOS:
+            mascara &= matriz.tipo[candidatos] == TIPOS.index(parametros["tipo"])
+        if parametros.get("operacion") in OPERACIONES:
+            mascara &= matriz.operacion[candidatos] == OPERACIONES.index(parametros["operacion"])
+        if "precio_min" in parametros:
+            mascara &= matriz.precio[candidatos] >= parametros["precio_min"]
+        if "precio_max" in parametros:
+            mascara &= matriz.precio[candidatos] <= parametros["precio_max"]
+        if "habitaciones" in parametros:
+            mascara &= matriz.habitaciones[candidatos] == parametros["habitaciones"]
+        if "banos" in parametros:
+            mascara &= matriz.banos[candidatos] == parametros["banos"]
+        if parametros.get("ubicacion"):
+            ubicacion = matriz.mascara_ubicacion(parametros["ubicacion"])
+            if ubicacion is not None:
+                mascara &= ubicacion[candidatos]
+        return mascara
+
+    def estadisticas(self) -> Dict:
+        """Tamaño del índice, consultas y última sincronización"""
+        matriz = self._matriz
+        return {
+            "propiedades": len(matriz) if matriz else 0,
+            "terminos": len(self._vocabulario),
+            "bytes": int(matriz.documentos.nbytes + matriz.pesos.nbytes + matriz.inicio_columna.nbytes) if matriz else 0,
+            "consultas": self._consultas,
+            "sincronizaciones": self._sincronizaciones,
+            "ultima_sincronizacion_ms": round(self._ultima_sincronizacion_ms, 1),
+        }
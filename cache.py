@@ -0,0 +1,233 @@
+"""
+Caché en memoria (LRU + TTL) para consultas al catálogo de propiedades
+Las entradas se invalidan cuando cambia la versión del catálogo, que los
+procesos que escriben propiedades incrementan en la colección `meta`.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+
+from serializacion import codificar_json
+
+logger = logging.getLogger(__name__)
+
+# Documento de `meta` que guarda la versión del catálogo
+CLAVE_VERSION_CATALOGO = "catalogo"
+
+
+def incrementar_version_catalogo(meta: Collection) -> int:
+    """Marca el catálogo como modificado; llamar después de escribir propiedades"""
+    documento = meta.find_one_and_update(
+        {"_id": CLAVE_VERSION_CATALOGO},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return documento["version"]
+
+
+def _tamano(valor: Any) -> int:
+    """Tamaño aproximado en bytes de un valor cacheado"""
+    return len(codificar_json(valor).encode("utf-8"))
+
+
+class CacheLRU:
+    """Caché LRU con expiración por TTL y límite de entradas y de memoria"""
+
+    def __init__(self, nombre: str, max_entradas: int = 1000, max_bytes: int = 16 * 1024 * 1024, ttl: float = 300.0):
+        self.nombre = nombre
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        # clave -> (valor, expira, tamaño)
+        self._entradas: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+
+        # Estadísticas
+        self._aciertos = 0
+        self._fallos = 0
+        self._desalojos = 0
+        self._expiradas = 0
+        self._invalidaciones = 0
+
+    def obtener(self, clave: str) -> Optional[Any]:
+        """Devuelve el valor cacheado o None si no está o expiró"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self._fallos += 1
+                return None
+
+            valor, expira, tamano = entrada
+            if expira < time.monotonic():
+                del self._entradas[clave]
+                self._bytes -= tamano
+                self._expiradas += 1
+                self._fallos += 1
+                return None
+
+            self._entradas.move_to_end(clave)
+            self._aciertos += 1
+            return valor
+
+    def guardar(self, clave: str, valor: Any):
+        """Guarda un valor, desalojando los menos usados si se superan los límites"""
+        tamano = _tamano(valor)
+        if tamano > self.max_bytes:
+            return
+
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= anterior[2]
+
+            self._entradas[clave] = (valor, time.monotonic() + self.ttl, tamano)
+            self._bytes += tamano
+
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                _, (_, _, tamano_desalojado) = self._entradas.popitem(last=False)
+                self._bytes -= tamano_desalojado
+                self._desalojos += 1
+
+    def claves(self) -> List[str]:
+        """Claves guardadas (pueden incluir entradas ya expiradas)"""
+        with self._lock:
+            return list(self._entradas)
+
+    def invalidar(self):
+        """Vacía la caché"""
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+            self._invalidaciones += 1
+
+    def estadisticas(self) -> Dict:
+        """Aciertos, fallos, desalojos y uso de memoria"""
+        with self._lock:
+            consultas = self._aciertos + self._fallos
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "aciertos": self._aciertos,
+                "fallos": self._fallos,
+                "tasa_aciertos": round(self._aciertos / consultas, 3) if consultas else 0.0,
+                "desalojos": self._desalojos,
+                "expiradas": self._expiradas,
+                "invalidaciones": self._invalidaciones,
+            }
+
+
+class VersionCatalogo:
+    """Sigue la versión del catálogo e invalida las cachés cuando cambia (cualquier objeto con `invalidar()`)"""
+
+    def __init__(
+        self,
+        meta: Collection,
+        propiedades: Collection,
+        caches: List[CacheLRU],
+        intervalo: float = 30.0,
+        usar_change_stream: bool = False,
+    ):
+        self.meta = meta
+        self.propiedades = propiedades
+        self.caches = caches
+        self.intervalo = intervalo
+        self.usar_change_stream = usar_change_stream
+
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._ultimo_chequeo = 0.0
+        self._pid_listener: Optional[int] = None
+
+    @property
+    def version(self) -> Optional[int]:
+        """Última versión conocida del catálogo"""
+        return self._version
+
+    def _actualizar(self, version: Optional[int]):
+        """Registra una versión e invalida las cachés si cambió"""
+        with self._lock:
+            if version == self._version:
+                return
+            anterior, self._version = self._version, version
+        if anterior is not None:
+            logger.info(f"Catálogo modificado (versión {anterior} → {version}), invalidando cachés")
+            for cache in self.caches:
+                cache.invalidar()
+
+    def _cambio(self):
+        """Evento del change stream: invalida siempre, aunque no se conozca versión previa"""
+        with self._lock:
+            self._version = (self._version or 0) + 1
+        logger.info(f"Catálogo modificado (change stream, versión local {self._version}), invalidando cachés")
+        for cache in self.caches:
+            cache.invalidar()
+
+    def _toca_verificar(self) -> bool:
+        """True como mucho una vez por intervalo"""
+        ahora = time.monotonic()
+        if ahora - self._ultimo_chequeo < self.intervalo:
+            return False
+        self._ultimo_chequeo = ahora
+        return True
+
+    def verificar(self):
+        """Consulta la versión del catálogo como mucho una vez por intervalo"""
+        if self.usar_change_stream:
+            self._iniciar_listener()
+            return
+
+        if not self._toca_verificar():
+            return
+
+        try:
+            documento = self.meta.find_one({"_id": CLAVE_VERSION_CATALOGO})
+        except Exception as e:
+            logger.error(f"Error leyendo versión del catálogo: {str(e)}")
+            return
+        self._actualizar(documento["version"] if documento else 0)
+
+    async def verificar_async(self):
+        """Igual que verificar, con `meta` de un driver asíncrono (motor); sin change stream"""
+        if not self._toca_verificar():
+            return
+
+        try:
+            documento = await self.meta.find_one({"_id": CLAVE_VERSION_CATALOGO})
+        except Exception as e:
+            logger.error(f"Error leyendo versión del catálogo: {str(e)}")
+            return
+        self._actualizar(documento["version"] if documento else 0)
+
+    def _iniciar_listener(self):
+        """Arranca (una vez por proceso) el hilo que escucha el change stream"""
+        with self._lock:
+            if self._pid_listener == os.getpid():
+                return
+            self._pid_listener = os.getpid()
+        threading.Thread(target=self._escuchar, name="catalogo-change-stream", daemon=True).start()
+
+    def _escuchar(self):
+        """Invalida las cachés ante cualquier escritura en propiedades"""
+        while True:
+            try:
+                with self.propiedades.watch() as stream:
+                    logger.info("Escuchando cambios del catálogo (change stream)")
+                    for _ in stream:
+                        self._cambio()
+            except Exception as e:
+                # Sin réplica set (p. ej. mongod local) no hay change streams
+                logger.error(f"Change stream del catálogo interrumpido: {str(e)}")
+                for cache in self.caches:
+                    cache.invalidar()
+                time.sleep(5)
@@ -0,0 +1,332 @@
+"""
+Carga masiva del catálogo de propiedades desde CSV o JSONL
+Lee el archivo en streaming (memoria acotada por el tamaño del lote), valida
+y normaliza cada fila y la escribe con upserts en `bulk_write`, usando como
+clave el identificador del aviso en el sistema de origen (`id_externo`).
+En modo completo, las propiedades cuyo `id_externo` no vino en el archivo se
+marcan `estado: no_disponible` en lugar de borrarse, así el catálogo nunca
+queda vacío mientras se recarga. Una fila inválida no da de baja su aviso y
+las propiedades sin `id_externo` (cargadas a mano) no se tocan. En modo delta solo se aplican las filas del
+archivo (una fila con `estado: no_disponible` da de baja el aviso).
+
+Uso:
+  python cargar_catalogo.py propiedades.csv
+  python cargar_catalogo.py novedades.jsonl --delta
+  python cargar_catalogo.py propiedades.csv --lote 2000 --sin-bajas
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import uuid
+import argparse
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from cache import incrementar_version_catalogo
+from catalogo import campos_ubicacion, crear_indices_busqueda
+
+# Variables de entorno
+MONGO_URI = os.getenv("MONGO_URI", "tu-mongo-uri-aqui")
+MONGO_DB = os.getenv("MONGO_DB", "inmobiliaria")
+
+TIPOS = {"casa", "departamento", "terreno", "oficina", "local"}
+OPERACIONES = {"venta", "alquiler"}
+ESTADO_DISPONIBLE = "disponible"
+ESTADO_NO_DISPONIBLE = "no_disponible"
+ESTADOS = {ESTADO_DISPONIBLE, "reservado", "vendido", ESTADO_NO_DISPONIBLE}
+
+# Campos de texto opcionales que se copian tal cual (sin espacios de más)
+CAMPOS_TEXTO = ("direccion", "descripcion")
+CAMPOS_ENTEROS = ("habitaciones", "banos")
+CAMPOS_DECIMALES = ("superficie_total", "superficie_cubierta")
+
+# Errores de validación que se muestran (el resto solo se cuenta)
+MAX_ERRORES_MOSTRADOS = 20
+
+# id_externo por update_many al marcar bajas
+LOTE_BAJAS = 1000
+
+
+def leer_filas(ruta: str, formato: Optional[str] = None) -> Iterator[Tuple[int, object]]:
+    """(número de línea, fila) de un CSV o JSONL; una línea JSON inválida viene como ValueError"""
+    formato = formato or ("csv" if ruta.lower().endswith(".csv") else "jsonl")
+    with open(ruta, encoding="utf-8-sig", newline="") as archivo:
+        if formato == "csv":
+            lector = csv.DictReader(archivo)
+            for fila in lector:
+                yield lector.line_num, fila
+            return
+
+        for numero, linea in enumerate(archivo, start=1):
+            if not linea.strip():
+                continue
+            try:
+                yield numero, json.loads(linea)
+            except ValueError as e:
+                yield numero, ValueError(f"JSON inválido: {str(e)}")
+
+
+def _vacio(valor) -> bool:
+    return valor is None or (isinstance(valor, str) and not valor.strip())
+
+
+def _numero(valor, campo: str, entero: bool = False):
+    """Número desde JSON o texto de CSV ("1500", "65,5"); None si viene vacío"""
+    if _vacio(valor):
+        return None
+    if isinstance(valor, str):
+        valor = valor.strip().replace(" ", "")
+        if "," in valor and "." not in valor:
+            valor = valor.replace(",", ".")
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"{campo} no es numérico: {valor!r}")
+    if numero < 0:
+        raise ValueError(f"{campo} negativo: {valor!r}")
+    if entero:
+        if numero != int(numero):
+            raise ValueError(f"{campo} no es entero: {valor!r}")
+        return int(numero)
+    return int(numero) if numero == int(numero) else numero
+
+
+def _lista(valor) -> List[str]:
+    """Características desde una lista JSON o un texto separado por | o ;"""
+    if _vacio(valor):
+        return []
+    if isinstance(valor, str):
+        separador = "|" if "|" in valor else ";"
+        valor = valor.split(separador)
+    return [str(v).strip() for v in valor if str(v).strip()]
+
+
+def _fecha(valor) -> Optional[datetime]:
+    """Fecha ISO (o datetime); None si viene vacía"""
+    if isinstance(valor, datetime):
+        return valor
+    if _vacio(valor):
+        return None
+    try:
+        return datetime.fromisoformat(str(valor).strip().replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"fecha_publicacion inválida: {valor!r}")
+
+
+def normalizar_propiedad(fila: Dict) -> Dict:
+    """Valida una fila y la convierte al documento de `propiedades`; lanza ValueError"""
+    id_externo = fila.get("id_externo")
+    if _vacio(id_externo):
+        raise ValueError("falta id_externo")
+
+    for campo in ("titulo", "tipo", "operacion", "precio", "ubicacion"):
+        if _vacio(fila.get(campo)):
+            raise ValueError(f"falta {campo}")
+
+    tipo = str(fila["tipo"]).strip().lower()
+    if tipo not in TIPOS:
+        raise ValueError(f"tipo desconocido: {fila['tipo']!r}")
+    operacion = str(fila["operacion"]).strip().lower()
+    if operacion not in OPERACIONES:
+        raise ValueError(f"operacion desconocida: {fila['operacion']!r}")
+    estado = str(fila.get("estado") or ESTADO_DISPONIBLE).strip().lower()
+    if estado not in ESTADOS:
+        raise ValueError(f"estado desconocido: {fila['estado']!r}")
+
+    ubicacion = " ".join(str(fila["ubicacion"]).split())
+    propiedad = {
+        "id_externo": str(id_externo).strip(),
+        "titulo": " ".join(str(fila["titulo"]).split()),
+        "tipo": tipo,
+        "operacion": operacion,
+        "precio": _numero(fila["precio"], "precio"),
+        "moneda": str(fila.get("moneda") or "USD").strip().upper(),
+        "ubicacion": ubicacion,
+        "caracteristicas": _lista(fila.get("caracteristicas")),
+        "estado": estado,
+        **campos_ubicacion(ubicacion),
+    }
+    fecha_publicacion = _fecha(fila.get("fecha_publicacion"))
+    if fecha_publicacion is not None:
+        propiedad["fecha_publicacion"] = fecha_publicacion
+    for campo in CAMPOS_TEXTO:
+        if not _vacio(fila.get(campo)):
+            propiedad[campo] = str(fila[campo]).strip()
+    for campo in CAMPOS_ENTEROS:
+        valor = _numero(fila.get(campo), campo, entero=True)
+        if valor is not None:
+            propiedad[campo] = valor
+    for campo in CAMPOS_DECIMALES:
+        valor = _numero(fila.get(campo), campo)
+        if valor is not None:
+            propiedad[campo] = valor
+    return propiedad
+
+
+def crear_indices_catalogo(coleccion: Collection):
+    """Índice único por id_externo (las propiedades cargadas a mano pueden no tenerlo)"""
+    coleccion.create_index(
+        [("id_externo", 1)],
+        unique=True,
+        partialFilterExpression={"id_externo": {"$exists": True}}
+    )
+    # Lecturas incrementales del índice semántico (ver busqueda_semantica.py)
+    coleccion.create_index([("fecha_actualizacion", 1)])
+
+
+def cargar(
+    coleccion: Collection,
+    filas: Iterable[Tuple[int, object]],
+    tamano_lote: int = 1000,
+    delta: bool = False,
+    marcar_bajas: bool = True,
+) -> Dict:
+    """
+    Escribe las filas en lotes de upserts y devuelve estadísticas.
+    En modo completo (sin `delta`) marca como no disponibles las propiedades
+    cuyo `id_externo` no estaba en las filas (válidas o no), salvo que haya
+    habido errores de escritura.
+    """
+    id_carga = uuid.uuid4().hex
+    ahora = datetime.now()
+    stats = {
+        "leidas": 0, "validas": 0, "invalidas": 0, "lotes": 0,
+        "insertadas": 0, "actualizadas": 0, "errores_escritura": 0, "bajas": 0,
+    }
+    lote: Dict[str, UpdateOne] = {}
+    # id_externo de todas las filas, también las inválidas: esas no son bajas
+    vistos: Set[str] = set()
+    inicio = time.monotonic()
+
+    def escribir():
+        if not lote:
+            return
+        try:
+            resultado = coleccion.bulk_write(list(lote.values()), ordered=False)
+            detalles = resultado.bulk_api_result
+        except BulkWriteError as e:
+            detalles = e.details
+            stats["errores_escritura"] += len(detalles.get("writeErrors", []))
+            for error in detalles.get("writeErrors", [])[:3]:
+                print(f"⚠️  Error de escritura: {error.get('errmsg')}")
+        stats["insertadas"] += detalles.get("nUpserted", 0)
+        stats["actualizadas"] += detalles.get("nMatched", 0)
+        stats["lotes"] += 1
+        lote.clear()
+
+        if stats["lotes"] % 10 == 0:
+            transcurrido = time.monotonic() - inicio
+            print(f"   … {stats['leidas']} filas ({stats['leidas'] / transcurrido:.0f} filas/s)")
+
+    for numero, fila in filas:
+        stats["leidas"] += 1
+        try:
+            if isinstance(fila, Exception):
+                raise fila
+            if not isinstance(fila, dict):
+                raise ValueError("la fila no es un objeto")
+            if not _vacio(fila.get("id_externo")):
+                vistos.add(str(fila["id_externo"]).strip())
+            propiedad = normalizar_propiedad(fila)
+        except ValueError as e:
+            stats["invalidas"] += 1
+            if stats["invalidas"] <= MAX_ERRORES_MOSTRADOS:
+                print(f"⚠️  Línea {numero}: {str(e)}")
+            continue
+
+        stats["validas"] += 1
+        al_insertar = {"fecha_alta": ahora}
+        if "fecha_publicacion" not in propiedad:
+            al_insertar["fecha_publicacion"] = ahora
+        actualizacion = {
+            "$set": {**propiedad, "id_carga": id_carga, "fecha_actualizacion": ahora},
+            "$setOnInsert": al_insertar,
+        }
+        if propiedad["estado"] == ESTADO_NO_DISPONIBLE:
+            actualizacion["$set"]["fecha_baja"] = ahora
+        else:
+            actualizacion["$unset"] = {"fecha_baja": ""}
+
+        # Si un id se repite dentro del lote gana la última fila
+        lote[propiedad["id_externo"]] = UpdateOne({"id_externo": propiedad["id_externo"]}, actualizacion, upsert=True)
+        if len(lote) >= tamano_lote:
+            escribir()
+    escribir()
+
+    # Bajas: lo que no vino en una carga completa deja de estar disponible
+    if not delta and marcar_bajas:
+        if stats["errores_escritura"] or not stats["validas"]:
+            print("⚠️  Bajas omitidas: la carga tuvo errores de escritura o ninguna fila válida")
+        else:
+            stats["bajas"] = marcar_bajas_faltantes(coleccion, vistos, ahora)
+
+    stats["segundos"] = round(time.monotonic() - inicio, 2)
+    stats["filas_por_segundo"] = round(stats["leidas"] / stats["segundos"], 1) if stats["segundos"] else 0.0
+    return stats
+
+
+def marcar_bajas_faltantes(coleccion: Collection, vistos: Set[str], ahora: datetime) -> int:
+    """Marca no disponibles las propiedades con un id_externo que no está en `vistos`"""
+    faltantes = [
+        documento["id_externo"]
+        for documento in coleccion.find(
+            {"id_externo": {"$exists": True}, "estado": {"$ne": ESTADO_NO_DISPONIBLE}},
+            {"id_externo": 1, "_id": 0}
+        )
+        if documento["id_externo"] not in vistos
+    ]
+    bajas = 0
+    for i in range(0, len(faltantes), LOTE_BAJAS):
+        resultado = coleccion.update_many(
+            {"id_externo": {"$in": faltantes[i:i + LOTE_BAJAS]}, "estado": {"$ne": ESTADO_NO_DISPONIBLE}},
+            {"$set": {"estado": ESTADO_NO_DISPONIBLE, "fecha_baja": ahora, "fecha_actualizacion": ahora}}
+        )
+        bajas += resultado.modified_count
+    return bajas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("archivo", help="CSV (con encabezado) o JSONL de propiedades")
+    parser.add_argument("--formato", choices=["csv", "jsonl"], help="por defecto según la extensión")
+    parser.add_argument("--lote", type=int, default=1000, help="operaciones por bulk_write")
+    parser.add_argument("--delta", action="store_true", help="solo aplicar las filas del archivo, sin bajas")
+    parser.add_argument("--sin-bajas", action="store_true", help="carga completa sin marcar bajas")
+    args = parser.parse_args()
+
+    client = MongoClient(MONGO_URI)
+    db = client[MONGO_DB]
+    crear_indices_catalogo(db.propiedades)
+    crear_indices_busqueda(db.propiedades)
+
+    stats = cargar(
+        db.propiedades,
+        leer_filas(args.archivo, args.formato),
+        tamano_lote=args.lote,
+        delta=args.delta,
+        marcar_bajas=not args.sin_bajas,
+    )
+
+    print(f"\n📊 Carga {'delta' if args.delta else 'completa'} de {args.archivo}:")
+    print(f"   Filas: {stats['leidas']} ({stats['validas']} válidas, {stats['invalidas']} inválidas)")
+    print(f"   Insertadas: {stats['insertadas']}  Actualizadas: {stats['actualizadas']}  "
+          f"Bajas: {stats['bajas']}  Errores de escritura: {stats['errores_escritura']}")
+    print(f"   {stats['lotes']} lotes en {stats['segundos']}s ({stats['filas_por_segundo']} filas/s)")
+
+    if stats["insertadas"] or stats["actualizadas"] or stats["bajas"]:
+        version = incrementar_version_catalogo(db.meta)
+        print(f"✅ Versión del catálogo: {version}")
+
+    client.close()
+    return 1 if stats["errores_escritura"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Utilidades del catálogo de propiedades
+Normalización de ubicaciones para búsquedas por índice (sin regex libres),
+filtros de búsqueda, orden estable con paginación por cursor e índices.
+"""
+
+import re
+import json
+import base64
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from bson import ObjectId
+
+# Separadores entre partes de una ubicación ("Centro, Rosario", "Córdoba y Santa Fe, Rosario")
+_SEPARADORES_PARTES = re.compile(r",|/|\s+y\s+|\s+-\s+")
+_NO_ALFANUMERICO = re.compile(r"[^a-z0-9]+")
+
+# Campos de la fila resumida que devuelve buscar_propiedades
+PROYECCION_RESUMEN = {
+    "titulo": 1,
+    "precio": 1,
+    "moneda": 1,
+    "ubicacion": 1,
+    "habitaciones": 1,
+    "banos": 1
+}
+
+# Orden estable de las búsquedas: precio y, a igual precio, _id
+ORDEN_BUSQUEDA = [("precio", 1), ("_id", 1)]
+TAMANO_PAGINA = 10
+
+# Índices compuestos para las formas de filtro de buscar_propiedades, en orden
+# ESR: igualdades (estado, operacion, tipo, ...), luego el orden y el rango (precio)
+INDICES_BUSQUEDA = [
+    ([("estado", 1), ("operacion", 1), ("tipo", 1), ("precio", 1), ("_id", 1)], "busqueda_operacion_tipo_precio"),
+    ([("estado", 1), ("operacion", 1), ("precio", 1), ("_id", 1)], "busqueda_operacion_precio"),
+    ([("estado", 1), ("operacion", 1), ("tipo", 1), ("habitaciones", 1), ("precio", 1), ("_id", 1)],
+     "busqueda_operacion_tipo_habitaciones_precio"),
+    # ubicacion_tokens se consulta por prefijo (rango): el orden por precio se hace en memoria,
+    # sobre un conjunto ya chico
+    ([("estado", 1), ("operacion", 1), ("ubicacion_tokens", 1), ("precio", 1)], "busqueda_operacion_ubicacion"),
+    ([("estado", 1), ("precio", 1), ("_id", 1)], "busqueda_precio"),
+    # Ubicación sin operación: el compuesto de arriba tendría que recorrer cada operación,
+    # así que se conserva el índice de un campo que acota el prefijo directamente
+    ([("ubicacion_tokens", 1)], "ubicacion_tokens_1"),
+]
+
+# Índices de un solo campo que los compuestos reemplazan
+INDICES_REEMPLAZADOS = ["tipo_1", "operacion_1", "precio_1"]
+
+# Palabras que no aportan a la búsqueda por ubicación
+PALABRAS_VACIAS = {"de", "del", "la", "las", "el", "los", "en", "y", "al"}
+
+
+def normalizar_texto(texto: str) -> str:
+    """Minúsculas, sin acentos y con espacios simples ("Córdoba" → "cordoba")"""
+    descompuesto = unicodedata.normalize("NFKD", texto or "")
+    sin_acentos = "".join(c for c in descompuesto if not unicodedata.combining(c))
+    return " ".join(sin_acentos.lower().split())
+
+
+def palabras(texto: str) -> List[str]:
+    """Palabras normalizadas de un texto, sin palabras vacías"""
+    return [p for p in _NO_ALFANUMERICO.split(normalizar_texto(texto)) if p and p not in PALABRAS_VACIAS]
+
+
+def campos_ubicacion(ubicacion: str) -> Dict:
+    """
+    Campos precomputados de ubicación para guardar en cada propiedad.
+    `ubicacion_tokens` contiene cada parte (barrio, ciudad, provincia) y cada
+    palabra, normalizadas, y se indexa (índice multikey).
+    """
+    normalizada = normalizar_texto(ubicacion)
+    tokens = []
+    for parte in _SEPARADORES_PARTES.split(normalizada):
+        parte = " ".join(palabras(parte))
+        if not parte:
+            continue
+        tokens.append(parte)
+        tokens.extend(parte.split())
+
+    return {
+        "ubicacion_norm": normalizada,
+        "ubicacion_tokens": list(dict.fromkeys(tokens))
+    }
+
+
+def filtro_ubicacion(texto: str) -> Dict:
+    """
+    Filtro de MongoDB por ubicación sobre `ubicacion_tokens`.
+    Cada palabra del usuario debe coincidir como prefijo anclado de algún token,
+    lo que usa el índice; el texto se escapa, así que no se interpreta como regex.
+    """
+    terminos = palabras(texto)
+    if not terminos:
+        return {}
+    return {"ubicacion_tokens": {"$all": [re.compile("^" + re.escape(t)) for t in terminos]}}
+
+
+def filtros_busqueda(parametros: Dict) -> Dict:
+    """Filtro de MongoDB a partir de los parámetros de buscar_propiedades"""
+    # Las bajas del catálogo quedan como `no_disponible` (ver cargar_catalogo.py)
+    filtros = {"estado": "disponible"}
+
+    if "tipo" in parametros:
+        filtros["tipo"] = parametros["tipo"]
+
+    if "operacion" in parametros:
+        filtros["operacion"] = parametros["operacion"]
+
+    if "ubicacion" in parametros:
+        filtros.update(filtro_ubicacion(parametros["ubicacion"]))
+
+    if "habitaciones" in parametros:
+        filtros["habitaciones"] = parametros["habitaciones"]
+
+    if "banos" in parametros:
+        filtros["banos"] = parametros["banos"]
+
+    if "precio_min" in parametros or "precio_max" in parametros:
+        filtros["precio"] = {}
+        if "precio_min" in parametros:
+            filtros["precio"]["$gte"] = parametros["precio_min"]
+        if "precio_max" in parametros:
+            filtros["precio"]["$lte"] = parametros["precio_max"]
+
+    return filtros
+
+
+def codificar_cursor(fila: Dict) -> str:
+    """Cursor opaco de "ver más" a partir de la última fila de una página"""
+    crudo = json.dumps([fila.get("precio"), fila["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(crudo.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def filtro_cursor(filtros: Dict, cursor: str) -> Dict:
+    """
+    Agrega a `filtros` la condición de "después del cursor" según ORDEN_BUSQUEDA.
+    El piso de precio va en el mismo campo, así el índice acota el rango. Sin
+    precio (null o faltante, que MongoDB ordena primero) sigue el resto de
+    los sin precio y después todos los que tienen.
+    """
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        precio, id_propiedad = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        id_propiedad = ObjectId(id_propiedad)
+    except Exception:
+        raise ValueError("Cursor inválido; repetir la búsqueda sin cursor")
+
+    filtros = dict(filtros)
+    if precio is None:
+        filtros["$or"] = [{"precio": {"$ne": None}}, {"_id": {"$gt": id_propiedad}}]
+        return filtros
+    rango = dict(filtros.get("precio", {}))
+    if "$gte" not in rango or rango["$gte"] < precio:
+        rango["$gte"] = precio
+    filtros["precio"] = rango
+    filtros["$or"] = [{"precio": {"$gt": precio}}, {"_id": {"$gt": id_propiedad}}]
+    return filtros
+
+
+def pagina(documentos: List[Dict], tamano: int = TAMANO_PAGINA) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Filas resumidas de hasta `tamano` documentos (se piden `tamano + 1` para
+    saber si hay más) y el cursor de la página siguiente, si la hay.
+    """
+    filas = [fila_resumen(doc) for doc in documentos[:tamano]]
+    siguiente = codificar_cursor(filas[-1]) if len(documentos) > tamano else None
+    return filas, siguiente
+
+
+def crear_indices_busqueda(coleccion) -> List[str]:
+    """Crea los índices compuestos de búsqueda y borra los de un campo reemplazados"""
+    existentes = set(coleccion.index_information())
+    for claves, nombre in INDICES_BUSQUEDA:
+        coleccion.create_index(claves, name=nombre)
+    borrados = [nombre for nombre in INDICES_REEMPLAZADOS if nombre in existentes]
+    for nombre in borrados:
+        coleccion.drop_index(nombre)
+    return borrados
+
+
+def fila_resumen(propiedad: Dict) -> Dict:
+    """Fila compacta de una propiedad proyectada con PROYECCION_RESUMEN"""
+    fila = {"id": str(propiedad["_id"])}
+    fila.update((campo, propiedad[campo]) for campo in PROYECCION_RESUMEN if campo in propiedad)
+    return fila
@@ -0,0 +1,384 @@
+"""
+Cola de mensajes entrantes con procesamiento ordenado por teléfono
+Los mensajes de un mismo teléfono se procesan en orden estricto y los de
+teléfonos distintos en paralelo, repartidos en un pool de workers.
+Con una ventana de fusión, los mensajes que un teléfono manda seguidos
+("hola", "busco depto", "2 ambientes") se unen en un único turno del agente.
+ColaMensajesAsync ofrece lo mismo con tareas de asyncio en lugar de hilos.
+"""
+
+import os
+import time
+import asyncio
+import heapq
+import logging
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ColaLlena(Exception):
+    """La cola alcanzó su límite de mensajes pendientes"""
+
+
+def _percentil(muestras: List[float], p: float) -> float:
+    """Percentil simple sobre una lista de muestras"""
+    if not muestras:
+        return 0.0
+    ordenadas = sorted(muestras)
+    indice = min(len(ordenadas) - 1, int(round(p / 100 * (len(ordenadas) - 1))))
+    return ordenadas[indice]
+
+
+class ColaMensajes:
+    """Cola con pool de workers: orden por teléfono, paralelismo entre teléfonos"""
+
+    def __init__(
+        self,
+        procesar: Callable[[str, str], None],
+        workers: int = 4,
+        max_pendientes: int = 1000,
+        max_por_telefono: int = 20,
+        ventana_fusion: float = 0.0,
+        max_espera_fusion: Optional[float] = None,
+    ):
+        self.procesar = procesar
+        self.workers = workers
+        self.max_pendientes = max_pendientes
+        self.max_por_telefono = max_por_telefono
+        # Silencio (segundos) que se espera antes de procesar; 0 desactiva la fusión
+        self.ventana_fusion = ventana_fusion
+        # Espera máxima desde el primer mensaje pendiente, aunque sigan llegando
+        self.max_espera_fusion = max_espera_fusion if max_espera_fusion is not None else 3 * ventana_fusion
+
+        self._cond = threading.Condition()
+        # Mensajes pendientes por teléfono: (texto, instante de recepción)
+        self._pendientes: Dict[str, Deque[Tuple[str, float]]] = {}
+        # Teléfonos sin worker asignado, ordenados por el instante en que quedan listos
+        self._agenda: List[Tuple[float, int, str]] = []
+        self._listo_en: Dict[str, float] = {}
+        self._secuencia = 0
+        # Teléfonos que un worker está procesando en este momento
+        self._activos: set = set()
+        self._total_pendientes = 0
+        self._hilos: List[threading.Thread] = []
+        self._pid: Optional[int] = None
+        self._detenida = False
+
+        # Estadísticas
+        self._encolados = 0
+        self._procesados = 0
+        self._errores = 0
+        self._rechazados = 0
+        self._fusionados = 0
+        self._max_profundidad = 0
+        self._esperas: Deque[float] = deque(maxlen=1000)
+        self._duraciones: Deque[float] = deque(maxlen=1000)
+
+    def iniciar(self):
+        """Arranca los workers (una vez por proceso, después del fork)"""
+        with self._cond:
+            if self._pid == os.getpid() and self._hilos:
+                return
+            self._pid = os.getpid()
+            self._detenida = False
+            self._hilos = []
+            for i in range(self.workers):
+                hilo = threading.Thread(
+                    target=self._worker, name=f"cola-worker-{i}", daemon=True
+                )
+                hilo.start()
+                self._hilos.append(hilo)
+        logger.info(f"Cola de mensajes iniciada con {self.workers} workers")
+
+    def _programar(self, telefono: str, ahora: float):
+        """Agenda un teléfono con pendientes para cuando termine su ventana de fusión"""
+        pendientes = self._pendientes[telefono]
+        if self.ventana_fusion > 0:
+            primero = pendientes[0][1]
+            ultimo = pendientes[-1][1]
+            listo_en = min(ultimo + self.ventana_fusion, primero + self.max_espera_fusion)
+        else:
+            listo_en = ahora
+
+        self._listo_en[telefono] = listo_en
+        self._secuencia += 1
+        heapq.heappush(self._agenda, (listo_en, self._secuencia, telefono))
+        self._cond.notify()
+
+    def encolar(self, telefono: str, texto: str):
+        """Agrega un mensaje a la cola; lanza ColaLlena si se supera algún límite"""
+        self.iniciar()
+        with self._cond:
+            if self._detenida:
+                raise ColaLlena("Cola detenida")
+            pendientes = self._pendientes.get(telefono)
+            if self._total_pendientes >= self.max_pendientes:
+                self._rechazados += 1
+                raise ColaLlena("Cola global llena")
+            if pendientes is not None and len(pendientes) >= self.max_por_telefono:
+                self._rechazados += 1
+                raise ColaLlena(f"Demasiados mensajes pendientes para {telefono}")
+
+            if pendientes is None:
+                pendientes = self._pendientes[telefono] = deque()
+            ahora = time.monotonic()
+            pendientes.append((texto, ahora))
+
+            self._total_pendientes += 1
+            self._encolados += 1
+            self._max_profundidad = max(self._max_profundidad, self._total_pendientes)
+
+            # Un teléfono en proceso se vuelve a agendar cuando termina su turno
+            if telefono not in self._activos:
+                self._programar(telefono, ahora)
+
+    def _tomar(self) -> Optional[Tuple[str, List[Tuple[str, float]]]]:
+        """Espera al próximo teléfono listo y toma sus mensajes (con el lock tomado)"""
+        while True:
+            ahora = time.monotonic()
+            # Descartar entradas reemplazadas por una reprogramación posterior
+            while self._agenda and self._listo_en.get(self._agenda[0][2]) != self._agenda[0][0]:
+                heapq.heappop(self._agenda)
+
+            if self._agenda:
+                listo_en, _, telefono = self._agenda[0]
+                # Al detener la cola no se espera el final de la ventana de fusión
+                if listo_en <= ahora or self._detenida:
+                    heapq.heappop(self._agenda)
+                    del self._listo_en[telefono]
+                    break
+                self._cond.wait(timeout=listo_en - ahora)
+            elif self._detenida:
+                return None
+            else:
+                self._cond.wait()
+
+        pendientes = self._pendientes[telefono]
+        if self.ventana_fusion > 0:
+            lote = list(pendientes)
+            pendientes.clear()
+        else:
+            lote = [pendientes.popleft()]
+        self._total_pendientes -= len(lote)
+        self._activos.add(telefono)
+        return telefono, lote
+
+    def _worker(self):
+        """Toma teléfonos listos y procesa sus mensajes como un único turno"""
+        while True:
+            with self._cond:
+                tomado = self._tomar()
+                if tomado is None:
+                    return
+            telefono, lote = tomado
+
+            texto = "\n".join(mensaje for mensaje, _ in lote)
+            if len(lote) > 1:
+                logger.info(f"{len(lote)} mensajes de {telefono} fusionados en un turno")
+
+            inicio = time.monotonic()
+            try:
+                self.procesar(telefono, texto)
+                exito = True
+            except Exception as e:
+                logger.error(f"Error procesando mensaje de {telefono}: {str(e)}")
+                exito = False
+            fin = time.monotonic()
+
+            with self._cond:
+                self._activos.discard(telefono)
+                if self._pendientes[telefono]:
+                    self._programar(telefono, fin)
+                else:
+                    del self._pendientes[telefono]
+
+                if exito:
+                    self._procesados += 1
+                else:
+                    self._errores += 1
+                self._fusionados += len(lote) - 1
+                self._esperas.append(inicio - lote[0][1])
+                self._duraciones.append(fin - inicio)
+                if self._detenida and not self._total_pendientes:
+                    self._cond.notify_all()
+
+    def detener(self, timeout: float = 10.0):
+        """Deja de aceptar trabajo nuevo y espera a que se vacíe la cola"""
+        limite = time.monotonic() + timeout
+        with self._cond:
+            self._detenida = True
+            self._cond.notify_all()
+            while (self._total_pendientes or self._activos) and time.monotonic() < limite:
+                self._cond.wait(timeout=max(0.0, limite - time.monotonic()))
+            if self._total_pendientes:
+                logger.warning(f"Cola detenida con {self._total_pendientes} mensajes sin procesar")
+
+    def estadisticas(self) -> Dict:
+        """Profundidad, saturación, fusión y latencias de la cola"""
+        with self._cond:
+            esperas = list(self._esperas)
+            duraciones = list(self._duraciones)
+            return {
+                "workers": self.workers,
+                "pendientes": self._total_pendientes,
+                "telefonos_pendientes": len(self._pendientes),
+                "en_proceso": len(self._activos),
+                "max_profundidad": self._max_profundidad,
+                "limite_pendientes": self.max_pendientes,
+                "encolados": self._encolados,
+                "procesados": self._procesados,
+                "errores": self._errores,
+                "rechazados": self._rechazados,
+                "ventana_fusion": self.ventana_fusion,
+                "turnos_ahorrados": self._fusionados,
+                "espera_p50_ms": round(_percentil(esperas, 50) * 1000, 1),
+                "espera_p95_ms": round(_percentil(esperas, 95) * 1000, 1),
+                "proceso_p50_ms": round(_percentil(duraciones, 50) * 1000, 1),
+                "proceso_p95_ms": round(_percentil(duraciones, 95) * 1000, 1),
+            }
+
+
+class ColaMensajesAsync:
+    """Cola sobre asyncio: una tarea por teléfono con pendientes, orden por teléfono"""
+
+    def __init__(
+        self,
+        procesar: Callable[[str, str], Awaitable[None]],
+        max_en_vuelo: int = 500,
+        max_pendientes: int = 5000,
+        max_por_telefono: int = 20,
+        ventana_fusion: float = 0.0,
+        max_espera_fusion: Optional[float] = None,
+    ):
+        self.procesar = procesar
+        self.max_en_vuelo = max_en_vuelo
+        self.max_pendientes = max_pendientes
+        self.max_por_telefono = max_por_telefono
+        self.ventana_fusion = ventana_fusion
+        self.max_espera_fusion = max_espera_fusion if max_espera_fusion is not None else 3 * ventana_fusion
+
+        # Mensajes pendientes por teléfono: (texto, instante de recepción)
+        self._pendientes: Dict[str, Deque[Tuple[str, float]]] = {}
+        self._tareas: Dict[str, asyncio.Task] = {}
+        self._semaforo: Optional[asyncio.Semaphore] = None
+        self._activos = 0
+        self._total_pendientes = 0
+        self._detenida = False
+
+        # Estadísticas
+        self._encolados = 0
+        self._procesados = 0
+        self._errores = 0
+        self._rechazados = 0
+        self._fusionados = 0
+        self._max_profundidad = 0
+        self._esperas: Deque[float] = deque(maxlen=1000)
+        self._duraciones: Deque[float] = deque(maxlen=1000)
+
+    def encolar(self, telefono: str, texto: str):
+        """Agrega un mensaje (desde el event loop); lanza ColaLlena si se supera algún límite"""
+        if self._detenida:
+            raise ColaLlena("Cola detenida")
+        pendientes = self._pendientes.get(telefono)
+        if self._total_pendientes >= self.max_pendientes:
+            self._rechazados += 1
+            raise ColaLlena("Cola global llena")
+        if pendientes is not None and len(pendientes) >= self.max_por_telefono:
+            self._rechazados += 1
+            raise ColaLlena(f"Demasiados mensajes pendientes para {telefono}")
+
+        if pendientes is None:
+            pendientes = self._pendientes[telefono] = deque()
+        pendientes.append((texto, time.monotonic()))
+        self._total_pendientes += 1
+        self._encolados += 1
+        self._max_profundidad = max(self._max_profundidad, self._total_pendientes)
+
+        # Una sola tarea por teléfono garantiza el orden de sus mensajes
+        if telefono not in self._tareas:
+            if self._semaforo is None:
+                self._semaforo = asyncio.Semaphore(self.max_en_vuelo)
+            self._tareas[telefono] = asyncio.get_running_loop().create_task(self._atender(telefono))
+
+    async def _esperar_ventana(self, pendientes: Deque[Tuple[str, float]]):
+        """Espera a que el teléfono deje de escribir (o se agote la espera máxima)"""
+        while not self._detenida:
+            listo_en = min(pendientes[-1][1] + self.ventana_fusion, pendientes[0][1] + self.max_espera_fusion)
+            espera = listo_en - time.monotonic()
+            if espera <= 0:
+                return
+            await asyncio.sleep(espera)
+
+    async def _atender(self, telefono: str):
+        """Procesa los mensajes de un teléfono hasta vaciar sus pendientes"""
+        pendientes = self._pendientes[telefono]
+        try:
+            while pendientes:
+                if self.ventana_fusion > 0:
+                    await self._esperar_ventana(pendientes)
+                    lote = list(pendientes)
+                    pendientes.clear()
+                else:
+                    lote = [pendientes.popleft()]
+                self._total_pendientes -= len(lote)
+
+                texto = "\n".join(mensaje for mensaje, _ in lote)
+                if len(lote) > 1:
+                    logger.info(f"{len(lote)} mensajes de {telefono} fusionados en un turno")
+
+                async with self._semaforo:
+                    self._activos += 1
+                    inicio = time.monotonic()
+                    try:
+                        await self.procesar(telefono, texto)
+                        self._procesados += 1
+                    except Exception as e:
+                        logger.error(f"Error procesando mensaje de {telefono}: {str(e)}")
+                        self._errores += 1
+                    finally:
+                        self._activos -= 1
+                fin = time.monotonic()
+
+                self._fusionados += len(lote) - 1
+                self._esperas.append(inicio - lote[0][1])
+                self._duraciones.append(fin - inicio)
+        finally:
+            # Sin await entre el último chequeo y la limpieza: no se pierden mensajes
+            del self._pendientes[telefono]
+            del self._tareas[telefono]
+
+    async def detener(self, timeout: float = 10.0):
+        """Deja de aceptar trabajo nuevo y espera a que se vacíe la cola"""
+        self._detenida = True
+        tareas = list(self._tareas.values())
+        if not tareas:
+            return
+        _, pendientes = await asyncio.wait(tareas, timeout=timeout)
+        if pendientes:
+            logger.warning(f"Cola detenida con {self._total_pendientes} mensajes sin procesar")
+
+    def estadisticas(self) -> Dict:
+        """Profundidad, saturación, fusión y latencias de la cola"""
+        esperas = list(self._esperas)
+        duraciones = list(self._duraciones)
+        return {
+            "max_en_vuelo": self.max_en_vuelo,
+            "pendientes": self._total_pendientes,
+            "telefonos_pendientes": len(self._pendientes),
+            "en_proceso": self._activos,
+            "max_profundidad": self._max_profundidad,
+            "limite_pendientes": self.max_pendientes,
+            "encolados": self._encolados,
+            "procesados": self._procesados,
+            "errores": self._errores,
+            "rechazados": self._rechazados,
+            "ventana_fusion": self.ventana_fusion,
+            "turnos_ahorrados": self._fusionados,
+            "espera_p50_ms": round(_percentil(esperas, 50) * 1000, 1),
+            "espera_p95_ms": round(_percentil(esperas, 95) * 1000, 1),
+            "proceso_p50_ms": round(_percentil(duraciones, 50) * 1000, 1),
+            "proceso_p95_ms": round(_percentil(duraciones, 95) * 1000, 1),
+        }
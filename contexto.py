@@ -0,0 +1,248 @@
+"""
+Gestión del contexto enviado a Claude
+Mantiene los últimos N turnos textuales, resume los anteriores en un
+resumen acumulado y recorta resultados de herramientas viejos, de modo que
+el tamaño de cada request quede acotado por un presupuesto de tokens.
+"""
+
+import logging
+from typing import Callable, Dict, List, Tuple
+
+from serializacion import codificar_json
+
+logger = logging.getLogger(__name__)
+
+# Aproximación de tokens: ~4 caracteres por token
+CARACTERES_POR_TOKEN = 4
+
+# Mensajes por turno contemplados al leer la ventana (usuario + tool loop + respuesta)
+MENSAJES_POR_TURNO = 8
+
+
+def _campo(bloque, nombre: str):
+    """Lee un campo de un bloque de contenido (dict o bloque del SDK)"""
+    if isinstance(bloque, dict):
+        return bloque.get(nombre)
+    return getattr(bloque, nombre, None)
+
+
+def es_inicio_de_turno(mensaje: Dict) -> bool:
+    """Un turno empieza con un mensaje de texto del usuario (no tool_result)"""
+    return mensaje["role"] == "user" and isinstance(mensaje["content"], str)
+
+
+def dividir_turnos(mensajes: List[Dict]) -> List[List[Dict]]:
+    """Agrupa los mensajes en turnos: texto del usuario + tool loop + respuesta"""
+    turnos: List[List[Dict]] = []
+    for mensaje in mensajes:
+        if es_inicio_de_turno(mensaje) or not turnos:
+            turnos.append([])
+        turnos[-1].append(mensaje)
+    return turnos
+
+
+def texto_mensaje(mensaje: Dict) -> str:
+    """Representación textual de un mensaje, usada para estimar y resumir"""
+    contenido = mensaje["content"]
+    if isinstance(contenido, str):
+        return contenido
+
+    partes = []
+    for bloque in contenido:
+        tipo = _campo(bloque, "type")
+        if tipo == "text":
+            partes.append(_campo(bloque, "text") or "")
+        elif tipo == "tool_use":
+            entrada = codificar_json(_campo(bloque, "input") or {})
+            partes.append(f"[{_campo(bloque, 'name')}({entrada})]")
+        elif tipo == "tool_result":
+            resultado = _campo(bloque, "content")
+            partes.append(resultado if isinstance(resultado, str) else codificar_json(resultado))
+    return "\n".join(partes)
+
+
+def estimar_tokens(mensajes: List[Dict]) -> int:
+    """Estimación rápida de tokens de una lista de mensajes"""
+    return sum(len(texto_mensaje(m)) for m in mensajes) // CARACTERES_POR_TOKEN
+
+
+def transcribir(mensajes: List[Dict], max_resultado: int = 200) -> str:
+    """Transcripción compacta de mensajes para el resumidor"""
+    lineas = []
+    for mensaje in mensajes:
+        contenido = mensaje["content"]
+        if mensaje["role"] == "user" and isinstance(contenido, str):
+            lineas.append(f"Cliente: {contenido}")
+        elif mensaje["role"] == "assistant":
+            texto = texto_mensaje(mensaje)
+            if texto:
+                lineas.append(f"Agente: {texto}")
+        else:
+            lineas.append(f"Resultado: {texto_mensaje(mensaje)[:max_resultado]}")
+    return "\n".join(lineas)
+
+
+class GestorContexto:
+    """Arma la ventana de mensajes para Claude dentro de un presupuesto de tokens"""
+
+    def __init__(
+        self,
+        resumir: Callable[[str, str], str],
+        turnos_verbatim: int = 6,
+        lote_resumen: int = 4,
+        presupuesto_tokens: int = 6000,
+        max_resultado: int = 400,
+    ):
+        self.resumir = resumir
+        self.turnos_verbatim = turnos_verbatim
+        self.lote_resumen = lote_resumen
+        self.presupuesto_tokens = presupuesto_tokens
+        self.max_resultado = max_resultado
+
+    def _compactar_turno(self, turno: List[Dict]) -> List[Dict]:
+        """Recorta los tool_result de un turno ya respondido"""
+        compactado = []
+        for mensaje in turno:
+            contenido = mensaje["content"]
+            if mensaje["role"] != "user" or isinstance(contenido, str):
+                compactado.append(mensaje)
+                continue
+
+            bloques = []
+            for bloque in contenido:
+                resultado = _campo(bloque, "content")
+                if (
+                    _campo(bloque, "type") == "tool_result"
+                    and isinstance(resultado, str)
+                    and len(resultado) > self.max_resultado
+                ):
+                    bloque = {
+                        "type": "tool_result",
+                        "tool_use_id": _campo(bloque, "tool_use_id"),
+                        "content": resultado[:self.max_resultado] + "… [resultado recortado]",
+                    }
+                bloques.append(bloque)
+            compactado.append({"role": mensaje["role"], "content": bloques})
+        return compactado
+
+    def _plegar(self, resumen: str, turnos: List[List[Dict]]) -> str:
+        """Incorpora turnos viejos al resumen acumulado"""
+        transcripcion = transcribir([m for turno in turnos for m in turno])
+        try:
+            return self.resumir(resumen, transcripcion)
+        except Exception as e:
+            return self._resumen_de_respaldo(resumen, transcripcion, e)
+
+    async def _plegar_async(self, resumen: str, turnos: List[List[Dict]]) -> str:
+        """Igual que _plegar, con un resumidor asíncrono"""
+        transcripcion = transcribir([m for turno in turnos for m in turno])
+        try:
+            return await self.resumir(resumen, transcripcion)
+        except Exception as e:
+            return self._resumen_de_respaldo(resumen, transcripcion, e)
+
+    def _resumen_de_respaldo(self, resumen: str, transcripcion: str, error: Exception) -> str:
+        """Sin resumidor: conservar lo último de la transcripción"""
+        logger.warning(f"Error resumiendo conversación: {str(error)}")
+        limite = self.presupuesto_tokens * CARACTERES_POR_TOKEN // 4
+        return ((resumen + "\n") if resumen else "") + transcripcion[-limite:]
+
+    @property
+    def max_mensajes(self) -> int:
+        """Mensajes que la migración deja sin resumir (el resto lo pliega antes, ver plegar_excedente)"""
+        return (self.turnos_verbatim + self.lote_resumen + 1) * MENSAJES_POR_TURNO
+
+    def plegar_excedente(self, pendientes: List[Dict], resumen: str = "") -> Tuple[str, int]:
+        """
+        Incorpora al resumen los mensajes aún no resumidos que quedan fuera de
+        los últimos `max_mensajes`, en lotes de a lo sumo `max_mensajes`, para
+        que el primer turno después de migrar no lea un historial enorme.
+        Devuelve (resumen, plegados).
+        """
+        lotes, inicio = self._lotes_excedente(pendientes)
+        for lote in lotes:
+            resumen = self._plegar(resumen, lote)
+        return resumen, inicio
+
+    async def plegar_excedente_async(self, pendientes: List[Dict], resumen: str = "") -> Tuple[str, int]:
+        """Igual que plegar_excedente, con un resumidor asíncrono"""
+        lotes, inicio = self._lotes_excedente(pendientes)
+        for lote in lotes:
+            resumen = await self._plegar_async(resumen, lote)
+        return resumen, inicio
+
+    def _lotes_excedente(self, pendientes: List[Dict]) -> Tuple[List[List[List[Dict]]], int]:
+        """Lotes de turnos a plegar y cantidad de mensajes que abarcan"""
+        inicio = max(0, len(pendientes) - self.max_mensajes)
+        while inicio < len(pendientes) and not es_inicio_de_turno(pendientes[inicio]):
+            inicio += 1
+        lotes: List[List[List[Dict]]] = []
+        lote: List[List[Dict]] = []
+        for turno in dividir_turnos(pendientes[:inicio]):
+            if lote and sum(len(t) for t in lote) + len(turno) > self.max_mensajes:
+                lotes.append(lote)
+                lote = []
+            lote.append(turno)
+        if lote:
+            lotes.append(lote)
+        return lotes, inicio
+
+    def construir(self, historial: List[Dict], resumen: str = "") -> Tuple[List[Dict], str, int]:
+        """
+        Arma los mensajes a enviar a partir de los mensajes aún no resumidos.
+        Devuelve (mensajes, resumen, plegados), donde `plegados` es la cantidad
+        de mensajes del inicio de `historial` que se incorporaron al resumen.
+        """
+        turnos, ventana, corte = self._ventana(historial, resumen)
+        plegados = 0
+        if corte:
+            resumen = self._plegar(resumen, turnos[:corte])
+            plegados = sum(len(t) for t in turnos[:corte])
+            logger.info(f"Contexto: {corte} turnos incorporados al resumen")
+        return self._armar(ventana, resumen), resumen, plegados
+
+    async def construir_async(self, historial: List[Dict], resumen: str = "") -> Tuple[List[Dict], str, int]:
+        """Igual que construir, con un resumidor asíncrono (`resumir` es una corrutina)"""
+        turnos, ventana, corte = self._ventana(historial, resumen)
+        plegados = 0
+        if corte:
+            resumen = await self._plegar_async(resumen, turnos[:corte])
+            plegados = sum(len(t) for t in turnos[:corte])
+            logger.info(f"Contexto: {corte} turnos incorporados al resumen")
+        return self._armar(ventana, resumen), resumen, plegados
+
+    def _ventana(self, historial: List[Dict], resumen: str) -> Tuple[List[List[Dict]], List[List[Dict]], int]:
+        """Turnos, turnos que entran en la ventana y cantidad de turnos a plegar"""
+        turnos = dividir_turnos(historial)
+
+        # Plegar en lotes para no invalidar el prefijo cacheado en cada turno
+        if len(turnos) > self.turnos_verbatim + self.lote_resumen:
+            corte = len(turnos) - self.turnos_verbatim
+        else:
+            corte = 0
+
+        # Presupuesto: sumar turnos (del más nuevo al más viejo) mientras entren
+        ventana = [turnos[-1]] + [self._compactar_turno(t) for t in reversed(turnos[corte:-1])]
+        ventana.reverse()
+        costo_resumen = len(resumen) // CARACTERES_POR_TOKEN
+        while len(ventana) > 1 and costo_resumen + sum(estimar_tokens(t) for t in ventana) > self.presupuesto_tokens:
+            ventana.pop(0)
+            corte += 1
+        return turnos, ventana, corte
+
+    def _armar(self, ventana: List[List[Dict]], resumen: str) -> List[Dict]:
+        """Mensajes de la ventana, con el resumen antepuesto al primero"""
+        mensajes = [m for turno in ventana for m in turno]
+        if resumen:
+            primero = mensajes[0]
+            contenido = primero["content"]
+            if isinstance(contenido, str):
+                contenido = [{"type": "text", "text": contenido}]
+            mensajes[0] = {
+                "role": primero["role"],
+                "content": [
+                    {"type": "text", "text": f"[Resumen de la conversación previa]\n{resumen}"},
+                    *contenido,
+                ],
+            }
+        return mensajes
@@ -0,0 +1,151 @@
+"""
+Deduplicación de webhooks de Green API por `idMessage`
+Green API reintenta los webhooks que respondemos lento; cada entrega se
+registra en un set en memoria con TTL y en una colección de MongoDB con
+índice TTL, para detectar reintentos también entre workers de gunicorn.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class Deduplicador:
+    """Registro de mensajes ya recibidos, en memoria y en MongoDB"""
+
+    def __init__(self, coleccion: Optional[Collection], ttl: float = 86400, max_memoria: int = 10000):
+        self.coleccion = coleccion
+        self.ttl = ttl
+        self.max_memoria = max_memoria
+
+        self._lock = threading.Lock()
+        # idMessage -> instante de expiración
+        self._vistos: "OrderedDict[str, float]" = OrderedDict()
+        self._indices_creados = False
+
+        # Estadísticas
+        self._recibidos = 0
+        self._duplicados_memoria = 0
+        self._duplicados_mongo = 0
+        self._errores = 0
+
+    def crear_indices(self):
+        """Índice TTL: MongoDB borra solo los registros viejos"""
+        self.coleccion.create_index("fecha", expireAfterSeconds=int(self.ttl))
+        self._indices_creados = True
+
+    def _recordar(self, id_mensaje: str):
+        """Agrega un id al set en memoria, respetando el límite de tamaño"""
+        self._vistos[id_mensaje] = time.monotonic() + self.ttl
+        self._vistos.move_to_end(id_mensaje)
+        while len(self._vistos) > self.max_memoria:
+            self._vistos.popitem(last=False)
+
+    def _visto_en_memoria(self, id_mensaje: str) -> bool:
+        """Registra el id en memoria y devuelve True si ya estaba"""
+        with self._lock:
+            self._recibidos += 1
+            expira = self._vistos.get(id_mensaje)
+            if expira is not None and expira > time.monotonic():
+                self._duplicados_memoria += 1
+                return True
+            self._recordar(id_mensaje)
+        return False
+
+    def _registrar_error(self, id_mensaje: str, error: Exception) -> bool:
+        """Ante una falla de MongoDB se procesa igual: mejor duplicar que perder"""
+        if isinstance(error, DuplicateKeyError):
+            with self._lock:
+                self._duplicados_mongo += 1
+            return True
+        logger.error(f"Error registrando webhook {id_mensaje}: {str(error)}")
+        with self._lock:
+            self._errores += 1
+        return False
+
+    def es_duplicado(self, id_mensaje: Optional[str]) -> bool:
+        """Registra el mensaje y devuelve True si ya se había recibido"""
+        if not id_mensaje:
+            return False
+        if self._visto_en_memoria(id_mensaje):
+            return True
+        if self.coleccion is None:
+            return False
+
+        try:
+            if not self._indices_creados:
+                self.crear_indices()
+            self.coleccion.insert_one({"_id": id_mensaje, "fecha": datetime.now(timezone.utc)})
+        except Exception as e:
+            return self._registrar_error(id_mensaje, e)
+        return False
+
+    def olvidar(self, id_mensaje: Optional[str]):
+        """Quita un mensaje del registro para que un reintento se procese"""
+        if not id_mensaje:
+            return
+        with self._lock:
+            self._vistos.pop(id_mensaje, None)
+        if self.coleccion is not None:
+            try:
+                self.coleccion.delete_one({"_id": id_mensaje})
+            except Exception as e:
+                logger.error(f"Error liberando webhook {id_mensaje}: {str(e)}")
+
+    def estadisticas(self) -> Dict:
+        """Webhooks recibidos y duplicados suprimidos"""
+        with self._lock:
+            return {
+                "recibidos": self._recibidos,
+                "duplicados": self._duplicados_memoria + self._duplicados_mongo,
+                "duplicados_memoria": self._duplicados_memoria,
+                "duplicados_mongo": self._duplicados_mongo,
+                "errores": self._errores,
+                "en_memoria": len(self._vistos),
+            }
+
+
+class DeduplicadorAsync(Deduplicador):
+    """Deduplicador sobre una colección de motor (driver asíncrono de MongoDB)"""
+
+    async def crear_indices(self):
+        """Índice TTL: MongoDB borra solo los registros viejos"""
+        await self.coleccion.create_index("fecha", expireAfterSeconds=int(self.ttl))
+        self._indices_creados = True
+
+    async def es_duplicado(self, id_mensaje: Optional[str]) -> bool:
+        """Registra el mensaje y devuelve True si ya se había recibido"""
+        if not id_mensaje:
+            return False
+        if self._visto_en_memoria(id_mensaje):
+            return True
+        if self.coleccion is None:
+            return False
+
+        try:
+            if not self._indices_creados:
+                await self.crear_indices()
+            await self.coleccion.insert_one({"_id": id_mensaje, "fecha": datetime.now(timezone.utc)})
+        except Exception as e:
+            return self._registrar_error(id_mensaje, e)
+        return False
+
+    async def olvidar(self, id_mensaje: Optional[str]):
+        """Quita un mensaje del registro para que un reintento se procese"""
+        if not id_mensaje:
+            return
+        with self._lock:
+            self._vistos.pop(id_mensaje, None)
+        if self.coleccion is not None:
+            try:
+                await self.coleccion.delete_one({"_id": id_mensaje})
+            except Exception as e:
+                logger.error(f"Error liberando webhook {id_mensaje}: {str(e)}")
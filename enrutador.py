@@ -0,0 +1,181 @@
+"""
+Enrutamiento de modelos por turno
+Cada turno elige una ruta según el mensaje del cliente:
+  - saludo:   "hola", "gracias", "dale" → modelo chico, presupuesto corto;
+              un "si"/"dale" que contesta una pregunta del agente ("¿agendo
+              la visita?") va como simple: suele disparar herramientas
+  - simple:   pedidos cortos que se resuelven despachando una herramienta
+              ("busco depto en alquiler en Rosario") → modelo chico
+  - compleja: comparaciones, recomendaciones, consultas largas → modelo grande
+Si el modelo chico falla, se queda sin presupuesto o responde vacío o con
+dudas, la llamada se repite con el modelo grande y el resto del turno sigue
+ahí (escalada); en streaming, solo si todavía no se envió texto al cliente.
+Cada llamada registra latencia, tokens y costo estimado por ruta y modelo
+para ajustar la política con datos.
+
+Cada modelo tiene su propio prefijo de prompt caching: mezclar modelos
+reparte las lecturas de caché entre dos prefijos.
+"""
+
+import re
+import threading
+from typing import Dict, Optional
+
+import metricas
+from catalogo import palabras
+
+# USD por millón de tokens: (input, output); escritura de caché 1,25× input, lectura 0,1×
+PRECIOS_POR_MTOK = {
+    "claude-sonnet-4-20250514": (3.0, 15.0),
+    "claude-3-5-haiku-20241022": (0.8, 4.0),
+}
+
+# Mensajes formados solo por estas palabras son saludos o acuses de recibo
+PALABRAS_SALUDO = {
+    "hola", "holis", "buenas", "buen", "buenos", "dia", "dias", "tarde", "tardes", "noche", "noches",
+    "gracias", "muchas", "mil", "ok", "oka", "okey", "dale", "listo", "perfecto", "genial", "joya",
+    "barbaro", "excelente", "bueno", "si", "no", "chau", "adios", "saludos", "hasta", "luego",
+    "pronto", "que", "tal", "como", "estas", "esta", "todo", "bien", "muy", "igualmente", "ah",
+}
+MAX_PALABRAS_SALUDO = 8
+
+# Afirmaciones y negaciones: si contestan una pregunta del agente no son un saludo
+PALABRAS_RESPUESTA = {
+    "si", "no", "dale", "ok", "oka", "okey", "listo", "perfecto", "bueno", "joya", "barbaro", "genial",
+}
+
+# Prefijos de palabras que piden razonar sobre varias opciones
+PREFIJOS_COMPLEJOS = (
+    "compar", "diferencia", "conviene", "recomend", "versus", "ventaja", "desventaja", "analiz",
+    "rentab", "invers", "financ", "credito", "hipotec", "cuota", "expensa", "ambas", "ambos",
+)
+MAX_PALABRAS_SIMPLE = 25
+
+# Frases con las que el modelo chico admite no poder responder
+_DUDAS = re.compile(r"no estoy segur|no tengo (esa |suficiente )?informaci|no puedo ayudar|no entiendo|no entendi")
+
+
+class Ruta:
+    """Modelo y presupuesto de tokens de salida para las llamadas de un turno"""
+
+    __slots__ = ("nombre", "modelo", "max_tokens")
+
+    def __init__(self, nombre: str, modelo: str, max_tokens: int):
+        self.nombre = nombre
+        self.modelo = modelo
+        self.max_tokens = max_tokens
+
+
+def clasificar(texto: str, anterior: Optional[str] = None) -> str:
+    """
+    saludo, simple o compleja según el mensaje del cliente y `anterior`, el
+    último mensaje del agente en la conversación (si lo hay).
+    """
+    terminos = palabras(texto)
+    if not terminos or (len(terminos) <= MAX_PALABRAS_SALUDO and all(t in PALABRAS_SALUDO for t in terminos)):
+        if anterior and "?" in anterior and any(t in PALABRAS_RESPUESTA for t in terminos):
+            return "simple"
+        return "saludo"
+    if (len(terminos) > MAX_PALABRAS_SIMPLE or texto.count("?") > 1
+            or any(t.startswith(PREFIJOS_COMPLEJOS) or t == "vs" for t in terminos)):
+        return "compleja"
+    return "simple"
+
+
+def costo(modelo: str, usage) -> float:
+    """Costo estimado en USD de una llamada según su usage"""
+    entrada, salida = PRECIOS_POR_MTOK.get(modelo, (0.0, 0.0))
+    escritura = getattr(usage, "cache_creation_input_tokens", None) or 0
+    lectura = getattr(usage, "cache_read_input_tokens", None) or 0
+    return (
+        usage.input_tokens * entrada
+        + escritura * entrada * 1.25
+        + lectura * entrada * 0.1
+        + usage.output_tokens * salida
+    ) / 1_000_000
+
+
+class Enrutador:
+    """Elige la ruta de cada turno, decide escaladas y acumula estadísticas por ruta"""
+
+    def __init__(
+        self,
+        modelo_chico: str,
+        modelo_grande: str,
+        tokens_saludo: int = 300,
+        tokens_simple: int = 800,
+        tokens_compleja: int = 1500,
+    ):
+        self.rutas = {
+            "saludo": Ruta("saludo", modelo_chico, tokens_saludo),
+            "simple": Ruta("simple", modelo_chico, tokens_simple),
+            "compleja": Ruta("compleja", modelo_grande, tokens_compleja),
+        }
+        self.modelo_grande = modelo_grande
+
+        self._lock = threading.Lock()
+        # ruta -> {turnos, llamadas, segundos, costo}; motivo -> escaladas
+        self._por_ruta: Dict[str, Dict] = {}
+        self._escaladas: Dict[str, int] = {}
+
+    def _stats(self, nombre: str) -> Dict:
+        return self._por_ruta.setdefault(nombre, {"turnos": 0, "llamadas": 0, "segundos": 0.0, "costo": 0.0})
+
+    def elegir(self, texto: str, anterior: Optional[str] = None) -> Ruta:
+        """Ruta inicial del turno (`anterior`: último mensaje del agente)"""
+        ruta = self.rutas[clasificar(texto, anterior)]
+        with self._lock:
+            self._stats(ruta.nombre)["turnos"] += 1
+        return ruta
+
+    def puede_escalar(self, ruta: Ruta) -> bool:
+        return ruta.modelo != self.modelo_grande
+
+    def motivo_escalada(self, ruta: Ruta, response, texto_emitido: bool) -> Optional[str]:
+        """Por qué repetir la llamada con el modelo grande, o None si la respuesta sirve"""
+        # Lo ya enviado por WhatsApp en streaming no se puede reemplazar
+        if not self.puede_escalar(ruta) or texto_emitido:
+            return None
+        if response.stop_reason == "max_tokens":
+            return "presupuesto"
+        if response.stop_reason == "tool_use":
+            return None
+        texto = "".join(block.text for block in response.content if hasattr(block, "text")).strip()
+        if not texto:
+            return "vacia"
+        if _DUDAS.search(" ".join(palabras(texto))):
+            return "duda"
+        return None
+
+    def escalar(self, ruta: Ruta, motivo: str) -> Ruta:
+        """Ruta con el modelo grande y al menos el presupuesto de una consulta compleja"""
+        with self._lock:
+            self._escaladas[motivo] = self._escaladas.get(motivo, 0) + 1
+        metricas.escaladas.inc(motivo=motivo)
+        return Ruta(f"{ruta.nombre}_escalada", self.modelo_grande, max(ruta.max_tokens, self.rutas["compleja"].max_tokens))
+
+    def registrar(self, ruta: Ruta, duracion: float, usage) -> float:
+        """Anota latencia y costo de una llamada; devuelve el costo"""
+        valor = costo(ruta.modelo, usage)
+        metricas.rutas.observar(duracion, ruta=ruta.nombre, modelo=ruta.modelo)
+        metricas.costo.inc(valor, ruta=ruta.nombre, modelo=ruta.modelo)
+        with self._lock:
+            stats = self._stats(ruta.nombre)
+            stats["llamadas"] += 1
+            stats["segundos"] += duracion
+            stats["costo"] += valor
+        return valor
+
+    def estadisticas(self) -> Dict:
+        """Turnos, llamadas, latencia media y costo por ruta, y escaladas por motivo"""
+        with self._lock:
+            rutas = {
+                nombre: {
+                    "turnos": s["turnos"],
+                    "llamadas": s["llamadas"],
+                    "latencia_media_ms": round(s["segundos"] / s["llamadas"] * 1000) if s["llamadas"] else 0,
+                    "costo_usd": round(s["costo"], 4),
+                }
+                for nombre, s in self._por_ruta.items()
+            }
+            return {"rutas": rutas, "escaladas": dict(self._escaladas)}
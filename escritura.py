@@ -0,0 +1,535 @@
+"""
+Escritura diferida (write-behind) de leads, visitas y mensajes
+guardar_lead, agendar_visita y el guardado de los mensajes del turno encolan
+sus operaciones (InsertOne, UpdateOne) en lugar de hacer un insert_one cada
+una dentro del tool loop; un hilo las manda cada `intervalo` segundos en un
+bulk_write por colección. `agregar()` devuelve la secuencia de cada operación
+y `vaciar(secuencias)` espera a que esas estén escritas, mandando ya la cola
+de su colección: así el turno asegura lo suyo antes de responder
+(ESCRITURA_MODO=turno) y de paso escribe lo que otros turnos encolaron en la
+misma colección (group commit).
+
+Reintentar un lote es idempotente: pymongo le pone el _id a cada documento
+insertado desde el primer intento (un duplicado en el reintento significa que
+ya estaba escrito) y los leads son upserts por teléfono. Los mensajes llevan un
+_id determinístico por turno (`clave_turno`), así el reintento de un turno que
+falló tampoco los duplica. Una operación que MongoDB rechaza (no un error de
+red) se descarta, y `vaciar(secuencias)` lanza EscrituraFallida si era del turno.
+EscrituraDiferidaAsync ofrece lo mismo sobre asyncio y motor.
+"""
+
+import os
+import time
+import hashlib
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import metricas
+
+logger = logging.getLogger(__name__)
+
+CODIGO_DUPLICADO = 11000
+
+# (secuencia, operación de pymongo)
+Pendiente = Tuple[int, Any]
+
+
+def _indice_leads(crear):
+    """Índice único de clientes.telefono para los leads con teléfono (create_index de pymongo o motor)"""
+    return crear("telefono", unique=True, partialFilterExpression={"telefono": {"$type": "string"}})
+
+
+def crear_indice_leads(clientes):
+    """Índice de los upserts por teléfono; sin unicidad si ya hay leads duplicados"""
+    try:
+        _indice_leads(clientes.create_index)
+    except Exception as e:
+        logger.error(f"Sin índice único de clientes.telefono (¿leads duplicados?): {str(e)}")
+        clientes.create_index("telefono")
+
+
+async def crear_indice_leads_async(clientes):
+    """crear_indice_leads sobre una colección de motor"""
+    try:
+        await _indice_leads(clientes.create_index)
+    except Exception as e:
+        logger.error(f"Sin índice único de clientes.telefono (¿leads duplicados?): {str(e)}")
+        await clientes.create_index("telefono")
+
+
+def normalizar_telefono(telefono: Optional[str]) -> Optional[str]:
+    """Solo los dígitos ("+54 9 341 555-1234" → "5493415551234"); None si no queda ninguno"""
+    digitos = "".join(c for c in str(telefono or "") if c.isdigit())
+    return digitos or None
+
+
+def operacion_lead(parametros: Dict, telefono: Optional[str] = None):
+    """
+    Escritura de guardar_lead: upsert por teléfono, así el mismo cliente no
+    acumula un lead por conversación. La clave es `telefono` (el de la
+    conversación de WhatsApp) y, sin él, el que informó el cliente
+    normalizado; el informado se guarda tal cual en `telefono_informado`.
+    Sin ninguno, un lead nuevo.
+    """
+    ahora = datetime.now()
+    datos = {"nombre": parametros["nombre"], "fecha_actualizacion": ahora}
+    al_crear = {"fecha_registro": ahora, "estado": "nuevo"}
+    for campo, vacio in (("email", None), ("preferencias", {}), ("telefono_informado", None)):
+        valor = parametros.get("telefono" if campo == "telefono_informado" else campo)
+        if valor:
+            datos[campo] = valor
+        else:
+            al_crear[campo] = vacio
+    clave = normalizar_telefono(telefono) or normalizar_telefono(parametros.get("telefono"))
+    if not clave:
+        return InsertOne({**datos, **al_crear, "telefono": None})
+    return UpdateOne({"telefono": clave}, {"$set": datos, "$setOnInsert": al_crear}, upsert=True)
+
+
+class EscrituraFallida(Exception):
+    """MongoDB rechazó una operación del turno: se descartó y no se va a reintentar"""
+
+
+def clave_turno(telefono: str, base: Optional[datetime], mensaje: str) -> str:
+    """
+    Identificador de un turno para el _id de sus mensajes: el teléfono, el
+    último mensaje que ya tenía la conversación (`base`) y el mensaje del
+    usuario. El reintento de un turno que falló da la misma clave, y sus
+    mensajes chocan con los del intento anterior en lugar de duplicarse.
+    """
+    marca = base.isoformat() if base is not None else "inicio"
+    resumen = hashlib.sha1(mensaje.encode("utf-8")).hexdigest()[:12]
+    return f"{telefono}:{marca}:{resumen}"
+
+
+class Plazo:
+    """
+    Vencimiento de una llamada a herramienta que puede encolar escrituras.
+    Un hilo (o tarea) que ya empezó no se puede detener: la herramienta
+    `comprometer()` antes de encolar y el turno `vencer()` al agotarse el
+    timeout; gana el primero, así una herramienta informada como vencida
+    nunca escribe y una que ya encoló se espera y se informa lo que hizo.
+    """
+
+    def __init__(self, limite: float):
+        self.limite = limite
+        self._lock = threading.Lock()
+        self._vencido = False
+        self._comprometido = False
+
+    def comprometer(self) -> bool:
+        """True si todavía se puede encolar (y desde ahora el turno espera el resultado)"""
+        with self._lock:
+            if self._vencido or time.monotonic() > self.limite:
+                self._vencido = True
+                return False
+            self._comprometido = True
+            return True
+
+    def vencer(self) -> bool:
+        """True si la llamada quedó vencida; False si ya encoló y hay que esperar su resultado"""
+        with self._lock:
+            if self._comprometido:
+                return False
+            self._vencido = True
+            return True
+
+
+class EscrituraDiferida:
+    """Buffer de escrituras agrupadas en bulk_write por colección, con un hilo por proceso"""
+
+    def __init__(self, intervalo: float = 0.5, max_lote: int = 1000, max_pendientes: int = 10000):
+        self.intervalo = intervalo
+        # Operaciones por bulk_write (el servidor igual las parte en lotes de 100k)
+        self.max_lote = max_lote
+        # Con más pendientes, el que encola escribe (contrapresión si MongoDB no responde)
+        self.max_pendientes = max_pendientes
+
+        self._lock = threading.Lock()
+        # Avisa a quien espera operaciones que otro vaciado está escribiendo
+        self._cond = threading.Condition(self._lock)
+        self._despertar = threading.Event()
+        # Cola por colección, en orden de secuencia
+        self._colas: Dict[str, Deque[Pendiente]] = {}
+        self._colecciones: Dict[str, Any] = {}
+        self._total_pendientes = 0
+        # Secuencias aún no escritas (encoladas o en un bulk_write en curso)
+        self._sin_escribir: Set[int] = set()
+        # Secuencias de los bulk_write en curso
+        self._en_vuelo: Set[int] = set()
+        # Secuencias descartadas por MongoDB → error, hasta que su turno las pida
+        self._fallidas: "OrderedDict[int, str]" = OrderedDict()
+        self._secuencia = 0
+        self._hilo: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._detenida = False
+
+        # Estadísticas
+        self._encoladas = 0
+        self._escritas = 0
+        self._duplicadas = 0
+        self._descartadas = 0
+        self._lotes = 0
+        self._compartidos = 0
+        self._errores = 0
+        self._max_profundidad = 0
+        self._tamanos: Deque[int] = deque(maxlen=1000)
+
+    def _reiniciar(self):
+        """Lo encolado en el proceso padre se escribe allá, no en cada fork"""
+        self._pid = os.getpid()
+        self._detenida = False
+        self._colas.clear()
+        self._colecciones.clear()
+        self._sin_escribir.clear()
+        self._en_vuelo.clear()
+        self._fallidas.clear()
+        self._total_pendientes = 0
+
+    def iniciar(self):
+        """Arranca el hilo de escritura (una vez por proceso, después del fork)"""
+        with self._lock:
+            if self._pid == os.getpid() and self._hilo is not None:
+                return
+            self._reiniciar()
+            self._hilo = threading.Thread(target=self._bucle, name="escritura-diferida", daemon=True)
+            self._hilo.start()
+        logger.info(f"Escritura diferida iniciada (cada {self.intervalo}s)")
+
+    @property
+    def pendientes(self) -> int:
+        return self._total_pendientes
+
+    def _encolar(self, coleccion, operaciones) -> Tuple[List[int], bool]:
+        """Agrega las operaciones; devuelve (sus secuencias, hay que vaciar ya)"""
+        with self._lock:
+            cola = self._colas.get(coleccion.name)
+            if cola is None:
+                cola = self._colas[coleccion.name] = deque()
+                self._colecciones[coleccion.name] = coleccion
+            secuencias = []
+            for operacion in operaciones:
+                self._secuencia += 1
+                cola.append((self._secuencia, operacion))
+                secuencias.append(self._secuencia)
+            self._sin_escribir.update(secuencias)
+            self._total_pendientes += len(secuencias)
+            self._encoladas += len(secuencias)
+            self._max_profundidad = max(self._max_profundidad, self._total_pendientes)
+            return secuencias, self._total_pendientes >= self.max_pendientes
+
+    def agregar(self, coleccion, *operaciones) -> List[int]:
+        """Encola operaciones de pymongo para `coleccion`; devuelve sus secuencias para vaciar()"""
+        self.iniciar()
+        secuencias, lleno = self._encolar(coleccion, operaciones)
+        if lleno:
+            self.vaciar(secuencias)
+        elif self._total_pendientes >= self.max_lote:
+            self._despertar.set()
+        return secuencias
+
+    def _faltan(self, secuencias: Optional[Iterable[int]]) -> Set[int]:
+        """Secuencias a esperar: las pedidas, o todo lo encolado hasta ahora"""
+        with self._lock:
+            if secuencias is None:
+                return set(self._sin_escribir)
+            return self._sin_escribir.intersection(secuencias)
+
+    def _informar(self, secuencias: Optional[Iterable[int]]):
+        """Lanza EscrituraFallida si MongoDB descartó alguna de las `secuencias` pedidas"""
+        if secuencias is None:
+            return
+        with self._lock:
+            errores = [self._fallidas.pop(s) for s in secuencias if s in self._fallidas]
+        if errores:
+            raise EscrituraFallida(f"{len(errores)} escritura(s) descartada(s): {errores[0]}")
+
+    def descartar(self, secuencias: Iterable[int]) -> int:
+        """
+        Saca de las colas las `secuencias` que todavía no se mandaron (las de un
+        turno que falló: el reintento las vuelve a encolar). Las que están en un
+        bulk_write en curso siguen; devuelve cuántas se sacaron.
+        """
+        quitar = set(secuencias)
+        sacadas = 0
+        with self._lock:
+            for cola in self._colas.values():
+                quedan = [pendiente for pendiente in cola if pendiente[0] not in quitar]
+                if len(quedan) < len(cola):
+                    sacadas += len(cola) - len(quedan)
+                    cola.clear()
+                    cola.extend(quedan)
+            self._total_pendientes -= sacadas
+            self._sin_escribir -= quitar - self._en_vuelo
+            for secuencia in quitar:
+                self._fallidas.pop(secuencia, None)
+        return sacadas
+
+    def _tomar(self, faltan: Set[int]) -> Optional[Tuple[str, List[Pendiente]]]:
+        """Cola de una colección con operaciones de `faltan` sin tomar (con el lock tomado)"""
+        for nombre, cola in self._colas.items():
+            if cola and any(secuencia in faltan for secuencia, _ in cola):
+                lote = [cola.popleft() for _ in range(min(self.max_lote, len(cola)))]
+                self._total_pendientes -= len(lote)
+                self._en_vuelo.update(secuencia for secuencia, _ in lote)
+                return nombre, lote
+        return None
+
+    def _devolver(self, nombre: str, pendientes: List[Pendiente]):
+        """Vuelve a poner al frente, en orden, lo que no se pudo escribir"""
+        with self._lock:
+            self._colas[nombre].extendleft(reversed(pendientes))
+            self._total_pendientes += len(pendientes)
+
+    def _confirmar(self, nombre: str, escritas: List[Pendiente]):
+        with self._lock:
+            self._sin_escribir.difference_update(secuencia for secuencia, _ in escritas)
+        self._lotes += 1
+        self._escritas += len(escritas)
+        self._tamanos.append(len(escritas))
+        metricas.lotes_escritura.observar(len(escritas), coleccion=nombre)
+
+    def _fallida(self, nombre: str, error: BulkWriteError, pendientes: List[Pendiente]) -> int:
+        """Registra la operación que cortó un bulk_write ordenado y devuelve su índice"""
+        if not error.details.get("writeErrors"):
+            # Solo errores de write concern: las operaciones se aplicaron
+            logger.warning(f"Write concern no confirmado en {nombre}: {error.details.get('writeConcernErrors')}")
+            return len(pendientes)
+        fallo = error.details["writeErrors"][0]
+        if fallo.get("code") == CODIGO_DUPLICADO:
+            # Un reintento de algo que ya se había escrito
+            self._duplicadas += 1
+        else:
+            self._descartadas += 1
+            logger.error(f"Escritura descartada en {nombre}: {fallo.get('errmsg')}")
+            # Queda para el vaciar() del turno que la encoló (las más viejas se olvidan)
+            with self._lock:
+                self._fallidas[pendientes[fallo["index"]][0]] = fallo.get("errmsg") or f"código {fallo.get('code')}"
+                while len(self._fallidas) > self.max_pendientes:
+                    self._fallidas.popitem(last=False)
+        return fallo["index"]
+
+    def _escribir(self, nombre: str, pendientes: List[Pendiente]) -> int:
+        """bulk_write ordenado de un lote; devuelve los hechos. Lo no escrito vuelve a la cola"""
+        coleccion = self._colecciones[nombre]
+        idas = 0
+        while pendientes:
+            try:
+                with metricas.medir("escritura"):
+                    coleccion.bulk_write([operacion for _, operacion in pendientes], ordered=True)
+                idas += 1
+                self._confirmar(nombre, pendientes)
+                pendientes = []
+            except BulkWriteError as e:
+                # Error de una operación puntual: se descarta y sigue el resto
+                idas += 1
+                indice = self._fallida(nombre, e, pendientes)
+                self._confirmar(nombre, pendientes[:indice + 1])
+                pendientes = pendientes[indice + 1:]
+            except Exception:
+                # Error de red o de servidor: se reintenta después
+                self._errores += 1
+                self._devolver(nombre, pendientes)
+                raise
+        return idas
+
+    def vaciar(self, secuencias: Optional[Iterable[int]] = None) -> int:
+        """
+        Espera a que las operaciones `secuencias` (todo lo encolado si es None)
+        estén escritas, escribiendo las colas de sus colecciones, y devuelve los
+        bulk_write que hizo esta llamada (0 si otro vaciado ya las escribió).
+        Dos vaciados pueden escribir a la vez la misma colección; el orden se
+        respeta dentro de cada lote (las escrituras de un teléfono llegan
+        serializadas por el lease del turno). Lanza el error de MongoDB si no
+        pudo (las operaciones quedan en la cola) y EscrituraFallida si MongoDB
+        descartó alguna de las `secuencias`.
+        """
+        faltan = self._faltan(secuencias)
+        idas = 0
+        espero = False
+        while True:
+            with self._cond:
+                faltan &= self._sin_escribir
+                if not faltan:
+                    if espero and not idas:
+                        self._compartidos += 1
+                    break
+                tomado = self._tomar(faltan)
+                if tomado is None:
+                    # Lo que falta lo está escribiendo otro vaciado
+                    espero = True
+                    self._cond.wait()
+                    continue
+            nombre, lote = tomado
+            try:
+                idas += self._escribir(nombre, lote)
+            finally:
+                with self._cond:
+                    self._en_vuelo.difference_update(secuencia for secuencia, _ in lote)
+                    self._cond.notify_all()
+        self._informar(secuencias)
+        return idas
+
+    def _bucle(self):
+        """Vacía las colas cada `intervalo` segundos o cuando se junta un lote completo"""
+        while not self._detenida:
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            if not self._total_pendientes:
+                continue
+            try:
+                self.vaciar()
+            except Exception as e:
+                logger.warning(f"Escritura diferida demorada ({self._total_pendientes} pendientes): {str(e)}")
+                time.sleep(self.intervalo)
+
+    def detener(self, timeout: float = 10.0):
+        """Escribe lo pendiente antes de terminar el proceso"""
+        self._detenida = True
+        self._despertar.set()
+        limite = time.monotonic() + timeout
+        while self._total_pendientes and time.monotonic() < limite:
+            try:
+                self.vaciar()
+            except Exception as e:
+                logger.error(f"Error escribiendo pendientes al detener: {str(e)}")
+                time.sleep(min(self.intervalo, max(0.0, limite - time.monotonic())))
+        if self._total_pendientes:
+            logger.warning(f"Escritura diferida detenida con {self._total_pendientes} operaciones sin escribir")
+
+    def estadisticas(self) -> Dict:
+        """Operaciones encoladas y escritas, y bulk_write hechos (idas y vueltas a MongoDB)"""
+        tamanos = list(self._tamanos)
+        return {
+            "intervalo": self.intervalo,
+            "pendientes": self._total_pendientes,
+            "max_profundidad": self._max_profundidad,
+            "encoladas": self._encoladas,
+            "escritas": self._escritas,
+            "duplicadas": self._duplicadas,
+            "descartadas": self._descartadas,
+            "bulk_writes": self._lotes,
+            "vaciados_compartidos": self._compartidos,
+            "errores": self._errores,
+            "operaciones_por_bulk_write": round(sum(tamanos) / len(tamanos), 1) if tamanos else 0.0,
+        }
+
+
+class EscrituraDiferidaAsync(EscrituraDiferida):
+    """EscrituraDiferida sobre asyncio: una tarea por proceso y bulk_write de motor"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond_async: Optional[asyncio.Condition] = None
+        self._despertar_async: Optional[asyncio.Event] = None
+        self._tarea: Optional[asyncio.Task] = None
+
+    def iniciar(self):
+        """Crea la tarea de escritura (desde el event loop)"""
+        if self._tarea is not None and not self._tarea.done():
+            return
+        self._reiniciar()
+        self._cond_async = asyncio.Condition()
+        self._despertar_async = asyncio.Event()
+        self._tarea = asyncio.get_running_loop().create_task(self._bucle())
+        logger.info(f"Escritura diferida iniciada (cada {self.intervalo}s)")
+
+    async def agregar(self, coleccion, *operaciones) -> List[int]:
+        """Encola operaciones para `coleccion`; devuelve sus secuencias para vaciar()"""
+        self.iniciar()
+        secuencias, lleno = self._encolar(coleccion, operaciones)
+        if lleno:
+            await self.vaciar(secuencias)
+        elif self._total_pendientes >= self.max_lote:
+            self._despertar_async.set()
+        return secuencias
+
+    async def _escribir(self, nombre: str, pendientes: List[Pendiente]) -> int:
+        """bulk_write ordenado de un lote; devuelve los hechos. Lo no escrito vuelve a la cola"""
+        coleccion = self._colecciones[nombre]
+        idas = 0
+        while pendientes:
+            try:
+                with metricas.medir("escritura"):
+                    await coleccion.bulk_write([operacion for _, operacion in pendientes], ordered=True)
+                idas += 1
+                self._confirmar(nombre, pendientes)
+                pendientes = []
+            except BulkWriteError as e:
+                idas += 1
+                indice = self._fallida(nombre, e, pendientes)
+                self._confirmar(nombre, pendientes[:indice + 1])
+                pendientes = pendientes[indice + 1:]
+            except Exception:
+                self._errores += 1
+                self._devolver(nombre, pendientes)
+                raise
+        return idas
+
+    async def vaciar(self, secuencias: Optional[Iterable[int]] = None) -> int:
+        """Espera a que `secuencias` estén escritas (ver EscrituraDiferida.vaciar)"""
+        if self._cond_async is None:
+            return 0
+        faltan = self._faltan(secuencias)
+        idas = 0
+        espero = False
+        while True:
+            async with self._cond_async:
+                faltan &= self._sin_escribir
+                if not faltan:
+                    if espero and not idas:
+                        self._compartidos += 1
+                    break
+                tomado = self._tomar(faltan)
+                if tomado is None:
+                    espero = True
+                    await self._cond_async.wait()
+                    continue
+            nombre, lote = tomado
+            try:
+                idas += await self._escribir(nombre, lote)
+            finally:
+                async with self._cond_async:
+                    self._en_vuelo.difference_update(secuencia for secuencia, _ in lote)
+                    self._cond_async.notify_all()
+        self._informar(secuencias)
+        return idas
+
+    async def _bucle(self):
+        while not self._detenida:
+            try:
+                await asyncio.wait_for(self._despertar_async.wait(), self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+            self._despertar_async.clear()
+            if not self._total_pendientes:
+                continue
+            try:
+                await self.vaciar()
+            except Exception as e:
+                logger.warning(f"Escritura diferida demorada ({self._total_pendientes} pendientes): {str(e)}")
+                await asyncio.sleep(self.intervalo)
+
+    async def detener(self, timeout: float = 10.0):
+        """Escribe lo pendiente antes de cerrar las conexiones"""
+        self._detenida = True
+        if self._tarea is None:
+            return
+        self._despertar_async.set()
+        await asyncio.wait([self._tarea], timeout=self.intervalo)
+        limite = time.monotonic() + timeout
+        while self._total_pendientes and time.monotonic() < limite:
+            try:
+                await self.vaciar()
+            except Exception as e:
+                logger.error(f"Error escribiendo pendientes al detener: {str(e)}")
+                await asyncio.sleep(min(self.intervalo, max(0.0, limite - time.monotonic())))
+        if self._total_pendientes:
+            logger.warning(f"Escritura diferida detenida con {self._total_pendientes} operaciones sin escribir")
@@ -0,0 +1,40 @@
+"""
+División de respuestas en streaming en mensajes de WhatsApp
+Acumula el texto que llega de Claude y emite cada bloque de párrafos en
+cuanto está completo, sin esperar al final de la respuesta.
+"""
+
+from typing import Callable
+
+SEPARADOR_PARRAFOS = "\n\n"
+
+
+class DivisorParrafos:
+    """Emite fragmentos cortados en límites de párrafo"""
+
+    def __init__(self, emitir: Callable[[str], None], min_caracteres: int = 200):
+        self.emitir = emitir
+        self.min_caracteres = min_caracteres
+        self._buffer = ""
+        self.emitidos = 0
+
+    def _emitir(self, texto: str):
+        """Emite un fragmento no vacío"""
+        texto = texto.strip()
+        if texto:
+            self.emitir(texto)
+            self.emitidos += 1
+
+    def agregar(self, texto: str):
+        """Agrega texto y emite lo que ya forma párrafos completos"""
+        self._buffer += texto
+        corte = self._buffer.rfind(SEPARADOR_PARRAFOS)
+        # Fragmentos muy cortos se juntan con el párrafo siguiente
+        if corte >= self.min_caracteres:
+            self._emitir(self._buffer[:corte])
+            self._buffer = self._buffer[corte + len(SEPARADOR_PARRAFOS):]
+
+    def cerrar(self):
+        """Emite lo que quede en el buffer al terminar la respuesta"""
+        self._emitir(self._buffer)
+        self._buffer = ""
@@ -0,0 +1,250 @@
+"""
+Cliente de Green API (WhatsApp) para mensajes salientes
+Conexiones keep-alive reutilizadas, timeouts de conexión/lectura, reintentos
+con backoff y jitter ante 429/5xx, y un token bucket que respeta la cuota de
+envío de la instancia. ClienteGreenAPIAsync hace lo mismo sobre httpx.
+"""
+
+import time
+import asyncio
+import random
+import logging
+import threading
+from typing import Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Respuestas que vale la pena reintentar
+ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+
+class LimitadorTasa:
+    """Token bucket: `tasa` envíos por segundo con ráfagas de hasta `capacidad`"""
+
+    def __init__(self, tasa: float, capacidad: int):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self._tokens = float(capacidad)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _tomar(self) -> float:
+        """Toma un token si hay; si no, devuelve cuánto falta para el próximo"""
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.tasa
+
+    def adquirir(self, timeout: Optional[float] = None) -> bool:
+        """Espera un token; devuelve False si no se consigue antes del timeout"""
+        limite = None if timeout is None else time.monotonic() + timeout
+        while True:
+            espera = self._tomar()
+            if not espera:
+                return True
+            if limite is not None and time.monotonic() + espera > limite:
+                return False
+            time.sleep(espera)
+
+    async def adquirir_async(self, timeout: Optional[float] = None) -> bool:
+        """Igual que adquirir, sin bloquear el event loop"""
+        limite = None if timeout is None else time.monotonic() + timeout
+        while True:
+            espera = self._tomar()
+            if not espera:
+                return True
+            if limite is not None and time.monotonic() + espera > limite:
+                return False
+            await asyncio.sleep(espera)
+
+
+class ClienteGreenAPI:
+    """Cliente HTTP reutilizable para la API de Green API"""
+
+    def __init__(
+        self,
+        url_base: str,
+        token: str,
+        timeout_conexion: float = 3.05,
+        timeout_lectura: float = 10.0,
+        reintentos: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        envios_por_segundo: float = 5.0,
+        rafaga: int = 10,
+        pool: int = 10,
+    ):
+        self.url_base = url_base.rstrip("/")
+        self.token = token
+        self.timeout = (timeout_conexion, timeout_lectura)
+        self.reintentos = reintentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limitador = LimitadorTasa(envios_por_segundo, rafaga)
+
+        self.session = self._crear_sesion(timeout_conexion, timeout_lectura, pool)
+
+        # Estadísticas
+        self._lock = threading.Lock()
+        self._enviados = 0
+        self._fallidos = 0
+        self._reintentos = 0
+
+    def _crear_sesion(self, timeout_conexion: float, timeout_lectura: float, pool: int):
+        """Sesión con pool de conexiones keep-alive (sin reintentos automáticos)"""
+        session = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=pool, pool_maxsize=pool, max_retries=0)
+        session.mount("https://", adaptador)
+        session.mount("http://", adaptador)
+        return session
+
+    def _espera_backoff(self, intento: int, response) -> float:
+        """Backoff exponencial con jitter completo; respeta Retry-After si viene"""
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return min(self.backoff_max, float(response.headers["Retry-After"]))
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** intento))
+
+    def llamar(self, metodo: str, payload: Dict) -> Dict:
+        """POST a un método de la API con rate limiting y reintentos"""
+        url = f"{self.url_base}/{metodo}/{self.token}"
+
+        for intento in range(self.reintentos + 1):
+            self.limitador.adquirir()
+            response = None
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+                if response.status_code not in ESTADOS_REINTENTABLES:
+                    response.raise_for_status()
+                    return response.json() if response.content else {}
+                error = f"HTTP {response.status_code}"
+            except requests.ConnectionError as e:
+                # Incluye timeouts de conexión; un timeout de lectura no se
+                # reintenta porque el mensaje pudo haberse enviado
+                error = str(e)
+
+            if intento == self.reintentos:
+                raise requests.HTTPError(f"{metodo} falló tras {intento + 1} intentos: {error}", response=response)
+
+            espera = self._espera_backoff(intento, response)
+            with self._lock:
+                self._reintentos += 1
+            logger.warning(f"Green API {metodo}: {error}, reintento en {espera:.2f}s")
+            time.sleep(espera)
+
+    def enviar_mensaje(self, telefono: str, mensaje: str) -> Dict:
+        """Envía un mensaje de texto a un chat individual"""
+        try:
+            resultado = self.llamar("sendMessage", {"chatId": f"{telefono}@c.us", "message": mensaje})
+        except Exception:
+            with self._lock:
+                self._fallidos += 1
+            raise
+        with self._lock:
+            self._enviados += 1
+        return resultado
+
+    def enviar_escribiendo(self, telefono: str, duracion_ms: int = 5000):
+        """Muestra el indicador "escribiendo..." en el chat (best effort, sin reintentos)"""
+        url = f"{self.url_base}/sendTyping/{self.token}"
+        if not self.limitador.adquirir(timeout=0):
+            return
+        try:
+            self.session.post(
+                url,
+                json={"chatId": f"{telefono}@c.us", "typingTime": duracion_ms},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            logger.debug(f"No se pudo enviar indicador de escritura: {str(e)}")
+
+    def precalentar(self) -> Dict:
+        """Abre una conexión keep-alive consultando el estado de la instancia"""
+        response = self.session.get(f"{self.url_base}/getStateInstance/{self.token}", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def estadisticas(self) -> Dict:
+        """Envíos exitosos, fallidos y reintentos"""
+        with self._lock:
+            return {
+                "enviados": self._enviados,
+                "fallidos": self._fallidos,
+                "reintentos": self._reintentos,
+            }
+
+
+class ClienteGreenAPIAsync(ClienteGreenAPI):
+    """Cliente de Green API sobre httpx.AsyncClient, para la app asíncrona"""
+
+    def _crear_sesion(self, timeout_conexion: float, timeout_lectura: float, pool: int):
+        """Cliente httpx con pool de conexiones keep-alive"""
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout_lectura, connect=timeout_conexion),
+            limits=httpx.Limits(max_connections=pool, max_keepalive_connections=pool),
+        )
+
+    async def llamar(self, metodo: str, payload: Dict) -> Dict:
+        """POST a un método de la API con rate limiting y reintentos"""
+        url = f"{self.url_base}/{metodo}/{self.token}"
+
+        for intento in range(self.reintentos + 1):
+            await self.limitador.adquirir_async()
+            response = None
+            try:
+                response = await self.session.post(url, json=payload)
+                if response.status_code not in ESTADOS_REINTENTABLES:
+                    response.raise_for_status()
+                    return response.json() if response.content else {}
+                error = f"HTTP {response.status_code}"
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+                # Un timeout de lectura no se reintenta: el mensaje pudo haberse enviado
+                error = str(e)
+
+            if intento == self.reintentos:
+                raise requests.HTTPError(f"{metodo} falló tras {intento + 1} intentos: {error}")
+
+            espera = self._espera_backoff(intento, response)
+            with self._lock:
+                self._reintentos += 1
+            logger.warning(f"Green API {metodo}: {error}, reintento en {espera:.2f}s")
+            await asyncio.sleep(espera)
+
+    async def enviar_mensaje(self, telefono: str, mensaje: str) -> Dict:
+        """Envía un mensaje de texto a un chat individual"""
+        try:
+            resultado = await self.llamar("sendMessage", {"chatId": f"{telefono}@c.us", "message": mensaje})
+        except Exception:
+            with self._lock:
+                self._fallidos += 1
+            raise
+        with self._lock:
+            self._enviados += 1
+        return resultado
+
+    async def enviar_escribiendo(self, telefono: str, duracion_ms: int = 5000):
+        """Muestra el indicador "escribiendo..." en el chat (best effort, sin reintentos)"""
+        url = f"{self.url_base}/sendTyping/{self.token}"
+        if not await self.limitador.adquirir_async(timeout=0):
+            return
+        try:
+            await self.session.post(url, json={"chatId": f"{telefono}@c.us", "typingTime": duracion_ms})
+        except httpx.HTTPError as e:
+            logger.debug(f"No se pudo enviar indicador de escritura: {str(e)}")
+
+    async def precalentar(self) -> Dict:
+        """Abre una conexión keep-alive consultando el estado de la instancia"""
+        response = await self.session.get(f"{self.url_base}/getStateInstance/{self.token}")
+        response.raise_for_status()
+        return response.json()
+
+    async def cerrar(self):
+        """Cierra las conexiones del pool"""
+        await self.session.aclose()
@@ -0,0 +1,35 @@
+"""
+Configuración de gunicorn (se carga sola desde el directorio de la app)
+Con preload el master importa main.py una sola vez y los workers nacen por
+fork con el código ya cargado; los clientes de MongoDB, Anthropic y Green API
+se crean recién en cada worker (recursos.py). Antes de aceptar pedidos, cada
+worker abre sus conexiones y carga el índice del catálogo (main.precalentar).
+Con WEBHOOK_ASINCRONO la cola de mensajes vive en la memoria del proceso: el
+orden por teléfono y la fusión solo valen dentro de un worker, así que en ese
+modo corre uno solo (el paralelismo lo dan los hilos de la cola, COLA_WORKERS).
+"""
+
+import os
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+WEBHOOK_ASINCRONO = os.getenv("WEBHOOK_ASINCRONO", "false").lower() == "true"
+if WEBHOOK_ASINCRONO:
+    workers = 1
+
+
+def on_starting(server):
+    """Con la cola en memoria, un solo worker aunque se pida otro número con -w"""
+    if WEBHOOK_ASINCRONO and server.num_workers != 1:
+        server.log.warning(
+            f"WEBHOOK_ASINCRONO=true: se ignoran {server.num_workers} workers, la cola exige uno solo"
+        )
+        server.num_workers = 1
+
+
+def post_worker_init(worker):
+    """Precalienta el worker después del fork y antes de que acepte pedidos"""
+    import main
+
+    if main.PRECALENTAR:
+        main.precalentar()
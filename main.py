@@ -4,15 +4,39 @@ Integración: Claude API + MongoDB Atlas + Green API
 """
 
 import os
-import json
+import time
+import atexit
 import logging
-from datetime import datetime
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from datetime import datetime, timedelta
+from typing import Callable, List, Dict, Optional, Tuple
 
-import requests
-from anthropic import Anthropic
-from pymongo import MongoClient
-from flask import Flask, request, jsonify
+from anthropic import Anthropic, APIError
+import pymongo
+from bson.objectid import ObjectId
+from pymongo import InsertOne, MongoClient
+from pymongo.errors import DuplicateKeyError
+from flask import Flask, Response, request, jsonify
+
+from bloqueo import Arrendamiento, BloqueoConversaciones, BloqueoPerdido, filtro_fencing
+from busqueda_semantica import IndiceSemantico
+from cache import CacheLRU, VersionCatalogo
+from catalogo import (
+    ORDEN_BUSQUEDA, PROYECCION_RESUMEN, TAMANO_PAGINA, filtro_cursor, filtros_busqueda, pagina
+)
+from cola import ColaMensajes, ColaLlena
+from contexto import GestorContexto, texto_mensaje
+from deduplicacion import Deduplicador
+from enrutador import Enrutador, Ruta
+from escritura import EscrituraDiferida, Plazo, clave_turno, crear_indice_leads, operacion_lead
+from fragmentos import DivisorParrafos
+from green_api import ClienteGreenAPI
+import metricas
+from migrar_historial import migrar_conversacion
+from prompts import HERRAMIENTAS, PROMPT_RESUMEN, SYSTEM_BLOQUES, mensajes_con_cache
+from recursos import BasePerezosa, PorProceso
+from respuestas import CacheRespuestas
+from serializacion import codificar_json, contenido_plano
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
@@ -24,157 +48,274 @@ app = Flask(__name__)
 # Variables de entorno
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB = os.getenv("MONGO_DB", "inmobiliaria")
+MONGO_POOL_MINIMO = int(os.getenv("MONGO_POOL_MINIMO", 2))
 GREEN_API_INSTANCE = os.getenv("GREEN_API_INSTANCE")
 GREEN_API_TOKEN = os.getenv("GREEN_API_TOKEN")
+GREEN_API_HOST = os.getenv("GREEN_API_HOST", "https://api.green-api.com")
+
+# Cliente saliente de Green API
+GREEN_API_TIMEOUT_CONEXION = float(os.getenv("GREEN_API_TIMEOUT_CONEXION", 3.05))
+GREEN_API_TIMEOUT_LECTURA = float(os.getenv("GREEN_API_TIMEOUT_LECTURA", 10))
+GREEN_API_REINTENTOS = int(os.getenv("GREEN_API_REINTENTOS", 3))
+GREEN_API_ENVIOS_POR_SEGUNDO = float(os.getenv("GREEN_API_ENVIOS_POR_SEGUNDO", 5))
+GREEN_API_RAFAGA = int(os.getenv("GREEN_API_RAFAGA", 10))
+
+# Modo asíncrono del webhook: encolar y responder 200 de inmediato
+WEBHOOK_ASINCRONO = os.getenv("WEBHOOK_ASINCRONO", "false").lower() == "true"
+COLA_WORKERS = int(os.getenv("COLA_WORKERS", 4))
+COLA_MAX_PENDIENTES = int(os.getenv("COLA_MAX_PENDIENTES", 1000))
+COLA_MAX_POR_TELEFONO = int(os.getenv("COLA_MAX_POR_TELEFONO", 20))
+# Fusión de mensajes seguidos de un mismo teléfono en un solo turno (0 = desactivada)
+COLA_VENTANA_FUSION = float(os.getenv("COLA_VENTANA_FUSION", 0))
+COLA_MAX_ESPERA_FUSION = float(os.getenv("COLA_MAX_ESPERA_FUSION", 3 * COLA_VENTANA_FUSION))
+
+# Deduplicación de webhooks reintentados por Green API
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", 86400))
+DEDUP_MAX_MEMORIA = int(os.getenv("DEDUP_MAX_MEMORIA", 10000))
+
+# Precalentamiento de cada worker antes de aceptar pedidos (ver gunicorn.conf.py)
+PRECALENTAR = os.getenv("PRECALENTAR", "true").lower() == "true"
+PRECALENTAR_TIMEOUT = float(os.getenv("PRECALENTAR_TIMEOUT", 5))
+
+# Bloqueo por teléfono entre workers/réplicas (lease con fencing en la colección `bloqueos`)
+BLOQUEO_CONVERSACIONES = os.getenv("BLOQUEO_CONVERSACIONES", "true").lower() == "true"
+BLOQUEO_DURACION = float(os.getenv("BLOQUEO_DURACION", 60))
+BLOQUEO_ESPERA_MAX = float(os.getenv("BLOQUEO_ESPERA_MAX", 90))
+
+# Contexto acotado: turnos textuales, resumen acumulado y presupuesto de tokens
+CONTEXTO_TURNOS = int(os.getenv("CONTEXTO_TURNOS", 6))
+CONTEXTO_LOTE_RESUMEN = int(os.getenv("CONTEXTO_LOTE_RESUMEN", 4))
+CONTEXTO_PRESUPUESTO_TOKENS = int(os.getenv("CONTEXTO_PRESUPUESTO_TOKENS", 6000))
+MODELO_RESUMEN = os.getenv("MODELO_RESUMEN", "claude-3-5-haiku-20241022")
+
+# Enrutamiento de modelos: el chico para saludos y pedidos simples, el grande para
+# consultas complejas y escaladas; presupuesto de tokens de salida por ruta
+ENRUTADOR_MODELOS = os.getenv("ENRUTADOR_MODELOS", "true").lower() == "true"
+MODELO_CHICO = os.getenv("MODELO_CHICO", "claude-3-5-haiku-20241022")
+MODELO_GRANDE = os.getenv("MODELO_GRANDE", "claude-sonnet-4-20250514")
+TOKENS_SALUDO = int(os.getenv("TOKENS_SALUDO", 300))
+TOKENS_SIMPLE = int(os.getenv("TOKENS_SIMPLE", 800))
+TOKENS_COMPLEJA = int(os.getenv("TOKENS_COMPLEJA", 1500))
+
+# Escritura diferida (write-behind) de leads, visitas y mensajes del turno:
+# turno = lo encolado se escribe antes de responder; diferida = todo se
+# escribe en segundo plano (si el proceso muere se pierden hasta
+# ESCRITURA_INTERVALO segundos de escrituras)
+ESCRITURA_MODO = os.getenv("ESCRITURA_MODO", "turno").lower()
+ESCRITURA_INTERVALO = float(os.getenv("ESCRITURA_INTERVALO", 0.5))
+# Diferida: espera máxima por los mensajes del turno anterior que otro proceso aún no escribió
+ESCRITURA_ESPERA = float(os.getenv("ESCRITURA_ESPERA", 2.0))
+ESCRITURA_MAX_LOTE = int(os.getenv("ESCRITURA_MAX_LOTE", 1000))
+ESCRITURA_MAX_PENDIENTES = int(os.getenv("ESCRITURA_MAX_PENDIENTES", 10000))
+
+# Ejecución concurrente de herramientas dentro de un turno
+HERRAMIENTAS_WORKERS = int(os.getenv("HERRAMIENTAS_WORKERS", 8))
+HERRAMIENTAS_TIMEOUT = float(os.getenv("HERRAMIENTAS_TIMEOUT", 10))
+TIEMPO_AGOTADO = {"success": False, "error": "Tiempo de espera agotado"}
 
+# Respuestas en streaming: cada párrafo se envía en cuanto está completo
+STREAMING_RESPUESTAS = os.getenv("STREAMING_RESPUESTAS", "false").lower() == "true"
+STREAMING_MIN_CARACTERES = int(os.getenv("STREAMING_MIN_CARACTERES", 200))
+
+# Caché de búsquedas y detalles de propiedades
+CACHE_PROPIEDADES_TTL = float(os.getenv("CACHE_PROPIEDADES_TTL", 300))
+CACHE_PROPIEDADES_MAX_ENTRADAS = int(os.getenv("CACHE_PROPIEDADES_MAX_ENTRADAS", 2000))
+CACHE_PROPIEDADES_MAX_BYTES = int(os.getenv("CACHE_PROPIEDADES_MAX_BYTES", 32 * 1024 * 1024))
+CACHE_VERSION_INTERVALO = float(os.getenv("CACHE_VERSION_INTERVALO", 30))
+CACHE_CHANGE_STREAM = os.getenv("CACHE_CHANGE_STREAM", "false").lower() == "true"
+
+# Caché de respuestas a primeros mensajes genéricos (opt-in); similitud 1 = solo texto idéntico
+CACHE_RESPUESTAS = os.getenv("CACHE_RESPUESTAS", "false").lower() == "true"
+CACHE_RESPUESTAS_TTL = float(os.getenv("CACHE_RESPUESTAS_TTL", 3600))
+CACHE_RESPUESTAS_MAX_ENTRADAS = int(os.getenv("CACHE_RESPUESTAS_MAX_ENTRADAS", 500))
+CACHE_RESPUESTAS_SIMILITUD = float(os.getenv("CACHE_RESPUESTAS_SIMILITUD", 1.0))
+
+# Clientes creados al primer uso en cada proceso (seguros con gunicorn --preload)
 # Cliente Anthropic
-anthropic_client = Anthropic(api_key=ANTHROPIC_API_KEY)
+anthropic_client = PorProceso(lambda: Anthropic(api_key=ANTHROPIC_API_KEY))
 
 # MongoDB
-mongo_client = MongoClient(MONGO_URI)
-db = mongo_client["inmobiliaria"]
+mongo_client = PorProceso(lambda: MongoClient(MONGO_URI, minPoolSize=MONGO_POOL_MINIMO))
+db = BasePerezosa(mongo_client, MONGO_DB)
 propiedades_col = db["propiedades"]
 conversaciones_col = db["conversaciones"]
+mensajes_col = db["mensajes"]
 clientes_col = db["clientes"]
 visitas_col = db["visitas"]
+meta_col = db["meta"]
+webhooks_col = db["webhooks_procesados"]
+
+# Registro de webhooks recibidos (memoria + colección con índice TTL)
+deduplicador = Deduplicador(webhooks_col, ttl=DEDUP_TTL, max_memoria=DEDUP_MAX_MEMORIA)
+
+# Leases por teléfono: un solo turno a la vez por conversación en todo el despliegue
+bloqueos = BloqueoConversaciones(
+    db["bloqueos"],
+    conversaciones_col,
+    duracion=BLOQUEO_DURACION,
+    espera_max=BLOQUEO_ESPERA_MAX
+)
+
+# Cachés del catálogo, invalidadas al cambiar su versión
+cache_busquedas = CacheLRU(
+    "busquedas",
+    max_entradas=CACHE_PROPIEDADES_MAX_ENTRADAS,
+    max_bytes=CACHE_PROPIEDADES_MAX_BYTES // 2,
+    ttl=CACHE_PROPIEDADES_TTL
+)
+cache_detalles = CacheLRU(
+    "detalles",
+    max_entradas=CACHE_PROPIEDADES_MAX_ENTRADAS,
+    max_bytes=CACHE_PROPIEDADES_MAX_BYTES // 2,
+    ttl=CACHE_PROPIEDADES_TTL
+)
+# Índice en memoria de buscar_por_descripcion, se sincroniza al cambiar el catálogo
+indice_semantico = IndiceSemantico(resultados=TAMANO_PAGINA)
+cache_respuestas = CacheRespuestas(
+    max_entradas=CACHE_RESPUESTAS_MAX_ENTRADAS,
+    ttl=CACHE_RESPUESTAS_TTL,
+    umbral_similitud=CACHE_RESPUESTAS_SIMILITUD
+)
+version_catalogo = VersionCatalogo(
+    meta_col,
+    propiedades_col,
+    [cache_busquedas, cache_detalles, indice_semantico, cache_respuestas],
+    intervalo=CACHE_VERSION_INTERVALO,
+    usar_change_stream=CACHE_CHANGE_STREAM
+)
+
+# Escritura diferida de leads, visitas y mensajes (bulk_write agrupados)
+escritura = EscrituraDiferida(
+    intervalo=ESCRITURA_INTERVALO,
+    max_lote=ESCRITURA_MAX_LOTE,
+    max_pendientes=ESCRITURA_MAX_PENDIENTES
+)
+
+# Pool acotado para las herramientas (los hilos se crean al primer uso)
+ejecutor_herramientas = ThreadPoolExecutor(
+    max_workers=HERRAMIENTAS_WORKERS,
+    thread_name_prefix="herramienta"
+)
 
 # Green API URL base
-GREEN_API_URL = f"https://api.green-api.com/waInstance{GREEN_API_INSTANCE}"
+GREEN_API_URL = f"{GREEN_API_HOST.rstrip('/')}/waInstance{GREEN_API_INSTANCE}"
+
+# Cliente de Green API: conexiones reutilizadas, timeouts, reintentos y rate limit
+green_api = ClienteGreenAPI(
+    GREEN_API_URL,
+    GREEN_API_TOKEN,
+    timeout_conexion=GREEN_API_TIMEOUT_CONEXION,
+    timeout_lectura=GREEN_API_TIMEOUT_LECTURA,
+    reintentos=GREEN_API_REINTENTOS,
+    envios_por_segundo=GREEN_API_ENVIOS_POR_SEGUNDO,
+    rafaga=GREEN_API_RAFAGA,
+    pool=max(10, COLA_WORKERS)
+)
+
+
+def resumir_conversacion(resumen_previo: str, transcripcion: str) -> str:
+    """Incorpora una transcripción al resumen acumulado usando Claude"""
+    contenido = f"Resumen actual:\n{resumen_previo or '(vacío)'}\n\nNuevos mensajes:\n{transcripcion}"
+    with metricas.medir("resumen", metricas.llamadas_claude, modelo=MODELO_RESUMEN):
+        response = anthropic_client().messages.create(
+            model=MODELO_RESUMEN,
+            max_tokens=500,
+            system=PROMPT_RESUMEN,
+            messages=[{"role": "user", "content": contenido}]
+        )
+    return "".join(block.text for block in response.content if hasattr(block, "text")).strip()
+
+
+gestor_contexto = GestorContexto(
+    resumir_conversacion,
+    turnos_verbatim=CONTEXTO_TURNOS,
+    lote_resumen=CONTEXTO_LOTE_RESUMEN,
+    presupuesto_tokens=CONTEXTO_PRESUPUESTO_TOKENS,
+)
 
 
 class AgenteInmobiliario:
     """Agente inmobiliario con IA"""
     
     def __init__(self):
-        self.model = "claude-sonnet-4-20250514"
-        self.max_tokens = 4000
+        self.enrutador = Enrutador(
+            MODELO_CHICO if ENRUTADOR_MODELOS else MODELO_GRANDE,
+            MODELO_GRANDE,
+            tokens_saludo=TOKENS_SALUDO,
+            tokens_simple=TOKENS_SIMPLE,
+            tokens_compleja=TOKENS_COMPLEJA
+        )
+        self._indice_leads = False
         
-    def obtener_propiedades(self, filtros: Dict = None) -> List[Dict]:
-        """Busca propiedades en MongoDB"""
+    def obtener_propiedades(self, filtros: Dict = None) -> Tuple[List[Dict], Optional[str]]:
+        """Busca propiedades en MongoDB en orden estable; devuelve una página y el cursor siguiente"""
         if filtros is None:
             filtros = {}
         
-        propiedades = list(propiedades_col.find(filtros).limit(10))
-        for prop in propiedades:
-            prop['_id'] = str(prop['_id'])
-        
-        return propiedades
+        cursor = (
+            propiedades_col.find(filtros, PROYECCION_RESUMEN)
+            .sort(ORDEN_BUSQUEDA)
+            .limit(TAMANO_PAGINA + 1)
+        )
+        return pagina(list(cursor))
     
     def crear_herramientas(self) -> List[Dict]:
         """Define herramientas disponibles para Claude"""
-        return [
-            {
-                "name": "buscar_propiedades",
-                "description": "Busca propiedades según criterios. Filtra por tipo, precio, ubicación, habitaciones, etc.",
-                "input_schema": {
-                    "type": "object",
-                    "properties": {
-                        "tipo": {
-                            "type": "string",
-                            "enum": ["casa", "departamento", "terreno", "oficina", "local"],
-                            "description": "Tipo de propiedad"
-                        },
-                        "operacion": {
-                            "type": "string",
-                            "enum": ["venta", "alquiler"],
-                            "description": "Venta o alquiler"
-                        },
-                        "precio_min": {"type": "number", "description": "Precio mínimo"},
-                        "precio_max": {"type": "number", "description": "Precio máximo"},
-                        "ubicacion": {"type": "string", "description": "Ciudad o zona"},
-                        "habitaciones": {"type": "integer", "description": "Número de habitaciones"},
-                        "banos": {"type": "integer", "description": "Número de baños"}
-                    },
-                    "required": []
-                }
-            },
-            {
-                "name": "obtener_detalle_propiedad",
-                "description": "Obtiene detalles completos de una propiedad por ID",
-                "input_schema": {
-                    "type": "object",
-                    "properties": {
-                        "propiedad_id": {
-                            "type": "string",
-                            "description": "ID de la propiedad"
-                        }
-                    },
-                    "required": ["propiedad_id"]
-                }
-            },
-            {
-                "name": "agendar_visita",
-                "description": "Agenda una visita a una propiedad",
-                "input_schema": {
-                    "type": "object",
-                    "properties": {
-                        "propiedad_id": {"type": "string", "description": "ID de la propiedad"},
-                        "nombre_cliente": {"type": "string", "description": "Nombre del cliente"},
-                        "telefono": {"type": "string", "description": "Teléfono del cliente"},
-                        "email": {"type": "string", "description": "Email del cliente"},
-                        "fecha_preferida": {"type": "string", "description": "Fecha preferida (YYYY-MM-DD)"},
-                        "horario_preferido": {"type": "string", "description": "Horario preferido"}
-                    },
-                    "required": ["propiedad_id", "nombre_cliente", "telefono"]
-                }
-            },
-            {
-                "name": "guardar_lead",
-                "description": "Guarda información de un cliente potencial",
-                "input_schema": {
-                    "type": "object",
-                    "properties": {
-                        "nombre": {"type": "string", "description": "Nombre del cliente"},
-                        "telefono": {"type": "string", "description": "Teléfono del cliente"},
-                        "email": {"type": "string", "description": "Email del cliente"},
-                        "preferencias": {"type": "object", "description": "Preferencias del cliente"}
-                    },
-                    "required": ["nombre"]
-                }
-            }
-        ]
+        return list(HERRAMIENTAS)
     
-    def ejecutar_herramienta(self, nombre: str, parametros: Dict) -> Dict:
-        """Ejecuta una herramienta específica"""
+    def ejecutar_herramienta(
+        self,
+        nombre: str,
+        parametros: Dict,
+        escrituras: Optional[List[int]] = None,
+        telefono: Optional[str] = None,
+        plazo: Optional[Plazo] = None
+    ) -> Dict:
+        """Ejecuta una herramienta específica; anota en `escrituras` las secuencias de lo que encoló"""
         try:
             if nombre == "buscar_propiedades":
-                filtros = {}
-                
-                if "tipo" in parametros:
-                    filtros["tipo"] = parametros["tipo"]
-                
-                if "operacion" in parametros:
-                    filtros["operacion"] = parametros["operacion"]
-                
-                if "ubicacion" in parametros:
-                    filtros["ubicacion"] = {"$regex": parametros["ubicacion"], "$options": "i"}
-                
-                if "habitaciones" in parametros:
-                    filtros["habitaciones"] = parametros["habitaciones"]
-                
-                if "banos" in parametros:
-                    filtros["banos"] = parametros["banos"]
-                
-                if "precio_min" in parametros or "precio_max" in parametros:
-                    filtros["precio"] = {}
-                    if "precio_min" in parametros:
-                        filtros["precio"]["$gte"] = parametros["precio_min"]
-                    if "precio_max" in parametros:
-                        filtros["precio"]["$lte"] = parametros["precio_max"]
-                
-                propiedades = self.obtener_propiedades(filtros)
+                filtros = filtros_busqueda(parametros)
+                if parametros.get("cursor"):
+                    filtros = filtro_cursor(filtros, parametros["cursor"])
+                version_catalogo.verificar()
+                clave = codificar_json(filtros)
+                resultado = cache_busquedas.obtener(clave)
+                if resultado is None:
+                    propiedades, siguiente = self.obtener_propiedades(filtros)
+                    resultado = {"propiedades": propiedades, "siguiente": siguiente}
+                    cache_busquedas.guardar(clave, resultado)
+                respuesta = {
+                    "success": True,
+                    "cantidad": len(resultado["propiedades"]),
+                    "propiedades": resultado["propiedades"]
+                }
+                # Hay más resultados: Claude puede pedirlos con cursor=siguiente
+                if resultado["siguiente"]:
+                    respuesta["siguiente"] = resultado["siguiente"]
+                return respuesta
+            
+            elif nombre == "buscar_por_descripcion":
+                version_catalogo.verificar()
+                indice_semantico.sincronizar(propiedades_col)
+                propiedades = indice_semantico.buscar(parametros["consulta"], parametros)
                 return {"success": True, "cantidad": len(propiedades), "propiedades": propiedades}
             
             elif nombre == "obtener_detalle_propiedad":
-                from bson.objectid import ObjectId
-                propiedad = propiedades_col.find_one({"_id": ObjectId(parametros["propiedad_id"])})
+                version_catalogo.verificar()
+                propiedad = cache_detalles.obtener(parametros["propiedad_id"])
+                if propiedad is None:
+                    propiedad = propiedades_col.find_one({"_id": ObjectId(parametros["propiedad_id"])})
+                    if propiedad:
+                        propiedad['_id'] = str(propiedad['_id'])
+                        cache_detalles.guardar(propiedad['_id'], propiedad)
                 if propiedad:
-                    propiedad['_id'] = str(propiedad['_id'])
                     return {"success": True, "propiedad": propiedad}
                 return {"success": False, "error": "Propiedad no encontrada"}
             
             elif nombre == "agendar_visita":
                 visita = {
+                    "_id": ObjectId(),
                     "propiedad_id": parametros["propiedad_id"],
                     "nombre_cliente": parametros["nombre_cliente"],
                     "telefono": parametros["telefono"],
@@ -184,117 +325,447 @@ class AgenteInmobiliario:
                     "estado": "pendiente",
                     "fecha_creacion": datetime.now()
                 }
-                resultado = visitas_col.insert_one(visita)
+                # El _id se genera acá: la visita se escribe después, con el próximo bulk_write
+                if not self._encolar(visitas_col, InsertOne(visita), escrituras, plazo):
+                    return dict(TIEMPO_AGOTADO)
                 return {
                     "success": True,
                     "mensaje": "Visita agendada correctamente",
-                    "visita_id": str(resultado.inserted_id)
+                    "visita_id": str(visita["_id"])
                 }
             
             elif nombre == "guardar_lead":
-                lead = {
-                    "nombre": parametros["nombre"],
-                    "telefono": parametros.get("telefono"),
-                    "email": parametros.get("email"),
-                    "preferencias": parametros.get("preferencias", {}),
-                    "fecha_registro": datetime.now(),
-                    "estado": "nuevo"
-                }
-                resultado = clientes_col.insert_one(lead)
+                if not self._indice_leads:
+                    crear_indice_leads(clientes_col)
+                    self._indice_leads = True
+                # La clave del lead es el teléfono de la conversación, no el que escribió el cliente
+                if not self._encolar(clientes_col, operacion_lead(parametros, telefono), escrituras, plazo):
+                    return dict(TIEMPO_AGOTADO)
                 return {
                     "success": True,
                     "mensaje": "Lead guardado correctamente",
-                    "cliente_id": str(resultado.inserted_id)
+                    "telefono": telefono or parametros.get("telefono")
                 }
             
             return {"success": False, "error": "Herramienta no reconocida"}
         
         except Exception as e:
             logger.error(f"Error ejecutando herramienta {nombre}: {str(e)}")
+            metricas.errores.inc(etapa="herramienta")
             return {"success": False, "error": str(e)}
     
-    def procesar_mensaje(self, mensaje: str, telefono: str) -> str:
-        """Procesa un mensaje y genera respuesta"""
+    def _encolar(self, coleccion, operacion, escrituras: Optional[List[int]], plazo: Optional[Plazo]) -> bool:
+        """Encola la escritura de una herramienta; False si su plazo ya venció"""
+        if plazo is not None and not plazo.comprometer():
+            return False
+        secuencias = escritura.agregar(coleccion, operacion)
+        if escrituras is not None:
+            escrituras.extend(secuencias)
+        return True
+    
+    def _ejecutar_medido(self, nombre: str, parametros: Dict, escrituras: List[int], telefono: str, plazo: Plazo):
+        """Ejecuta una herramienta y devuelve (resultado, duración)"""
+        inicio = time.monotonic()
+        resultado = self.ejecutar_herramienta(nombre, parametros, escrituras, telefono, plazo)
+        duracion = time.monotonic() - inicio
+        metricas.herramientas.observar(duracion, herramienta=nombre)
+        return resultado, duracion
+    
+    def ejecutar_herramientas(self, bloques: List, escrituras: List[int], telefono: str) -> List[Dict]:
+        """
+        Ejecuta en paralelo los tool_use de un turno (de la conversación de
+        `telefono`) y arma los tool_result en orden; `escrituras` junta las
+        secuencias de lo que encolaron. Cada llamada, aunque sea una sola, corre
+        en el pool con HERRAMIENTAS_TIMEOUT.
+        """
+        inicio = time.monotonic()
+        limite = inicio + HERRAMIENTAS_TIMEOUT
+        plazos = [Plazo(limite) for _ in bloques]
+        futuros = [
+            ejecutor_herramientas.submit(self._ejecutar_medido, block.name, block.input, escrituras, telefono, plazo)
+            for block, plazo in zip(bloques, plazos)
+        ]
         
-        # Obtener o crear historial
-        conversacion = conversaciones_col.find_one({"telefono": telefono})
+        tool_results = []
+        secuencial = 0.0
+        for i, block in enumerate(bloques):
+            try:
+                resultado, duracion = futuros[i].result(timeout=max(0.0, limite - time.monotonic()))
+            except FuturesTimeout:
+                if plazos[i].vencer():
+                    # El hilo sigue, pero ya no puede encolar escrituras
+                    futuros[i].cancel()
+                    logger.error(f"Timeout ejecutando herramienta {block.name}")
+                    metricas.errores.inc(etapa="herramienta")
+                    resultado = dict(TIEMPO_AGOTADO)
+                    duracion = HERRAMIENTAS_TIMEOUT
+                else:
+                    # Ya encoló su escritura: se informa lo que hizo
+                    resultado, duracion = futuros[i].result()
+            secuencial += duracion
+            tool_results.append({
+                "type": "tool_result",
+                "tool_use_id": block.id,
+                "content": codificar_json(resultado)
+            })
         
-        if not conversacion:
-            conversacion = {
-                "telefono": telefono,
-                "historial": [],
-                "fecha_inicio": datetime.now(),
+        total = time.monotonic() - inicio
+        if len(bloques) > 1:
+            logger.info(
+                f"Herramientas: {len(bloques)} llamadas en {total * 1000:.0f} ms "
+                f"(secuencial {secuencial * 1000:.0f} ms, ahorro {(secuencial - total) * 1000:.0f} ms)"
+            )
+        
+        return tool_results
+    
+    def _llamar_enrutado(
+        self,
+        mensajes: List[Dict],
+        uso: Dict,
+        estado: Dict,
+        al_fragmento: Optional[Callable[[str], None]] = None,
+        tiempos: Optional[Dict] = None
+    ):
+        """
+        Llama a Claude con la ruta del turno (estado["ruta"]). Si el modelo
+        chico falla, agota su presupuesto o responde vacío o con dudas, repite
+        la llamada con el modelo grande, que queda para el resto del turno.
+        """
+        ruta = estado["ruta"]
+        emitido: List[str] = []
+        emitir = None
+        if al_fragmento is not None:
+            def emitir(texto: str):
+                emitido.append(texto)
+                al_fragmento(texto)
+    
+        try:
+            response = self._llamar_claude(mensajes, uso, ruta, emitir, tiempos)
+            motivo = self.enrutador.motivo_escalada(ruta, response, bool(emitido))
+        except APIError as e:
+            if not self.enrutador.puede_escalar(ruta) or emitido:
+                raise
+            logger.warning(f"Error de {ruta.modelo}, se escala al modelo grande: {str(e)}")
+            motivo = "error"
+        if motivo is None:
+            return response
+    
+        estado["ruta"] = self.enrutador.escalar(ruta, motivo)
+        logger.info(f"Escalada {ruta.nombre} -> {estado['ruta'].modelo} ({motivo})")
+        return self._llamar_claude(mensajes, uso, estado["ruta"], al_fragmento, tiempos)
+    
+    def _llamar_claude(
+        self,
+        mensajes: List[Dict],
+        uso: Dict,
+        ruta: Ruta,
+        al_fragmento: Optional[Callable[[str], None]] = None,
+        tiempos: Optional[Dict] = None
+    ):
+        """Llama a Claude con el modelo y presupuesto de la ruta y acumula el uso de tokens"""
+        parametros = {
+            "model": ruta.modelo,
+            "max_tokens": ruta.max_tokens,
+            "system": list(SYSTEM_BLOQUES),
+            "tools": self.crear_herramientas(),
+            "messages": mensajes_con_cache(mensajes)
+        }
+        
+        inicio = time.perf_counter()
+        with metricas.medir("claude", metricas.llamadas_claude, modelo=ruta.modelo):
+            if al_fragmento is None:
+                response = anthropic_client().messages.create(**parametros)
+            else:
+                # Streaming: emitir párrafos completos a medida que llegan
+                divisor = DivisorParrafos(al_fragmento, min_caracteres=STREAMING_MIN_CARACTERES)
+                with anthropic_client().messages.stream(**parametros) as stream:
+                    for texto in stream.text_stream:
+                        if tiempos is not None:
+                            tiempos.setdefault("primer_token", time.monotonic())
+                        divisor.agregar(texto)
+                    response = stream.get_final_message()
+                divisor.cerrar()
+        
+        usage = response.usage
+        cache_lectura = getattr(usage, "cache_read_input_tokens", None) or 0
+        cache_escritura = getattr(usage, "cache_creation_input_tokens", None) or 0
+        uso["llamadas"] += 1
+        uso["costo"] += self.enrutador.registrar(ruta, time.perf_counter() - inicio, usage)
+        uso["input"] += usage.input_tokens
+        uso["output"] += usage.output_tokens
+        uso["cache_lectura"] += cache_lectura
+        uso["cache_escritura"] += cache_escritura
+        metricas.tokens.inc(usage.input_tokens, tipo="input")
+        metricas.tokens.inc(usage.output_tokens, tipo="output")
+        metricas.tokens.inc(cache_lectura, tipo="cache_lectura")
+        metricas.tokens.inc(cache_escritura, tipo="cache_escritura")
+        logger.info(
+            f"Claude ({ruta.modelo}): input={usage.input_tokens} cache_hit={cache_lectura} "
+            f"cache_miss={cache_escritura} output={usage.output_tokens}"
+        )
+        
+        return response
+    
+    def cargar_mensajes(
+        self,
+        telefono: str,
+        resumido_hasta: Optional[datetime],
+        ultimo_mensaje: Optional[datetime] = None
+    ) -> List[Dict]:
+        """
+        Lee todos los mensajes aún no resumidos de una conversación (los que no
+        entran en la ventana los pliega gestor_contexto.construir, así ninguno
+        se pierde sin pasar por el resumen; son a lo sumo unos pocos turnos).
+        Con `ultimo_mensaje` (ESCRITURA_MODO=diferida) espera a que estén escritos
+        los mensajes hasta ese ts: primero vacía la cola de este proceso y
+        después, si los encoló otro, relee hasta ESCRITURA_ESPERA segundos.
+        """
+        filtro = {"telefono": telefono}
+        if resumido_hasta:
+            filtro["ts"] = {"$gt": resumido_hasta}
+        if resumido_hasta and ultimo_mensaje and ultimo_mensaje <= resumido_hasta:
+            ultimo_mensaje = None
+        
+        limite = time.monotonic() + ESCRITURA_ESPERA
+        vaciada = False
+        while True:
+            previos = list(mensajes_col.find(filtro, {"_id": 0, "role": 1, "content": 1, "ts": 1}).sort("ts", 1))
+            if ultimo_mensaje is None or (previos and previos[-1]["ts"] >= ultimo_mensaje):
+                break
+            if not vaciada:
+                escritura.vaciar()
+                vaciada = True
+            elif time.monotonic() >= limite:
+                logger.warning(f"Mensajes de {telefono} hasta {ultimo_mensaje} sin escribir: se sigue sin ellos")
+                break
+            else:
+                time.sleep(0.05)
+        return previos
+    
+    def guardar_turno(
+        self,
+        telefono: str,
+        nuevos: List[Dict],
+        resumen: str,
+        resumido_hasta: Optional[datetime],
+        token: Optional[int] = None,
+        encoladas: Optional[List[int]] = None,
+        clave: Optional[str] = None
+    ) -> int:
+        """
+        Actualiza la conversación y agrega los mensajes del turno (O(1) por turno).
+        Con `token` (el del lease) la escritura se rechaza si otro proceso ya
+        escribió con un token más nuevo. Los mensajes pasan por la escritura
+        diferida: con ESCRITURA_MODO=turno se espera a que estén escritos, junto
+        con las `encoladas` del turno (leads y visitas) y, si algo falla, el
+        turno falla y lo suyo que no llegó a mandarse se saca de la cola; con
+        diferida solo se encolan y `ultimo_mensaje` le indica al próximo turno
+        hasta dónde esperarlos. Con `clave` los mensajes llevan _id
+        determinístico: el reintento del turno no los duplica. Devuelve las
+        idas y vueltas a MongoDB antes de responder.
+        """
+        ahora = datetime.now()
+        actualizacion = {
+            "$set": {
+                "resumen": resumen,
+                "resumido_hasta": resumido_hasta,
+                "ultima_actualizacion": ahora,
+                "ultimo_mensaje": ahora + timedelta(milliseconds=len(nuevos) - 1)
+            },
+            "$setOnInsert": {
+                "fecha_inicio": ahora,
                 "estado": "activa"
+            },
+            "$inc": {"mensajes": len(nuevos)}
+        }
+        if token is not None:
+            actualizacion["$set"]["token_bloqueo"] = token
+        try:
+            conversaciones_col.update_one(filtro_fencing(telefono, token), actualizacion, upsert=True)
+        except DuplicateKeyError:
+            bloqueos.perdido()
+            raise BloqueoPerdido(f"Turno de {telefono} descartado: el lease (token {token}) venció")
+        
+        documentos = [
+            {
+                "telefono": telefono,
+                "ts": ahora + timedelta(milliseconds=i),
+                "role": m["role"],
+                "content": m["content"]
             }
-            conversaciones_col.insert_one(conversacion)
+            for i, m in enumerate(nuevos)
+        ]
+        if clave is not None:
+            for i, documento in enumerate(documentos):
+                documento["_id"] = f"{clave}:{i}"
+        secuencias = escritura.agregar(mensajes_col, *(InsertOne(documento) for documento in documentos))
+        # Escritos antes de soltar el lease: el próximo turno del teléfono los lee
+        if ESCRITURA_MODO == "turno":
+            del_turno = (encoladas or []) + secuencias
+            try:
+                return 1 + escritura.vaciar(del_turno)
+            except Exception:
+                # El turno falla entero: lo que no llegó a mandarse no se escribe después
+                escritura.descartar(del_turno)
+                raise
+        return 1
+    
+    def _vaciar_antes(self, al_fragmento: Callable[[str], None], escrituras: Dict) -> Callable[[str], None]:
+        """al_fragmento que primero escribe lo encolado (p. ej. la visita que el fragmento confirma)"""
+        def enviar(fragmento: str):
+            if escrituras["secuencias"]:
+                try:
+                    escrituras["idas"] += escritura.vaciar(escrituras["secuencias"])
+                except Exception:
+                    escritura.descartar(escrituras["secuencias"])
+                    raise
+                escrituras["secuencias"].clear()
+            al_fragmento(fragmento)
+        return enviar
+    
+    def procesar_mensaje(
+        self,
+        mensaje: str,
+        telefono: str,
+        al_fragmento: Optional[Callable[[str], None]] = None,
+        al_esperar: Optional[Callable[[], None]] = None,
+        tiempos: Optional[Dict] = None
+    ) -> str:
+        """
+        Procesa un mensaje y genera respuesta.
+        Con `al_fragmento` la respuesta se genera en streaming y cada fragmento
+        se entrega en cuanto está completo; `al_esperar` se llama antes de
+        ejecutar herramientas (p. ej. para mostrar "escribiendo...").
+        `tiempos` recibe marcas de tiempo (time.monotonic) por etapa.
+        Con BLOQUEO_CONVERSACIONES el turno corre con el lease del teléfono.
+        """
+        if tiempos is None:
+            tiempos = {}
+        if not BLOQUEO_CONVERSACIONES:
+            return self._procesar(mensaje, telefono, None, al_fragmento, al_esperar, tiempos)
         
-        historial = conversacion.get("historial", [])
+        with metricas.medir("bloqueo"):
+            arrendamiento = bloqueos.adquirir(telefono)
+        try:
+            return self._procesar(mensaje, telefono, arrendamiento, al_fragmento, al_esperar, tiempos)
+        finally:
+            bloqueos.liberar(arrendamiento)
+    
+    def _procesar(
+        self,
+        mensaje: str,
+        telefono: str,
+        arrendamiento: Optional[Arrendamiento],
+        al_fragmento: Optional[Callable[[str], None]],
+        al_esperar: Optional[Callable[[], None]],
+        tiempos: Dict
+    ) -> str:
+        """Turno completo: carga, tool loop y guardado, con el lease tomado"""
+        token = arrendamiento.token if arrendamiento else None
         
-        # Agregar mensaje del usuario
-        historial.append({
+        with metricas.medir("carga"):
+            # Datos de la conversación: resumen y marca de lo ya resumido
+            conversacion = conversaciones_col.find_one({"telefono": telefono}) or {}
+            
+            # Conversaciones con el formato anterior se migran al primer acceso
+            if "historial" in conversacion:
+                migrar_conversacion(conversaciones_col, mensajes_col, conversacion, gestor_contexto)
+                conversacion = conversaciones_col.find_one({"telefono": telefono})
+            
+            resumen = conversacion.get("resumen", "")
+            resumido_hasta = conversacion.get("resumido_hasta")
+            
+            # Solo los mensajes aún no resumidos, más el mensaje del usuario
+            previos = self.cargar_mensajes(
+                telefono,
+                resumido_hasta,
+                conversacion.get("ultimo_mensaje") if ESCRITURA_MODO == "diferida" else None
+            )
+        nuevos = [{
             "role": "user",
             "content": mensaje
-        })
+        }]
+        
+        # Escrituras diferidas del turno, idas y vueltas a MongoDB antes de responder
+        # y la clave de sus mensajes (la misma si el webhook reintenta el turno)
+        escrituras = {
+            "secuencias": [],
+            "idas": 0,
+            "clave": clave_turno(telefono, previos[-1]["ts"] if previos else resumido_hasta, mensaje)
+        }
+        if al_fragmento is not None and ESCRITURA_MODO == "turno":
+            al_fragmento = self._vaciar_antes(al_fragmento, escrituras)
+        
+        # Sin historial la respuesta no depende de la conversación: se puede cachear
+        sin_historial = CACHE_RESPUESTAS and not previos and not resumen
+        version = None
+        if sin_historial:
+            version_catalogo.verificar()
+            version = version_catalogo.version
+            cacheada = cache_respuestas.obtener(mensaje, version)
+            if cacheada is not None:
+                tiempos["claude"] = time.monotonic()
+                if al_fragmento is not None:
+                    al_fragmento(cacheada)
+                nuevos.append({"role": "assistant", "content": cacheada})
+                with metricas.medir("guardado"):
+                    escrituras["idas"] += self.guardar_turno(
+                        telefono, nuevos, resumen, resumido_hasta, token,
+                        escrituras["secuencias"], escrituras["clave"]
+                    )
+                metricas.escrituras_turno.observar(escrituras["idas"])
+                logger.info(f"Respuesta cacheada para {telefono}")
+                return cacheada
+        elif CACHE_RESPUESTAS:
+            cache_respuestas.omitir()
+        
+        historial = [{"role": m["role"], "content": m["content"]} for m in previos] + nuevos
+        
+        # Ventana acotada: últimos turnos + resumen de los anteriores
+        mensajes, resumen, plegados = gestor_contexto.construir(historial, resumen)
+        if plegados:
+            resumido_hasta = previos[plegados - 1]["ts"]
+        tiempos["contexto"] = time.monotonic()
         
-        # System prompt
-        system_prompt = """Eres un agente inmobiliario virtual profesional y amable en WhatsApp.
-
-Tu objetivo es ayudar a los clientes a encontrar propiedades según sus necesidades.
-
-Responsabilidades:
-- Entender necesidades del cliente
-- Buscar propiedades con filtros adecuados
-- Proporcionar información detallada
-- Agendar visitas
-- Capturar información de contacto
-
-Comportamiento:
-- Sé profesional pero cercano
-- Sé específico con detalles
-- Confirma información importante
-- Mantén respuestas concisas para WhatsApp (máximo 3-4 párrafos)
-- Usa emojis moderadamente para hacer el mensaje más amigable
-
-Cuando muestres propiedades, incluye: precio, ubicación, características principales."""
-
         # Llamada a Claude
-        response = anthropic_client.messages.create(
-            model=self.model,
-            max_tokens=self.max_tokens,
-            system=system_prompt,
-            tools=self.crear_herramientas(),
-            messages=historial
-        )
+        uso = {"llamadas": 0, "input": 0, "output": 0, "cache_lectura": 0, "cache_escritura": 0, "costo": 0.0}
+        # Un "si" que contesta la pregunta del turno anterior no es un saludo
+        anterior = next((texto_mensaje(m) for m in reversed(previos) if m["role"] == "assistant"), None)
+        estado = {"ruta": self.enrutador.elegir(mensaje, anterior)}
+        response = self._llamar_enrutado(mensajes, uso, estado, al_fragmento, tiempos)
         
         # Procesar tool calls
+        iteraciones = 0
+        usadas = set()
         while response.stop_reason == "tool_use":
-            historial.append({
+            iteraciones += 1
+            mensaje_asistente = {
                 "role": "assistant",
-                "content": response.content
-            })
+                "content": contenido_plano(response.content)
+            }
+            nuevos.append(mensaje_asistente)
+            mensajes.append(mensaje_asistente)
             
-            tool_results = []
-            for block in response.content:
-                if block.type == "tool_use":
-                    resultado = self.ejecutar_herramienta(block.name, block.input)
-                    tool_results.append({
-                        "type": "tool_result",
-                        "tool_use_id": block.id,
-                        "content": json.dumps(resultado, ensure_ascii=False)
-                    })
+            if al_esperar is not None:
+                al_esperar()
+            bloques = [block for block in response.content if block.type == "tool_use"]
+            usadas.update(block.name for block in bloques)
+            tool_results = self.ejecutar_herramientas(bloques, escrituras["secuencias"], telefono)
             
-            historial.append({
+            mensaje_resultados = {
                 "role": "user",
                 "content": tool_results
-            })
+            }
+            nuevos.append(mensaje_resultados)
+            mensajes.append(mensaje_resultados)
             
-            response = anthropic_client.messages.create(
-                model=self.model,
-                max_tokens=self.max_tokens,
-                system=system_prompt,
-                tools=self.crear_herramientas(),
-                messages=historial
-            )
+            if arrendamiento is not None:
+                bloqueos.renovar(arrendamiento)
+            
+            response = self._llamar_enrutado(mensajes, uso, estado, al_fragmento, tiempos)
+        
+        tiempos["claude"] = time.monotonic()
+        metricas.iteraciones.observar(iteraciones)
         
         # Extraer respuesta
         respuesta_texto = ""
@@ -302,21 +773,27 @@ Cuando muestres propiedades, incluye: precio, ubicación, características princ
             if hasattr(block, "text"):
                 respuesta_texto += block.text
         
-        # Guardar historial actualizado
-        historial.append({
+        logger.info(
+            f"Tokens del turno {telefono}: {uso['llamadas']} llamadas, "
+            f"input={uso['input']} cache_hit={uso['cache_lectura']} "
+            f"cache_miss={uso['cache_escritura']} output={uso['output']} "
+            f"ruta={estado['ruta'].nombre} costo=US${uso['costo']:.4f}"
+        )
+        
+        # Guardar los mensajes nuevos del turno
+        nuevos.append({
             "role": "assistant",
             "content": respuesta_texto
         })
+        with metricas.medir("guardado"):
+            escrituras["idas"] += self.guardar_turno(
+                telefono, nuevos, resumen, resumido_hasta, token,
+                escrituras["secuencias"], escrituras["clave"]
+            )
+        metricas.escrituras_turno.observar(escrituras["idas"])
         
-        conversaciones_col.update_one(
-            {"telefono": telefono},
-            {
-                "$set": {
-                    "historial": historial,
-                    "ultima_actualizacion": datetime.now()
-                }
-            }
-        )
+        if sin_historial:
+            cache_respuestas.guardar(mensaje, version, respuesta_texto, uso["llamadas"], usadas)
         
         return respuesta_texto
 
@@ -327,16 +804,9 @@ agente = AgenteInmobiliario()
 
 def enviar_whatsapp(telefono: str, mensaje: str):
     """Envía mensaje por WhatsApp usando Green API"""
-    url = f"{GREEN_API_URL}/sendMessage/{GREEN_API_TOKEN}"
-    
-    payload = {
-        "chatId": f"{telefono}@c.us",
-        "message": mensaje
-    }
-    
     try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
+        with metricas.medir("whatsapp"):
+            green_api.enviar_mensaje(telefono, mensaje)
         logger.info(f"Mensaje enviado a {telefono}")
         return True
     except Exception as e:
@@ -344,6 +814,143 @@ def enviar_whatsapp(telefono: str, mensaje: str):
         return False
 
 
+def atender_mensaje(telefono: str, texto: str):
+    """Procesa un mensaje con el agente y envía la respuesta"""
+    tiempos = {"inicio": time.monotonic()}
+    with metricas.medir("turno"):
+        _atender(telefono, texto, tiempos)
+    
+    tiempos["fin"] = time.monotonic()
+    etapas = " ".join(
+        f"{etapa}={(marca - tiempos['inicio']) * 1000:.0f}ms"
+        for etapa, marca in sorted(tiempos.items(), key=lambda item: item[1])
+        if etapa != "inicio"
+    )
+    logger.info(f"Tiempos {telefono}: {etapas}")
+
+
+def _atender(telefono: str, texto: str, tiempos: Dict):
+    """Genera la respuesta (en streaming o completa) y la envía"""
+    if STREAMING_RESPUESTAS:
+        def enviar_fragmento(fragmento: str):
+            enviar_whatsapp(telefono, fragmento)
+            tiempos.setdefault("primer_mensaje", time.monotonic())
+        
+        agente.procesar_mensaje(
+            texto,
+            telefono,
+            al_fragmento=enviar_fragmento,
+            al_esperar=lambda: green_api.enviar_escribiendo(telefono),
+            tiempos=tiempos
+        )
+    else:
+        respuesta = agente.procesar_mensaje(texto, telefono, tiempos=tiempos)
+        enviar_whatsapp(telefono, respuesta)
+        tiempos["primer_mensaje"] = time.monotonic()
+
+
+# Cola de mensajes (solo se usa en modo asíncrono)
+cola = ColaMensajes(
+    atender_mensaje,
+    workers=COLA_WORKERS,
+    max_pendientes=COLA_MAX_PENDIENTES,
+    max_por_telefono=COLA_MAX_POR_TELEFONO,
+    ventana_fusion=COLA_VENTANA_FUSION,
+    max_espera_fusion=COLA_MAX_ESPERA_FUSION,
+)
+# atexit corre al revés del registro: primero terminan los turnos, después se escribe lo pendiente
+atexit.register(escritura.detener)
+atexit.register(cola.detener)
+
+
+def _medidores_de(nombre: str, ayuda: str, etiqueta: str, fuentes: Dict[str, Callable[[], Dict]], campo: str):
+    """Registra un medidor que lee `campo` de las estadísticas de cada fuente"""
+    metricas.registro.registrar(metricas.Medidor(
+        nombre,
+        ayuda,
+        lambda: {(clave,): estadisticas()[campo] for clave, estadisticas in fuentes.items()},
+        [etiqueta]
+    ))
+
+
+# Medidores leídos al exponer /metrics: cola, cachés del catálogo y webhooks
+_medidores_cola = {"cola": cola.estadisticas}
+_medidores_cache = {
+    "busquedas": cache_busquedas.estadisticas,
+    "detalles": cache_detalles.estadisticas,
+    "respuestas": cache_respuestas.estadisticas,
+}
+_medidores_de("agente_cola_pendientes", "Mensajes esperando en la cola", "cola", _medidores_cola, "pendientes")
+_medidores_de("agente_cola_en_proceso", "Teléfonos en proceso", "cola", _medidores_cola, "en_proceso")
+_medidores_de("agente_cola_rechazados", "Mensajes rechazados por saturación", "cola", _medidores_cola, "rechazados")
+_medidores_de("agente_cache_aciertos", "Aciertos de la caché", "cache", _medidores_cache, "aciertos")
+_medidores_de("agente_cache_fallos", "Fallos de la caché", "cache", _medidores_cache, "fallos")
+_medidores_de("agente_cache_bytes", "Memoria usada por la caché", "cache", _medidores_cache, "bytes")
+_medidores_de("agente_claude_ahorradas", "Llamadas a Claude evitadas por la caché de respuestas", "cache",
+              {"respuestas": cache_respuestas.estadisticas}, "llamadas_claude_ahorradas")
+_medidores_de("agente_escritura_pendientes", "Operaciones esperando la escritura diferida", "buffer",
+              {"escritura": escritura.estadisticas}, "pendientes")
+_medidores_de("agente_webhooks_duplicados", "Webhooks duplicados suprimidos", "origen",
+              {"total": deduplicador.estadisticas}, "duplicados")
+
+
+# Resultado del precalentamiento de este proceso: etapa -> ms (None si falló)
+_precalentamiento: Dict = {"pid": None, "etapas": {}}
+
+
+def _precalentar_mongo():
+    with pymongo.timeout(PRECALENTAR_TIMEOUT):
+        db.command("ping")
+
+
+def _precalentar_anthropic():
+    # Copia con timeout corto que comparte el pool de conexiones del cliente
+    anthropic_client().with_options(timeout=PRECALENTAR_TIMEOUT, max_retries=0).models.list(limit=1)
+
+
+def _precalentar_catalogo():
+    version_catalogo.verificar()
+    indice_semantico.sincronizar(propiedades_col)
+
+
+def precalentar() -> Dict:
+    """
+    Abre el pool de MongoDB y conexiones keep-alive a Anthropic y Green API, y
+    carga el índice del catálogo, una vez por proceso. Lo llama cada worker de
+    gunicorn antes de aceptar pedidos; las fallas se loguean y esas conexiones
+    se abren con el primer mensaje.
+    """
+    if _precalentamiento["pid"] == os.getpid():
+        return _precalentamiento["etapas"]
+    
+    pasos = (
+        ("mongo", _precalentar_mongo),
+        ("anthropic", _precalentar_anthropic),
+        ("green_api", green_api.precalentar),
+        ("catalogo", _precalentar_catalogo),
+    )
+    etapas = {}
+    with metricas.medir("precalentamiento"):
+        for nombre, paso in pasos:
+            # Sin MongoDB el catálogo esperaría la selección de servidor completa
+            if nombre == "catalogo" and etapas["mongo"] is None:
+                etapas[nombre] = None
+                continue
+            inicio = time.perf_counter()
+            try:
+                paso()
+                etapas[nombre] = round((time.perf_counter() - inicio) * 1000)
+            except Exception as e:
+                logger.warning(f"Precalentamiento de {nombre} falló: {str(e)}")
+                metricas.errores.inc(etapa="precalentamiento")
+                etapas[nombre] = None
+    
+    _precalentamiento["etapas"] = etapas
+    _precalentamiento["pid"] = os.getpid()
+    logger.info(f"Worker {os.getpid()} precalentado: {etapas}")
+    return etapas
+
+
 @app.route("/", methods=["GET"])
 def home():
     """Health check"""
@@ -354,9 +961,60 @@ def home():
     })
 
 
+@app.route("/live", methods=["GET"])
+def live():
+    """Liveness: el proceso atiende pedidos (no consulta dependencias)"""
+    return jsonify({"status": "vivo", "pid": os.getpid()})
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness: worker precalentado y con un servidor de MongoDB disponible"""
+    etapas = precalentar() if PRECALENTAR else {}
+    try:
+        mongo = mongo_client().topology_description.has_readable_server()
+    except Exception as e:
+        logger.error(f"MongoDB no disponible: {str(e)}")
+        mongo = False
+    return jsonify({
+        "status": "listo" if mongo else "no_listo",
+        "mongo": mongo,
+        "precalentamiento_ms": etapas
+    }), 200 if mongo else 503
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(metricas.registro.exponer(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Estadísticas de la cola, webhooks, cachés y envíos a Green API"""
+    return jsonify({
+        "modo": "asincrono" if WEBHOOK_ASINCRONO else "sincrono",
+        "cola": cola.estadisticas(),
+        "webhooks": deduplicador.estadisticas(),
+        "green_api": green_api.estadisticas(),
+        "cache": {
+            "version_catalogo": version_catalogo.version,
+            "busquedas": cache_busquedas.estadisticas(),
+            "detalles": cache_detalles.estadisticas(),
+            "indice_semantico": indice_semantico.estadisticas(),
+            "respuestas": cache_respuestas.estadisticas()
+        },
+        "bloqueos": bloqueos.estadisticas(),
+        "escritura": {"modo": ESCRITURA_MODO, **escritura.estadisticas()},
+        "modelos": agente.enrutador.estadisticas()
+    })
+
+
 @app.route("/webhook", methods=["POST"])
 def webhook():
     """Webhook para recibir mensajes de Green API"""
+    id_mensaje = None
+    inicio = time.perf_counter()
     try:
         data = request.json
         logger.info(f"Webhook recibido: {data}")
@@ -389,18 +1047,35 @@ def webhook():
         if "@g.us" in sender_data.get("chatId", ""):
             return jsonify({"status": "group_ignored"}), 200
         
+        # Reintentos de Green API: confirmar sin procesar de nuevo
+        id_mensaje = data.get("idMessage")
+        if deduplicador.es_duplicado(id_mensaje):
+            logger.info(f"Webhook duplicado ignorado: {id_mensaje}")
+            return jsonify({"status": "duplicate"}), 200
+        
         logger.info(f"Mensaje de {telefono}: {texto_mensaje}")
+        metricas.etapas.observar(time.perf_counter() - inicio, etapa="webhook")
         
-        # Procesar con el agente
-        respuesta = agente.procesar_mensaje(texto_mensaje, telefono)
+        # Modo asíncrono: encolar y responder de inmediato
+        if WEBHOOK_ASINCRONO:
+            try:
+                cola.encolar(telefono, texto_mensaje)
+            except ColaLlena as e:
+                logger.warning(f"Mensaje rechazado por saturación: {str(e)}")
+                deduplicador.olvidar(id_mensaje)
+                return jsonify({"status": "busy"}), 503
+            return jsonify({"status": "queued"}), 200
         
-        # Enviar respuesta
-        enviar_whatsapp(telefono, respuesta)
+        # Procesar con el agente y enviar respuesta
+        atender_mensaje(telefono, texto_mensaje)
         
         return jsonify({"status": "success"}), 200
     
     except Exception as e:
         logger.error(f"Error en webhook: {str(e)}")
+        metricas.errores.inc(etapa="webhook")
+        # Permitir que el reintento de Green API vuelva a procesarlo
+        deduplicador.olvidar(id_mensaje)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
@@ -0,0 +1,1012 @@
+"""
+Agente Inmobiliario IA - WhatsApp Bot (servidor asíncrono)
+Mismas rutas que main.py sobre Quart (ASGI), con el cliente asíncrono de
+Anthropic, motor para MongoDB y httpx para Green API: mientras una
+conversación espera a Claude el proceso sigue atendiendo otras, así que un
+solo proceso mantiene cientos de conversaciones en vuelo.
+
+Uso: uvicorn main_async:app --host 0.0.0.0 --port $PORT
+"""
+
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Dict, Optional, Tuple
+
+from anthropic import APIError, AsyncAnthropic
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne
+from pymongo.errors import DuplicateKeyError
+from quart import Quart, Response, request, jsonify
+
+import metricas
+from bloqueo import Arrendamiento, BloqueoConversacionesAsync, BloqueoPerdido, filtro_fencing
+from busqueda_semantica import IndiceSemantico
+from cache import CacheLRU, VersionCatalogo
+from catalogo import (
+    ORDEN_BUSQUEDA, PROYECCION_RESUMEN, TAMANO_PAGINA, filtro_cursor, filtros_busqueda, pagina
+)
+from cola import ColaMensajesAsync, ColaLlena
+from contexto import GestorContexto, texto_mensaje
+from deduplicacion import DeduplicadorAsync
+from enrutador import Enrutador, Ruta
+from escritura import EscrituraDiferidaAsync, Plazo, clave_turno, crear_indice_leads_async, operacion_lead
+from fragmentos import DivisorParrafos
+from green_api import ClienteGreenAPIAsync
+from migrar_historial import migrar_conversacion_async
+from prompts import HERRAMIENTAS, PROMPT_RESUMEN, SYSTEM_BLOQUES, mensajes_con_cache
+from recursos import BasePerezosa, PorProceso
+from respuestas import CacheRespuestas
+from serializacion import codificar_json, contenido_plano
+
+# Configuración de logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Inicialización
+app = Quart(__name__)
+
+# Variables de entorno (las mismas que main.py)
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB = os.getenv("MONGO_DB", "inmobiliaria")
+MONGO_POOL_MINIMO = int(os.getenv("MONGO_POOL_MINIMO", 2))
+GREEN_API_INSTANCE = os.getenv("GREEN_API_INSTANCE")
+GREEN_API_TOKEN = os.getenv("GREEN_API_TOKEN")
+GREEN_API_HOST = os.getenv("GREEN_API_HOST", "https://api.green-api.com")
+
+GREEN_API_TIMEOUT_CONEXION = float(os.getenv("GREEN_API_TIMEOUT_CONEXION", 3.05))
+GREEN_API_TIMEOUT_LECTURA = float(os.getenv("GREEN_API_TIMEOUT_LECTURA", 10))
+GREEN_API_REINTENTOS = int(os.getenv("GREEN_API_REINTENTOS", 3))
+GREEN_API_ENVIOS_POR_SEGUNDO = float(os.getenv("GREEN_API_ENVIOS_POR_SEGUNDO", 5))
+GREEN_API_RAFAGA = int(os.getenv("GREEN_API_RAFAGA", 10))
+
+WEBHOOK_ASINCRONO = os.getenv("WEBHOOK_ASINCRONO", "false").lower() == "true"
+COLA_MAX_PENDIENTES = int(os.getenv("COLA_MAX_PENDIENTES", 1000))
+COLA_MAX_POR_TELEFONO = int(os.getenv("COLA_MAX_POR_TELEFONO", 20))
+COLA_VENTANA_FUSION = float(os.getenv("COLA_VENTANA_FUSION", 0))
+COLA_MAX_ESPERA_FUSION = float(os.getenv("COLA_MAX_ESPERA_FUSION", 3 * COLA_VENTANA_FUSION))
+# Turnos procesándose a la vez en este proceso (equivale a COLA_WORKERS)
+ASYNC_MAX_EN_VUELO = int(os.getenv("ASYNC_MAX_EN_VUELO", 500))
+
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", 86400))
+DEDUP_MAX_MEMORIA = int(os.getenv("DEDUP_MAX_MEMORIA", 10000))
+
+PRECALENTAR = os.getenv("PRECALENTAR", "true").lower() == "true"
+PRECALENTAR_TIMEOUT = float(os.getenv("PRECALENTAR_TIMEOUT", 5))
+
+BLOQUEO_CONVERSACIONES = os.getenv("BLOQUEO_CONVERSACIONES", "true").lower() == "true"
+BLOQUEO_DURACION = float(os.getenv("BLOQUEO_DURACION", 60))
+BLOQUEO_ESPERA_MAX = float(os.getenv("BLOQUEO_ESPERA_MAX", 90))
+
+CONTEXTO_TURNOS = int(os.getenv("CONTEXTO_TURNOS", 6))
+CONTEXTO_LOTE_RESUMEN = int(os.getenv("CONTEXTO_LOTE_RESUMEN", 4))
+CONTEXTO_PRESUPUESTO_TOKENS = int(os.getenv("CONTEXTO_PRESUPUESTO_TOKENS", 6000))
+MODELO_RESUMEN = os.getenv("MODELO_RESUMEN", "claude-3-5-haiku-20241022")
+
+# Enrutamiento de modelos: el chico para saludos y pedidos simples, el grande para
+# consultas complejas y escaladas; presupuesto de tokens de salida por ruta
+ENRUTADOR_MODELOS = os.getenv("ENRUTADOR_MODELOS", "true").lower() == "true"
+MODELO_CHICO = os.getenv("MODELO_CHICO", "claude-3-5-haiku-20241022")
+MODELO_GRANDE = os.getenv("MODELO_GRANDE", "claude-sonnet-4-20250514")
+TOKENS_SALUDO = int(os.getenv("TOKENS_SALUDO", 300))
+TOKENS_SIMPLE = int(os.getenv("TOKENS_SIMPLE", 800))
+TOKENS_COMPLEJA = int(os.getenv("TOKENS_COMPLEJA", 1500))
+
+ESCRITURA_MODO = os.getenv("ESCRITURA_MODO", "turno").lower()
+ESCRITURA_INTERVALO = float(os.getenv("ESCRITURA_INTERVALO", 0.5))
+ESCRITURA_ESPERA = float(os.getenv("ESCRITURA_ESPERA", 2.0))
+ESCRITURA_MAX_LOTE = int(os.getenv("ESCRITURA_MAX_LOTE", 1000))
+ESCRITURA_MAX_PENDIENTES = int(os.getenv("ESCRITURA_MAX_PENDIENTES", 10000))
+
+HERRAMIENTAS_TIMEOUT = float(os.getenv("HERRAMIENTAS_TIMEOUT", 10))
+TIEMPO_AGOTADO = {"success": False, "error": "Tiempo de espera agotado"}
+
+STREAMING_RESPUESTAS = os.getenv("STREAMING_RESPUESTAS", "false").lower() == "true"
+STREAMING_MIN_CARACTERES = int(os.getenv("STREAMING_MIN_CARACTERES", 200))
+
+CACHE_PROPIEDADES_TTL = float(os.getenv("CACHE_PROPIEDADES_TTL", 300))
+CACHE_PROPIEDADES_MAX_ENTRADAS = int(os.getenv("CACHE_PROPIEDADES_MAX_ENTRADAS", 2000))
+CACHE_PROPIEDADES_MAX_BYTES = int(os.getenv("CACHE_PROPIEDADES_MAX_BYTES", 32 * 1024 * 1024))
+CACHE_VERSION_INTERVALO = float(os.getenv("CACHE_VERSION_INTERVALO", 30))
+
+CACHE_RESPUESTAS = os.getenv("CACHE_RESPUESTAS", "false").lower() == "true"
+CACHE_RESPUESTAS_TTL = float(os.getenv("CACHE_RESPUESTAS_TTL", 3600))
+CACHE_RESPUESTAS_MAX_ENTRADAS = int(os.getenv("CACHE_RESPUESTAS_MAX_ENTRADAS", 500))
+CACHE_RESPUESTAS_SIMILITUD = float(os.getenv("CACHE_RESPUESTAS_SIMILITUD", 1.0))
+
+# Cliente Anthropic (asíncrono)
+anthropic_client = AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+
+# MongoDB (motor), creado al primer uso: un MONGO_URI inválido no impide arrancar
+mongo_client = PorProceso(lambda: AsyncIOMotorClient(MONGO_URI, minPoolSize=MONGO_POOL_MINIMO))
+db = BasePerezosa(mongo_client, MONGO_DB)
+propiedades_col = db["propiedades"]
+conversaciones_col = db["conversaciones"]
+mensajes_col = db["mensajes"]
+clientes_col = db["clientes"]
+visitas_col = db["visitas"]
+meta_col = db["meta"]
+webhooks_col = db["webhooks_procesados"]
+
+deduplicador = DeduplicadorAsync(webhooks_col, ttl=DEDUP_TTL, max_memoria=DEDUP_MAX_MEMORIA)
+
+# Leases por teléfono: un solo turno a la vez por conversación en todo el despliegue
+bloqueos = BloqueoConversacionesAsync(
+    db["bloqueos"],
+    conversaciones_col,
+    duracion=BLOQUEO_DURACION,
+    espera_max=BLOQUEO_ESPERA_MAX
+)
+
+# Cachés del catálogo; la versión se consulta por polling (sin change stream)
+cache_busquedas = CacheLRU(
+    "busquedas",
+    max_entradas=CACHE_PROPIEDADES_MAX_ENTRADAS,
+    max_bytes=CACHE_PROPIEDADES_MAX_BYTES // 2,
+    ttl=CACHE_PROPIEDADES_TTL
+)
+cache_detalles = CacheLRU(
+    "detalles",
+    max_entradas=CACHE_PROPIEDADES_MAX_ENTRADAS,
+    max_bytes=CACHE_PROPIEDADES_MAX_BYTES // 2,
+    ttl=CACHE_PROPIEDADES_TTL
+)
+# Índice en memoria de buscar_por_descripcion, se sincroniza al cambiar el catálogo
+indice_semantico = IndiceSemantico(resultados=TAMANO_PAGINA)
+cache_respuestas = CacheRespuestas(
+    max_entradas=CACHE_RESPUESTAS_MAX_ENTRADAS,
+    ttl=CACHE_RESPUESTAS_TTL,
+    umbral_similitud=CACHE_RESPUESTAS_SIMILITUD
+)
+version_catalogo = VersionCatalogo(
+    meta_col,
+    propiedades_col,
+    [cache_busquedas, cache_detalles, indice_semantico, cache_respuestas],
+    intervalo=CACHE_VERSION_INTERVALO
+)
+
+# Escritura diferida de leads, visitas y mensajes (bulk_write agrupados)
+escritura = EscrituraDiferidaAsync(
+    intervalo=ESCRITURA_INTERVALO,
+    max_lote=ESCRITURA_MAX_LOTE,
+    max_pendientes=ESCRITURA_MAX_PENDIENTES
+)
+
+# Cliente de Green API sobre httpx
+GREEN_API_URL = f"{GREEN_API_HOST.rstrip('/')}/waInstance{GREEN_API_INSTANCE}"
+green_api = ClienteGreenAPIAsync(
+    GREEN_API_URL,
+    GREEN_API_TOKEN,
+    timeout_conexion=GREEN_API_TIMEOUT_CONEXION,
+    timeout_lectura=GREEN_API_TIMEOUT_LECTURA,
+    reintentos=GREEN_API_REINTENTOS,
+    envios_por_segundo=GREEN_API_ENVIOS_POR_SEGUNDO,
+    rafaga=GREEN_API_RAFAGA,
+    pool=100
+)
+
+
+async def resumir_conversacion(resumen_previo: str, transcripcion: str) -> str:
+    """Incorpora una transcripción al resumen acumulado usando Claude"""
+    contenido = f"Resumen actual:\n{resumen_previo or '(vacío)'}\n\nNuevos mensajes:\n{transcripcion}"
+    with metricas.medir("resumen", metricas.llamadas_claude, modelo=MODELO_RESUMEN):
+        response = await anthropic_client.messages.create(
+            model=MODELO_RESUMEN,
+            max_tokens=500,
+            system=PROMPT_RESUMEN,
+            messages=[{"role": "user", "content": contenido}]
+        )
+    return "".join(block.text for block in response.content if hasattr(block, "text")).strip()
+
+
+gestor_contexto = GestorContexto(
+    resumir_conversacion,
+    turnos_verbatim=CONTEXTO_TURNOS,
+    lote_resumen=CONTEXTO_LOTE_RESUMEN,
+    presupuesto_tokens=CONTEXTO_PRESUPUESTO_TOKENS,
+)
+
+
+class AgenteInmobiliarioAsync:
+    """Agente inmobiliario con IA (versión asíncrona de AgenteInmobiliario)"""
+
+    def __init__(self):
+        self.enrutador = Enrutador(
+            MODELO_CHICO if ENRUTADOR_MODELOS else MODELO_GRANDE,
+            MODELO_GRANDE,
+            tokens_saludo=TOKENS_SALUDO,
+            tokens_simple=TOKENS_SIMPLE,
+            tokens_compleja=TOKENS_COMPLEJA
+        )
+        self._indice_leads = False
+
+    async def obtener_propiedades(self, filtros: Dict = None) -> Tuple[List[Dict], Optional[str]]:
+        """Busca propiedades en MongoDB en orden estable; devuelve una página y el cursor siguiente"""
+        cursor = (
+            propiedades_col.find(filtros or {}, PROYECCION_RESUMEN)
+            .sort(ORDEN_BUSQUEDA)
+            .limit(TAMANO_PAGINA + 1)
+        )
+        return pagina(await cursor.to_list(length=None))
+
+    async def ejecutar_herramienta(
+        self,
+        nombre: str,
+        parametros: Dict,
+        escrituras: Optional[List[int]] = None,
+        telefono: Optional[str] = None,
+        plazo: Optional[Plazo] = None
+    ) -> Dict:
+        """Ejecuta una herramienta específica"""
+        try:
+            if nombre == "buscar_propiedades":
+                filtros = filtros_busqueda(parametros)
+                if parametros.get("cursor"):
+                    filtros = filtro_cursor(filtros, parametros["cursor"])
+                await version_catalogo.verificar_async()
+                clave = codificar_json(filtros)
+                resultado = cache_busquedas.obtener(clave)
+                if resultado is None:
+                    propiedades, siguiente = await self.obtener_propiedades(filtros)
+                    resultado = {"propiedades": propiedades, "siguiente": siguiente}
+                    cache_busquedas.guardar(clave, resultado)
+                respuesta = {
+                    "success": True,
+                    "cantidad": len(resultado["propiedades"]),
+                    "propiedades": resultado["propiedades"]
+                }
+                # Hay más resultados: Claude puede pedirlos con cursor=siguiente
+                if resultado["siguiente"]:
+                    respuesta["siguiente"] = resultado["siguiente"]
+                return respuesta
+
+            elif nombre == "buscar_por_descripcion":
+                await version_catalogo.verificar_async()
+                await indice_semantico.sincronizar_async(propiedades_col)
+                propiedades = indice_semantico.buscar(parametros["consulta"], parametros)
+                return {"success": True, "cantidad": len(propiedades), "propiedades": propiedades}
+
+            elif nombre == "obtener_detalle_propiedad":
+                await version_catalogo.verificar_async()
+                propiedad = cache_detalles.obtener(parametros["propiedad_id"])
+                if propiedad is None:
+                    propiedad = await propiedades_col.find_one({"_id": ObjectId(parametros["propiedad_id"])})
+                    if propiedad:
+                        propiedad['_id'] = str(propiedad['_id'])
+                        cache_detalles.guardar(propiedad['_id'], propiedad)
+                if propiedad:
+                    return {"success": True, "propiedad": propiedad}
+                return {"success": False, "error": "Propiedad no encontrada"}
+
+            elif nombre == "agendar_visita":
+                visita = {
+                    "_id": ObjectId(),
+                    "propiedad_id": parametros["propiedad_id"],
+                    "nombre_cliente": parametros["nombre_cliente"],
+                    "telefono": parametros["telefono"],
+                    "email": parametros.get("email"),
+                    "fecha_preferida": parametros.get("fecha_preferida"),
+                    "horario_preferido": parametros.get("horario_preferido"),
+                    "estado": "pendiente",
+                    "fecha_creacion": datetime.now()
+                }
+                if not await self._encolar(visitas_col, InsertOne(visita), escrituras, plazo):
+                    return dict(TIEMPO_AGOTADO)
+                return {
+                    "success": True,
+                    "mensaje": "Visita agendada correctamente",
+                    "visita_id": str(visita["_id"])
+                }
+
+            elif nombre == "guardar_lead":
+                if not self._indice_leads:
+                    await crear_indice_leads_async(clientes_col)
+                    self._indice_leads = True
+                # La clave del lead es el teléfono de la conversación, no el que escribió el cliente
+                if not await self._encolar(clientes_col, operacion_lead(parametros, telefono), escrituras, plazo):
+                    return dict(TIEMPO_AGOTADO)
+                return {
+                    "success": True,
+                    "mensaje": "Lead guardado correctamente",
+                    "telefono": telefono or parametros.get("telefono")
+                }
+
+            return {"success": False, "error": "Herramienta no reconocida"}
+
+        except Exception as e:
+            logger.error(f"Error ejecutando herramienta {nombre}: {str(e)}")
+            metricas.errores.inc(etapa="herramienta")
+            return {"success": False, "error": str(e)}
+
+    async def _encolar(self, coleccion, operacion, escrituras: Optional[List[int]], plazo: Optional[Plazo]) -> bool:
+        """Encola la escritura de una herramienta; False si su plazo ya venció"""
+        if plazo is not None and not plazo.comprometer():
+            return False
+        secuencias = await escritura.agregar(coleccion, operacion)
+        if escrituras is not None:
+            escrituras.extend(secuencias)
+        return True
+
+    async def _ejecutar_medido(
+        self, nombre: str, parametros: Dict, escrituras: List[int], telefono: str, plazo: Plazo
+    ) -> Dict:
+        """Ejecuta una herramienta registrando su duración"""
+        inicio = time.monotonic()
+        resultado = await self.ejecutar_herramienta(nombre, parametros, escrituras, telefono, plazo)
+        metricas.herramientas.observar(time.monotonic() - inicio, herramienta=nombre)
+        return resultado
+
+    async def ejecutar_herramientas(self, bloques: List, escrituras: List[int], telefono: str) -> List[Dict]:
+        """Ejecuta concurrentemente los tool_use de un turno y arma los tool_result en orden"""
+        plazos = [Plazo(time.monotonic() + HERRAMIENTAS_TIMEOUT) for _ in bloques]
+        tareas = [
+            asyncio.ensure_future(self._ejecutar_medido(block.name, block.input, escrituras, telefono, plazo))
+            for block, plazo in zip(bloques, plazos)
+        ]
+        _, pendientes = await asyncio.wait(tareas, timeout=HERRAMIENTAS_TIMEOUT)
+        vencidas = {tarea for tarea, plazo in zip(tareas, plazos) if tarea in pendientes and plazo.vencer()}
+        for tarea in vencidas:
+            tarea.cancel()
+        if pendientes - vencidas:
+            # Ya encolaron su escritura: se espera para informar lo que hicieron
+            await asyncio.wait(pendientes - vencidas)
+
+        tool_results = []
+        for block, tarea in zip(bloques, tareas):
+            if tarea in vencidas:
+                logger.error(f"Timeout ejecutando herramienta {block.name}")
+                metricas.errores.inc(etapa="herramienta")
+                resultado = dict(TIEMPO_AGOTADO)
+            else:
+                resultado = tarea.result()
+            tool_results.append({
+                "type": "tool_result",
+                "tool_use_id": block.id,
+                "content": codificar_json(resultado)
+            })
+        return tool_results
+
+    async def _llamar_enrutado(
+        self,
+        mensajes: List[Dict],
+        uso: Dict,
+        estado: Dict,
+        al_fragmento: Optional[Callable[[str], Awaitable[None]]] = None,
+        tiempos: Optional[Dict] = None
+    ):
+        """
+        Llama a Claude con la ruta del turno (estado["ruta"]). Si el modelo
+        chico falla, agota su presupuesto o responde vacío o con dudas, repite
+        la llamada con el modelo grande, que queda para el resto del turno.
+        """
+        ruta = estado["ruta"]
+        emitido: List[str] = []
+        emitir = None
+        if al_fragmento is not None:
+            async def emitir(texto: str):
+                emitido.append(texto)
+                await al_fragmento(texto)
+
+        try:
+            response = await self._llamar_claude(mensajes, uso, ruta, emitir, tiempos)
+            motivo = self.enrutador.motivo_escalada(ruta, response, bool(emitido))
+        except APIError as e:
+            if not self.enrutador.puede_escalar(ruta) or emitido:
+                raise
+            logger.warning(f"Error de {ruta.modelo}, se escala al modelo grande: {str(e)}")
+            motivo = "error"
+        if motivo is None:
+            return response
+
+        estado["ruta"] = self.enrutador.escalar(ruta, motivo)
+        logger.info(f"Escalada {ruta.nombre} -> {estado['ruta'].modelo} ({motivo})")
+        return await self._llamar_claude(mensajes, uso, estado["ruta"], al_fragmento, tiempos)
+
+    async def _llamar_claude(
+        self,
+        mensajes: List[Dict],
+        uso: Dict,
+        ruta: Ruta,
+        al_fragmento: Optional[Callable[[str], Awaitable[None]]] = None,
+        tiempos: Optional[Dict] = None
+    ):
+        """Llama a Claude con el modelo y presupuesto de la ruta y acumula el uso de tokens"""
+        parametros = {
+            "model": ruta.modelo,
+            "max_tokens": ruta.max_tokens,
+            "system": list(SYSTEM_BLOQUES),
+            "tools": list(HERRAMIENTAS),
+            "messages": mensajes_con_cache(mensajes)
+        }
+
+        inicio = time.perf_counter()
+        with metricas.medir("claude", metricas.llamadas_claude, modelo=ruta.modelo):
+            if al_fragmento is None:
+                response = await anthropic_client.messages.create(**parametros)
+            else:
+                # Streaming: los párrafos completos se envían a medida que llegan
+                listos: List[str] = []
+                divisor = DivisorParrafos(listos.append, min_caracteres=STREAMING_MIN_CARACTERES)
+                async with anthropic_client.messages.stream(**parametros) as stream:
+                    async for texto in stream.text_stream:
+                        if tiempos is not None:
+                            tiempos.setdefault("primer_token", time.monotonic())
+                        divisor.agregar(texto)
+                        while listos:
+                            await al_fragmento(listos.pop(0))
+                    response = await stream.get_final_message()
+                divisor.cerrar()
+                for fragmento in listos:
+                    await al_fragmento(fragmento)
+
+        usage = response.usage
+        cache_lectura = getattr(usage, "cache_read_input_tokens", None) or 0
+        cache_escritura = getattr(usage, "cache_creation_input_tokens", None) or 0
+        uso["llamadas"] += 1
+        uso["costo"] += self.enrutador.registrar(ruta, time.perf_counter() - inicio, usage)
+        uso["input"] += usage.input_tokens
+        uso["output"] += usage.output_tokens
+        uso["cache_lectura"] += cache_lectura
+        uso["cache_escritura"] += cache_escritura
+        metricas.tokens.inc(usage.input_tokens, tipo="input")
+        metricas.tokens.inc(usage.output_tokens, tipo="output")
+        metricas.tokens.inc(cache_lectura, tipo="cache_lectura")
+        metricas.tokens.inc(cache_escritura, tipo="cache_escritura")
+        logger.info(
+            f"Claude ({ruta.modelo}): input={usage.input_tokens} cache_hit={cache_lectura} "
+            f"cache_miss={cache_escritura} output={usage.output_tokens}"
+        )
+
+        return response
+
+    async def cargar_mensajes(
+        self,
+        telefono: str,
+        resumido_hasta: Optional[datetime],
+        ultimo_mensaje: Optional[datetime] = None
+    ) -> List[Dict]:
+        """Lee todos los mensajes aún no resumidos (ver AgenteInmobiliario.cargar_mensajes)"""
+        filtro = {"telefono": telefono}
+        if resumido_hasta:
+            filtro["ts"] = {"$gt": resumido_hasta}
+        if resumido_hasta and ultimo_mensaje and ultimo_mensaje <= resumido_hasta:
+            ultimo_mensaje = None
+
+        limite = time.monotonic() + ESCRITURA_ESPERA
+        vaciada = False
+        while True:
+            previos = await (
+                mensajes_col.find(filtro, {"_id": 0, "role": 1, "content": 1, "ts": 1})
+                .sort("ts", 1)
+                .to_list(length=None)
+            )
+            if ultimo_mensaje is None or (previos and previos[-1]["ts"] >= ultimo_mensaje):
+                break
+            if not vaciada:
+                await escritura.vaciar()
+                vaciada = True
+            elif time.monotonic() >= limite:
+                logger.warning(f"Mensajes de {telefono} hasta {ultimo_mensaje} sin escribir: se sigue sin ellos")
+                break
+            else:
+                await asyncio.sleep(0.05)
+        return previos
+
+    async def guardar_turno(
+        self,
+        telefono: str,
+        nuevos: List[Dict],
+        resumen: str,
+        resumido_hasta: Optional[datetime],
+        token: Optional[int] = None,
+        encoladas: Optional[List[int]] = None,
+        clave: Optional[str] = None
+    ) -> int:
+        """Actualiza la conversación y agrega los mensajes del turno (ver AgenteInmobiliario.guardar_turno)"""
+        ahora = datetime.now()
+        actualizacion = {
+            "$set": {
+                "resumen": resumen,
+                "resumido_hasta": resumido_hasta,
+                "ultima_actualizacion": ahora,
+                "ultimo_mensaje": ahora + timedelta(milliseconds=len(nuevos) - 1)
+            },
+            "$setOnInsert": {
+                "fecha_inicio": ahora,
+                "estado": "activa"
+            },
+            "$inc": {"mensajes": len(nuevos)}
+        }
+        if token is not None:
+            actualizacion["$set"]["token_bloqueo"] = token
+        try:
+            await conversaciones_col.update_one(filtro_fencing(telefono, token), actualizacion, upsert=True)
+        except DuplicateKeyError:
+            bloqueos.perdido()
+            raise BloqueoPerdido(f"Turno de {telefono} descartado: el lease (token {token}) venció")
+
+        documentos = [
+            {
+                "telefono": telefono,
+                "ts": ahora + timedelta(milliseconds=i),
+                "role": m["role"],
+                "content": m["content"]
+            }
+            for i, m in enumerate(nuevos)
+        ]
+        if clave is not None:
+            for i, documento in enumerate(documentos):
+                documento["_id"] = f"{clave}:{i}"
+        secuencias = await escritura.agregar(mensajes_col, *(InsertOne(documento) for documento in documentos))
+        if ESCRITURA_MODO == "turno":
+            del_turno = (encoladas or []) + secuencias
+            try:
+                return 1 + await escritura.vaciar(del_turno)
+            except Exception:
+                # El turno falla entero: lo que no llegó a mandarse no se escribe después
+                escritura.descartar(del_turno)
+                raise
+        return 1
+
+    def _vaciar_antes(
+        self, al_fragmento: Callable[[str], Awaitable[None]], escrituras: Dict
+    ) -> Callable[[str], Awaitable[None]]:
+        """al_fragmento que primero escribe lo encolado"""
+        async def enviar(fragmento: str):
+            if escrituras["secuencias"]:
+                try:
+                    escrituras["idas"] += await escritura.vaciar(escrituras["secuencias"])
+                except Exception:
+                    escritura.descartar(escrituras["secuencias"])
+                    raise
+                escrituras["secuencias"].clear()
+            await al_fragmento(fragmento)
+        return enviar
+
+    async def procesar_mensaje(
+        self,
+        mensaje: str,
+        telefono: str,
+        al_fragmento: Optional[Callable[[str], Awaitable[None]]] = None,
+        al_esperar: Optional[Callable[[], Awaitable[None]]] = None,
+        tiempos: Optional[Dict] = None
+    ) -> str:
+        """Procesa un mensaje y genera respuesta (ver AgenteInmobiliario.procesar_mensaje)"""
+        if tiempos is None:
+            tiempos = {}
+        if not BLOQUEO_CONVERSACIONES:
+            return await self._procesar(mensaje, telefono, None, al_fragmento, al_esperar, tiempos)
+
+        with metricas.medir("bloqueo"):
+            arrendamiento = await bloqueos.adquirir(telefono)
+        try:
+            return await self._procesar(mensaje, telefono, arrendamiento, al_fragmento, al_esperar, tiempos)
+        finally:
+            await bloqueos.liberar(arrendamiento)
+
+    async def _procesar(
+        self,
+        mensaje: str,
+        telefono: str,
+        arrendamiento: Optional[Arrendamiento],
+        al_fragmento: Optional[Callable[[str], Awaitable[None]]],
+        al_esperar: Optional[Callable[[], Awaitable[None]]],
+        tiempos: Dict
+    ) -> str:
+        """Turno completo: carga, tool loop y guardado, con el lease tomado"""
+        token = arrendamiento.token if arrendamiento else None
+
+        with metricas.medir("carga"):
+            conversacion = await conversaciones_col.find_one({"telefono": telefono}) or {}
+
+            # Conversaciones con el formato anterior se migran al primer acceso
+            if "historial" in conversacion:
+                await migrar_conversacion_async(conversaciones_col, mensajes_col, conversacion, gestor_contexto)
+                conversacion = await conversaciones_col.find_one({"telefono": telefono})
+
+            resumen = conversacion.get("resumen", "")
+            resumido_hasta = conversacion.get("resumido_hasta")
+            previos = await self.cargar_mensajes(
+                telefono,
+                resumido_hasta,
+                conversacion.get("ultimo_mensaje") if ESCRITURA_MODO == "diferida" else None
+            )
+
+        nuevos = [{
+            "role": "user",
+            "content": mensaje
+        }]
+
+        # Escrituras diferidas del turno y la clave de sus mensajes (ver main.py)
+        escrituras = {
+            "secuencias": [],
+            "idas": 0,
+            "clave": clave_turno(telefono, previos[-1]["ts"] if previos else resumido_hasta, mensaje)
+        }
+        if al_fragmento is not None and ESCRITURA_MODO == "turno":
+            al_fragmento = self._vaciar_antes(al_fragmento, escrituras)
+
+        # Sin historial la respuesta no depende de la conversación: se puede cachear
+        sin_historial = CACHE_RESPUESTAS and not previos and not resumen
+        version = None
+        if sin_historial:
+            await version_catalogo.verificar_async()
+            version = version_catalogo.version
+            cacheada = cache_respuestas.obtener(mensaje, version)
+            if cacheada is not None:
+                tiempos["claude"] = time.monotonic()
+                if al_fragmento is not None:
+                    await al_fragmento(cacheada)
+                nuevos.append({"role": "assistant", "content": cacheada})
+                with metricas.medir("guardado"):
+                    escrituras["idas"] += await self.guardar_turno(
+                        telefono, nuevos, resumen, resumido_hasta, token,
+                        escrituras["secuencias"], escrituras["clave"]
+                    )
+                metricas.escrituras_turno.observar(escrituras["idas"])
+                logger.info(f"Respuesta cacheada para {telefono}")
+                return cacheada
+        elif CACHE_RESPUESTAS:
+            cache_respuestas.omitir()
+
+        historial = [{"role": m["role"], "content": m["content"]} for m in previos] + nuevos
+
+        # Ventana acotada: últimos turnos + resumen de los anteriores
+        mensajes, resumen, plegados = await gestor_contexto.construir_async(historial, resumen)
+        if plegados:
+            resumido_hasta = previos[plegados - 1]["ts"]
+        tiempos["contexto"] = time.monotonic()
+
+        uso = {"llamadas": 0, "input": 0, "output": 0, "cache_lectura": 0, "cache_escritura": 0, "costo": 0.0}
+        # Un "si" que contesta la pregunta del turno anterior no es un saludo
+        anterior = next((texto_mensaje(m) for m in reversed(previos) if m["role"] == "assistant"), None)
+        estado = {"ruta": self.enrutador.elegir(mensaje, anterior)}
+        response = await self._llamar_enrutado(mensajes, uso, estado, al_fragmento, tiempos)
+
+        # Procesar tool calls
+        iteraciones = 0
+        usadas = set()
+        while response.stop_reason == "tool_use":
+            iteraciones += 1
+            mensaje_asistente = {
+                "role": "assistant",
+                "content": contenido_plano(response.content)
+            }
+            nuevos.append(mensaje_asistente)
+            mensajes.append(mensaje_asistente)
+
+            if al_esperar is not None:
+                await al_esperar()
+            bloques = [block for block in response.content if block.type == "tool_use"]
+            usadas.update(block.name for block in bloques)
+            tool_results = await self.ejecutar_herramientas(bloques, escrituras["secuencias"], telefono)
+
+            mensaje_resultados = {
+                "role": "user",
+                "content": tool_results
+            }
+            nuevos.append(mensaje_resultados)
+            mensajes.append(mensaje_resultados)
+
+            if arrendamiento is not None:
+                await bloqueos.renovar(arrendamiento)
+
+            response = await self._llamar_enrutado(mensajes, uso, estado, al_fragmento, tiempos)
+
+        tiempos["claude"] = time.monotonic()
+        metricas.iteraciones.observar(iteraciones)
+
+        respuesta_texto = "".join(block.text for block in response.content if hasattr(block, "text"))
+
+        logger.info(
+            f"Tokens del turno {telefono}: {uso['llamadas']} llamadas, "
+            f"input={uso['input']} cache_hit={uso['cache_lectura']} "
+            f"cache_miss={uso['cache_escritura']} output={uso['output']} "
+            f"ruta={estado['ruta'].nombre} costo=US${uso['costo']:.4f}"
+        )
+
+        nuevos.append({
+            "role": "assistant",
+            "content": respuesta_texto
+        })
+        with metricas.medir("guardado"):
+            escrituras["idas"] += await self.guardar_turno(
+                telefono, nuevos, resumen, resumido_hasta, token,
+                escrituras["secuencias"], escrituras["clave"]
+            )
+        metricas.escrituras_turno.observar(escrituras["idas"])
+
+        if sin_historial:
+            cache_respuestas.guardar(mensaje, version, respuesta_texto, uso["llamadas"], usadas)
+
+        return respuesta_texto
+
+
+# Instancia del agente
+agente = AgenteInmobiliarioAsync()
+
+
+async def enviar_whatsapp(telefono: str, mensaje: str) -> bool:
+    """Envía mensaje por WhatsApp usando Green API"""
+    try:
+        with metricas.medir("whatsapp"):
+            await green_api.enviar_mensaje(telefono, mensaje)
+        logger.info(f"Mensaje enviado a {telefono}")
+        return True
+    except Exception as e:
+        logger.error(f"Error enviando mensaje: {str(e)}")
+        return False
+
+
+async def atender_mensaje(telefono: str, texto: str):
+    """Procesa un mensaje con el agente y envía la respuesta"""
+    tiempos = {"inicio": time.monotonic()}
+    with metricas.medir("turno"):
+        if STREAMING_RESPUESTAS:
+            async def enviar_fragmento(fragmento: str):
+                await enviar_whatsapp(telefono, fragmento)
+                tiempos.setdefault("primer_mensaje", time.monotonic())
+
+            await agente.procesar_mensaje(
+                texto,
+                telefono,
+                al_fragmento=enviar_fragmento,
+                al_esperar=lambda: green_api.enviar_escribiendo(telefono),
+                tiempos=tiempos
+            )
+        else:
+            respuesta = await agente.procesar_mensaje(texto, telefono, tiempos=tiempos)
+            await enviar_whatsapp(telefono, respuesta)
+            tiempos["primer_mensaje"] = time.monotonic()
+
+    tiempos["fin"] = time.monotonic()
+    etapas = " ".join(
+        f"{etapa}={(marca - tiempos['inicio']) * 1000:.0f}ms"
+        for etapa, marca in sorted(tiempos.items(), key=lambda item: item[1])
+        if etapa != "inicio"
+    )
+    logger.info(f"Tiempos {telefono}: {etapas}")
+
+
+# Cola de mensajes (solo se usa con WEBHOOK_ASINCRONO=true)
+cola = ColaMensajesAsync(
+    atender_mensaje,
+    max_en_vuelo=ASYNC_MAX_EN_VUELO,
+    max_pendientes=COLA_MAX_PENDIENTES,
+    max_por_telefono=COLA_MAX_POR_TELEFONO,
+    ventana_fusion=COLA_VENTANA_FUSION,
+    max_espera_fusion=COLA_MAX_ESPERA_FUSION,
+)
+
+def _medidores_de(nombre: str, ayuda: str, etiqueta: str, fuentes: Dict[str, Callable[[], Dict]], campo: str):
+    """Registra un medidor que lee `campo` de las estadísticas de cada fuente"""
+    metricas.registro.registrar(metricas.Medidor(
+        nombre,
+        ayuda,
+        lambda: {(clave,): estadisticas()[campo] for clave, estadisticas in fuentes.items()},
+        [etiqueta]
+    ))
+
+
+# Medidores leídos al exponer /metrics (los mismos que main.py)
+_medidores_cola = {"cola": cola.estadisticas}
+_medidores_cache = {
+    "busquedas": cache_busquedas.estadisticas,
+    "detalles": cache_detalles.estadisticas,
+    "respuestas": cache_respuestas.estadisticas,
+}
+_medidores_de("agente_cola_pendientes", "Mensajes esperando en la cola", "cola", _medidores_cola, "pendientes")
+_medidores_de("agente_cola_en_proceso", "Turnos en proceso", "cola", _medidores_cola, "en_proceso")
+_medidores_de("agente_cola_rechazados", "Mensajes rechazados por saturación", "cola", _medidores_cola, "rechazados")
+_medidores_de("agente_cache_aciertos", "Aciertos de la caché", "cache", _medidores_cache, "aciertos")
+_medidores_de("agente_cache_fallos", "Fallos de la caché", "cache", _medidores_cache, "fallos")
+_medidores_de("agente_cache_bytes", "Memoria usada por la caché", "cache", _medidores_cache, "bytes")
+_medidores_de("agente_claude_ahorradas", "Llamadas a Claude evitadas por la caché de respuestas", "cache",
+              {"respuestas": cache_respuestas.estadisticas}, "llamadas_claude_ahorradas")
+_medidores_de("agente_escritura_pendientes", "Operaciones esperando la escritura diferida", "buffer",
+              {"escritura": escritura.estadisticas}, "pendientes")
+_medidores_de("agente_webhooks_duplicados", "Webhooks duplicados suprimidos", "origen",
+              {"total": deduplicador.estadisticas}, "duplicados")
+
+
+@app.after_serving
+async def cerrar():
+    """Termina los turnos en curso, escribe lo pendiente y cierra las conexiones"""
+    await cola.detener()
+    await escritura.detener()
+    await green_api.cerrar()
+    if mongo_client.creado:
+        mongo_client().close()
+
+
+# Resultado del precalentamiento: etapa -> ms (None si falló)
+_precalentamiento: Dict = {"etapas": {}}
+
+
+async def _precalentar_catalogo():
+    await version_catalogo.verificar_async()
+    await indice_semantico.sincronizar_async(propiedades_col)
+
+
+@app.before_serving
+async def precalentar():
+    """
+    Abre el pool de MongoDB y conexiones keep-alive a Anthropic y Green API, y
+    carga el índice del catálogo, antes de aceptar pedidos. Las fallas se
+    loguean y esas conexiones se abren con el primer mensaje.
+    """
+    if not PRECALENTAR:
+        return
+    pasos = (
+        ("mongo", lambda: db.command("ping")),
+        ("anthropic", lambda: anthropic_client.with_options(max_retries=0).models.list(limit=1)),
+        ("green_api", green_api.precalentar),
+        ("catalogo", _precalentar_catalogo),
+    )
+    etapas = _precalentamiento["etapas"]
+    with metricas.medir("precalentamiento"):
+        for nombre, paso in pasos:
+            # Sin MongoDB el catálogo esperaría la selección de servidor completa
+            if nombre == "catalogo" and etapas["mongo"] is None:
+                etapas[nombre] = None
+                continue
+            inicio = time.perf_counter()
+            try:
+                limite = None if nombre == "catalogo" else PRECALENTAR_TIMEOUT
+                await asyncio.wait_for(paso(), limite)
+                etapas[nombre] = round((time.perf_counter() - inicio) * 1000)
+            except Exception as e:
+                logger.warning(f"Precalentamiento de {nombre} falló: {str(e) or type(e).__name__}")
+                metricas.errores.inc(etapa="precalentamiento")
+                etapas[nombre] = None
+    logger.info(f"Worker {os.getpid()} precalentado: {etapas}")
+
+
+@app.route("/", methods=["GET"])
+async def home():
+    """Health check"""
+    return jsonify({
+        "status": "online",
+        "service": "Agente Inmobiliario IA",
+        "version": "1.0.0",
+        "modo": "asyncio"
+    })
+
+
+@app.route("/live", methods=["GET"])
+async def live():
+    """Liveness: el proceso atiende pedidos (no consulta dependencias)"""
+    return jsonify({"status": "vivo", "pid": os.getpid()})
+
+
+@app.route("/ready", methods=["GET"])
+async def ready():
+    """Readiness: precalentado y con un servidor de MongoDB disponible"""
+    try:
+        mongo = mongo_client().delegate.topology_description.has_readable_server()
+    except Exception as e:
+        logger.error(f"MongoDB no disponible: {str(e)}")
+        mongo = False
+    return jsonify({
+        "status": "listo" if mongo else "no_listo",
+        "mongo": mongo,
+        "precalentamiento_ms": _precalentamiento["etapas"]
+    }), 200 if mongo else 503
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(metricas.registro.exponer(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/stats", methods=["GET"])
+async def stats():
+    """Estadísticas de la cola, webhooks, cachés y envíos a Green API"""
+    return jsonify({
+        "modo": "asincrono" if WEBHOOK_ASINCRONO else "sincrono",
+        "servidor": "asyncio",
+        "tareas": len(asyncio.all_tasks()),
+        "cola": cola.estadisticas(),
+        "webhooks": deduplicador.estadisticas(),
+        "green_api": green_api.estadisticas(),
+        "cache": {
+            "version_catalogo": version_catalogo.version,
+            "busquedas": cache_busquedas.estadisticas(),
+            "detalles": cache_detalles.estadisticas(),
+            "indice_semantico": indice_semantico.estadisticas(),
+            "respuestas": cache_respuestas.estadisticas()
+        },
+        "bloqueos": bloqueos.estadisticas(),
+        "escritura": {"modo": ESCRITURA_MODO, **escritura.estadisticas()},
+        "modelos": agente.enrutador.estadisticas()
+    })
+
+
+@app.route("/webhook", methods=["POST"])
+async def webhook():
+    """Webhook para recibir mensajes de Green API"""
+    id_mensaje = None
+    inicio = time.perf_counter()
+    try:
+        data = await request.get_json()
+        logger.info(f"Webhook recibido: {data}")
+
+        # Validar estructura del webhook; solo mensajes entrantes
+        if not data or "typeWebhook" not in data:
+            return jsonify({"status": "ignored"}), 200
+        if data["typeWebhook"] != "incomingMessageReceived":
+            return jsonify({"status": "ignored"}), 200
+
+        message_data = data.get("messageData", {})
+        sender_data = data.get("senderData", {})
+
+        texto_mensaje = message_data.get("textMessageData", {}).get("textMessage", "")
+        if not texto_mensaje:
+            return jsonify({"status": "no_text"}), 200
+
+        telefono = sender_data.get("chatId", "").replace("@c.us", "")
+        if not telefono:
+            return jsonify({"status": "no_sender"}), 200
+
+        # Ignorar mensajes de grupos
+        if "@g.us" in sender_data.get("chatId", ""):
+            return jsonify({"status": "group_ignored"}), 200
+
+        # Reintentos de Green API: confirmar sin procesar de nuevo
+        id_mensaje = data.get("idMessage")
+        if await deduplicador.es_duplicado(id_mensaje):
+            logger.info(f"Webhook duplicado ignorado: {id_mensaje}")
+            return jsonify({"status": "duplicate"}), 200
+
+        logger.info(f"Mensaje de {telefono}: {texto_mensaje}")
+        metricas.etapas.observar(time.perf_counter() - inicio, etapa="webhook")
+
+        # Modo asíncrono: encolar y responder de inmediato
+        if WEBHOOK_ASINCRONO:
+            try:
+                cola.encolar(telefono, texto_mensaje)
+            except ColaLlena as e:
+                logger.warning(f"Mensaje rechazado por saturación: {str(e)}")
+                await deduplicador.olvidar(id_mensaje)
+                return jsonify({"status": "busy"}), 503
+            return jsonify({"status": "queued"}), 200
+
+        # Procesar con el agente y enviar respuesta (sin bloquear el proceso)
+        await atender_mensaje(telefono, texto_mensaje)
+
+        return jsonify({"status": "success"}), 200
+
+    except Exception as e:
+        logger.error(f"Error en webhook: {str(e)}")
+        metricas.errores.inc(etapa="webhook")
+        await deduplicador.olvidar(id_mensaje)
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@app.route("/send", methods=["POST"])
+async def send_message():
+    """Endpoint para enviar mensajes manualmente (testing)"""
+    try:
+        data = await request.get_json()
+        telefono = data.get("telefono")
+        mensaje = data.get("mensaje")
+
+        if not telefono or not mensaje:
+            return jsonify({"error": "telefono y mensaje son requeridos"}), 400
+
+        if await enviar_whatsapp(telefono, mensaje):
+            return jsonify({"status": "sent"}), 200
+        return jsonify({"status": "failed"}), 500
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 5000)))
@@ -0,0 +1,207 @@
+"""
+Métricas del agente en formato Prometheus
+Contadores, histogramas y medidores mínimos (sin dependencias externas),
+pensados para costar microsegundos por observación. Cada proceso de
+gunicorn expone sus propias métricas; Prometheus las distingue por instancia.
+"""
+
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Buckets de latencia en segundos (de milisegundos a un tool loop largo)
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _formato_etiquetas(nombres: Sequence[str], valores: Sequence[str], extra: str = "") -> str:
+    """{a="x",b="y"} con escape de comillas y barras"""
+    partes = [
+        f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for n, v in zip(nombres, valores)
+    ]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+class _Metrica:
+    """Base: nombre, ayuda, etiquetas y lock"""
+
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+
+    def _clave(self, etiquetas: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(etiquetas.get(e, "") for e in self.etiquetas)
+
+    def encabezado(self) -> List[str]:
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+
+
+class Contador(_Metrica):
+    """Valor que solo crece"""
+
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()):
+        super().__init__(nombre, ayuda, etiquetas)
+        self._valores: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, valor: float = 1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def exponer(self) -> List[str]:
+        with self._lock:
+            valores = list(self._valores.items())
+        return self.encabezado() + [
+            f"{self.nombre}{_formato_etiquetas(self.etiquetas, clave)} {valor}" for clave, valor in valores
+        ]
+
+
+class Histograma(_Metrica):
+    """Distribución de observaciones en buckets acumulativos"""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (), buckets: Sequence[float] = BUCKETS_SEGUNDOS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        # clave -> [conteos por bucket (+Inf al final), suma, cantidad]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observar(self, valor: float, **etiquetas):
+        clave = self._clave(etiquetas)
+        indice = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        """Observa la duración del bloque"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def exponer(self) -> List[str]:
+        with self._lock:
+            series = [(clave, list(serie[0]), serie[1], serie[2]) for clave, serie in self._series.items()]
+        lineas = self.encabezado()
+        for clave, conteos, suma, cantidad in series:
+            acumulado = 0
+            for limite, conteo in zip(list(self.buckets) + ["+Inf"], conteos):
+                acumulado += conteo
+                etiquetas = _formato_etiquetas(self.etiquetas, clave, f'le="{limite}"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            etiquetas = _formato_etiquetas(self.etiquetas, clave)
+            lineas.append(f"{self.nombre}_sum{etiquetas} {suma}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {cantidad}")
+        return lineas
+
+
+class Medidor(_Metrica):
+    """Valor instantáneo leído al exponer (p. ej. profundidad de la cola)"""
+
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, funcion: Callable[[], Dict[Tuple[str, ...], float]],
+                 etiquetas: Sequence[str] = ()):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion
+
+    def exponer(self) -> List[str]:
+        valores = self.funcion()
+        return self.encabezado() + [
+            f"{self.nombre}{_formato_etiquetas(self.etiquetas, clave)} {valor}" for clave, valor in valores.items()
+        ]
+
+
+class Registro:
+    """Conjunto de métricas expuestas en /metrics"""
+
+    def __init__(self):
+        self._metricas: List[_Metrica] = []
+
+    def registrar(self, metrica: _Metrica) -> _Metrica:
+        self._metricas.append(metrica)
+        return metrica
+
+    def exponer(self) -> str:
+        lineas = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.exponer())
+        return "\n".join(lineas) + "\n"
+
+
+registro = Registro()
+
+# Latencia por etapa: webhook, contexto, claude, herramientas, guardado, whatsapp, turno
+etapas = registro.registrar(Histograma(
+    "agente_etapa_segundos", "Duración de cada etapa del procesamiento", ["etapa"]
+))
+llamadas_claude = registro.registrar(Histograma(
+    "agente_claude_segundos", "Duración de cada llamada a messages.create", ["modelo"]
+))
+herramientas = registro.registrar(Histograma(
+    "agente_herramienta_segundos", "Duración de cada ejecución de herramienta", ["herramienta"]
+))
+iteraciones = registro.registrar(Histograma(
+    "agente_tool_loop_iteraciones", "Iteraciones del tool loop por turno", buckets=(0, 1, 2, 3, 4, 5, 8, 12)
+))
+tokens = registro.registrar(Contador(
+    "agente_tokens_total", "Tokens consumidos por tipo", ["tipo"]
+))
+errores = registro.registrar(Contador(
+    "agente_errores_total", "Errores por etapa", ["etapa"]
+))
+# Enrutamiento de modelos: latencia y costo por ruta, escaladas al modelo grande
+rutas = registro.registrar(Histograma(
+    "agente_ruta_segundos", "Duración de cada llamada a Claude por ruta y modelo", ["ruta", "modelo"]
+))
+costo = registro.registrar(Contador(
+    "agente_costo_usd_total", "Costo estimado de las llamadas a Claude en USD", ["ruta", "modelo"]
+))
+escaladas = registro.registrar(Contador(
+    "agente_escaladas_total", "Llamadas repetidas con el modelo grande por motivo", ["motivo"]
+))
+
+# Escritura diferida: operaciones por bulk_write y escrituras que esperó cada turno antes de responder
+lotes_escritura = registro.registrar(Histograma(
+    "agente_escritura_lote_operaciones", "Operaciones por bulk_write de la escritura diferida", ["coleccion"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+))
+escrituras_turno = registro.registrar(Histograma(
+    "agente_escrituras_por_turno", "Idas y vueltas de escritura a MongoDB antes de responder, por turno",
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10)
+))
+
+
+@contextmanager
+def medir(etapa: str, histograma: Optional[Histograma] = None, **etiquetas):
+    """Mide una etapa y cuenta el error si el bloque lanza una excepción"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errores.inc(etapa=etapa)
+        raise
+    finally:
+        duracion = time.perf_counter() - inicio
+        if histograma is None:
+            etapas.observar(duracion, etapa=etapa)
+        else:
+            histograma.observar(duracion, **etiquetas)
@@ -0,0 +1,114 @@
+"""
+Migración de conversaciones: del array `historial` a la colección `mensajes`
+Cada mensaje pasa a ser un documento propio indexado por (telefono, ts).
+Lo que no entra en la ventana que lee el agente se incorpora al resumen con
+el mismo resumidor (Claude), para no perderlo. Es idempotente: se puede volver a ejecutar si se interrumpe.
+
+Uso: python migrar_historial.py
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from pymongo import ASCENDING, MongoClient
+from pymongo.collection import Collection
+
+from contexto import GestorContexto
+
+# Variables de entorno
+MONGO_URI = os.getenv("MONGO_URI", "tu-mongo-uri-aqui")
+
+
+def crear_indices_mensajes(mensajes: Collection):
+    """Índice para leer la ventana reciente de cada teléfono"""
+    mensajes.create_index([("telefono", ASCENDING), ("ts", ASCENDING)])
+
+
+def _documentos(conversacion: Dict) -> List[Dict]:
+    """Un documento por mensaje del historial, con ts consecutivos desde el inicio"""
+    base = conversacion.get("fecha_inicio") or datetime.now()
+    return [
+        {
+            "telefono": conversacion["telefono"],
+            "ts": base + timedelta(milliseconds=i),
+            "role": mensaje["role"],
+            "content": mensaje["content"],
+            "origen": "migracion"
+        }
+        for i, mensaje in enumerate(conversacion.get("historial") or [])
+    ]
+
+
+def _actualizacion(documentos: List[Dict], resumen: str, resumidos: int) -> Dict:
+    """Resumen y marca de lo resumido; quita el formato anterior"""
+    resumido_hasta = documentos[resumidos - 1]["ts"] if resumidos else None
+    return {
+        "$set": {"resumen": resumen, "resumido_hasta": resumido_hasta, "mensajes": len(documentos)},
+        "$unset": {"historial": "", "resumidos": ""}
+    }
+
+
+def migrar_conversacion(
+    conversaciones: Collection, mensajes: Collection, conversacion: Dict, gestor: GestorContexto
+) -> int:
+    """Mueve el historial de una conversación a documentos individuales y resume lo que excede la ventana"""
+    # Reintentos: descartar lo insertado por una migración interrumpida
+    mensajes.delete_many({"telefono": conversacion["telefono"], "origen": "migracion"})
+
+    documentos = _documentos(conversacion)
+    if documentos:
+        mensajes.insert_many(documentos)
+
+    # Lo que ya estaba resumido queda marcado por timestamp
+    resumidos = min(max(conversacion.get("resumidos", 0), 0), len(documentos))
+
+    # Lo que excede la ventana se pliega en el resumen
+    resumen, plegados = gestor.plegar_excedente(documentos[resumidos:], conversacion.get("resumen", ""))
+    conversaciones.update_one(
+        {"_id": conversacion["_id"]},
+        _actualizacion(documentos, resumen, resumidos + plegados)
+    )
+    return len(documentos)
+
+
+async def migrar_conversacion_async(conversaciones, mensajes, conversacion: Dict, gestor: GestorContexto) -> int:
+    """Igual que migrar_conversacion, con colecciones de motor y un resumidor asíncrono"""
+    await mensajes.delete_many({"telefono": conversacion["telefono"], "origen": "migracion"})
+
+    documentos = _documentos(conversacion)
+    if documentos:
+        await mensajes.insert_many(documentos)
+
+    resumidos = min(max(conversacion.get("resumidos", 0), 0), len(documentos))
+    resumen, plegados = await gestor.plegar_excedente_async(documentos[resumidos:], conversacion.get("resumen", ""))
+    await conversaciones.update_one(
+        {"_id": conversacion["_id"]},
+        _actualizacion(documentos, resumen, resumidos + plegados)
+    )
+    return len(documentos)
+
+
+def migrar():
+    """Migra todas las conversaciones que todavía tienen `historial`"""
+    # El mismo resumidor y tamaño de ventana que usa el agente (CONTEXTO_*, MODELO_RESUMEN)
+    from main import gestor_contexto
+
+    client = MongoClient(MONGO_URI)
+    db = client["inmobiliaria"]
+
+    crear_indices_mensajes(db.mensajes)
+
+    total_conversaciones = 0
+    total_mensajes = 0
+    for conversacion in db.conversaciones.find({"historial": {"$exists": True}}):
+        total_mensajes += migrar_conversacion(db.conversaciones, db.mensajes, conversacion, gestor_contexto)
+        total_conversaciones += 1
+
+    print(f"✅ {total_conversaciones} conversaciones migradas ({total_mensajes} mensajes)")
+
+    client.close()
+
+
+if __name__ == "__main__":
+    migrar()
@@ -0,0 +1,170 @@
+"""
+Prompts y definiciones de herramientas del agente
+Compartidos por la app síncrona (main.py) y la asíncrona (main_async.py),
+construidos una sola vez para que el prefijo cacheado sea idéntico.
+"""
+
+from typing import Dict, List
+
+
+# Prompt-cache: marca el final de un prefijo estable (tools → system → historial)
+CACHE_EPHEMERAL = {"type": "ephemeral"}
+
+# System prompt (estático, se envía cacheado)
+SYSTEM_PROMPT = """Eres un agente inmobiliario virtual profesional y amable en WhatsApp.
+
+Tu objetivo es ayudar a los clientes a encontrar propiedades según sus necesidades.
+
+Responsabilidades:
+- Entender necesidades del cliente
+- Buscar propiedades con filtros adecuados
+- Proporcionar información detallada
+- Agendar visitas
+- Capturar información de contacto
+
+Comportamiento:
+- Sé profesional pero cercano
+- Sé específico con detalles
+- Confirma información importante
+- Mantén respuestas concisas para WhatsApp (máximo 3-4 párrafos)
+- Usa emojis moderadamente para hacer el mensaje más amigable
+
+Cuando muestres propiedades, incluye: precio, ubicación, características principales."""
+
+# Herramientas disponibles para Claude, construidas una sola vez
+HERRAMIENTAS = (
+    {
+        "name": "buscar_propiedades",
+        "description": "Busca propiedades disponibles según criterios. Filtra por tipo, precio, ubicación, habitaciones, etc. Devuelve hasta 10 propiedades ordenadas por precio (de menor a mayor), con un resumen por propiedad (id, título, precio, ubicación, habitaciones, baños); para descripción, características y dirección usar obtener_detalle_propiedad. Si hay más resultados devuelve `siguiente`: para ver más, repetir la búsqueda con los mismos filtros y cursor=siguiente.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "tipo": {
+                    "type": "string",
+                    "enum": ["casa", "departamento", "terreno", "oficina", "local"],
+                    "description": "Tipo de propiedad"
+                },
+                "operacion": {
+                    "type": "string",
+                    "enum": ["venta", "alquiler"],
+                    "description": "Venta o alquiler"
+                },
+                "precio_min": {"type": "number", "description": "Precio mínimo"},
+                "precio_max": {"type": "number", "description": "Precio máximo"},
+                "ubicacion": {"type": "string", "description": "Ciudad o zona"},
+                "habitaciones": {"type": "integer", "description": "Número de habitaciones"},
+                "banos": {"type": "integer", "description": "Número de baños"},
+                "cursor": {
+                    "type": "string",
+                    "description": "Valor de `siguiente` de la búsqueda anterior, para ver más resultados"
+                }
+            },
+            "required": []
+        }
+    },
+    {
+        "name": "buscar_por_descripcion",
+        "description": "Busca propiedades disponibles por lo que el cliente describe con sus palabras (comodidades, entorno, estilo), p. ej. \"con pileta y quincho, cerca del río\". Compara la consulta con título, descripción y características, y acepta los mismos filtros que buscar_propiedades. Devuelve hasta 10 propiedades ordenadas por relevancia (0 a 1), con el mismo resumen por propiedad. Usar buscar_propiedades cuando solo hay filtros exactos.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "consulta": {"type": "string", "description": "Lo que busca el cliente, en texto libre"},
+                "tipo": {
+                    "type": "string",
+                    "enum": ["casa", "departamento", "terreno", "oficina", "local"],
+                    "description": "Tipo de propiedad"
+                },
+                "operacion": {
+                    "type": "string",
+                    "enum": ["venta", "alquiler"],
+                    "description": "Venta o alquiler"
+                },
+                "precio_min": {"type": "number", "description": "Precio mínimo"},
+                "precio_max": {"type": "number", "description": "Precio máximo"},
+                "ubicacion": {"type": "string", "description": "Ciudad o zona"},
+                "habitaciones": {"type": "integer", "description": "Número de habitaciones"},
+                "banos": {"type": "integer", "description": "Número de baños"}
+            },
+            "required": ["consulta"]
+        }
+    },
+    {
+        "name": "obtener_detalle_propiedad",
+        "description": "Obtiene detalles completos de una propiedad (descripción, características, dirección, superficie) por su id",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "propiedad_id": {
+                    "type": "string",
+                    "description": "ID de la propiedad"
+                }
+            },
+            "required": ["propiedad_id"]
+        }
+    },
+    {
+        "name": "agendar_visita",
+        "description": "Agenda una visita a una propiedad",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "propiedad_id": {"type": "string", "description": "ID de la propiedad"},
+                "nombre_cliente": {"type": "string", "description": "Nombre del cliente"},
+                "telefono": {"type": "string", "description": "Teléfono del cliente"},
+                "email": {"type": "string", "description": "Email del cliente"},
+                "fecha_preferida": {"type": "string", "description": "Fecha preferida (YYYY-MM-DD)"},
+                "horario_preferido": {"type": "string", "description": "Horario preferido"}
+            },
+            "required": ["propiedad_id", "nombre_cliente", "telefono"]
+        }
+    },
+    {
+        "name": "guardar_lead",
+        "description": "Guarda información de un cliente potencial",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "nombre": {"type": "string", "description": "Nombre del cliente"},
+                "telefono": {"type": "string", "description": "Teléfono del cliente"},
+                "email": {"type": "string", "description": "Email del cliente"},
+                "preferencias": {"type": "object", "description": "Preferencias del cliente"}
+            },
+            "required": ["nombre"]
+        },
+        # Breakpoint de caché: cubre todas las definiciones de herramientas
+        "cache_control": CACHE_EPHEMERAL
+    },
+)
+
+# System prompt en bloques, con breakpoint de caché al final
+SYSTEM_BLOQUES = (
+    {"type": "text", "text": SYSTEM_PROMPT, "cache_control": CACHE_EPHEMERAL},
+)
+
+# Instrucciones para el resumen acumulado de conversaciones largas
+PROMPT_RESUMEN = """Actualiza el resumen de una conversación de WhatsApp entre un cliente y un agente inmobiliario.
+
+Conserva solo lo útil para continuar la atención:
+- Nombre y datos de contacto del cliente
+- Qué busca (tipo, operación, zona, presupuesto, ambientes)
+- Propiedades mostradas o de interés, con su ID
+- Visitas agendadas, leads guardados y compromisos pendientes
+
+Responde solo con el resumen, en un máximo de 10 líneas."""
+
+
+def mensajes_con_cache(mensajes: List[Dict]) -> List[Dict]:
+    """Copia de los mensajes con breakpoint de caché en el último bloque"""
+    if not mensajes:
+        return mensajes
+
+    ultimo = mensajes[-1]
+    contenido = ultimo["content"]
+    if isinstance(contenido, str):
+        bloques = [{"type": "text", "text": contenido, "cache_control": CACHE_EPHEMERAL}]
+    elif contenido and isinstance(contenido[-1], dict):
+        bloques = list(contenido[:-1]) + [{**contenido[-1], "cache_control": CACHE_EPHEMERAL}]
+    else:
+        return mensajes
+
+    return mensajes[:-1] + [{"role": ultimo["role"], "content": bloques}]
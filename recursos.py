@@ -0,0 +1,84 @@
+"""
+Clientes externos creados al primer uso en cada proceso
+Crear MongoClient o el cliente de Anthropic al importar la app suma su costo
+al arranque de cada worker, no es seguro con `gunicorn --preload` (el master
+abriría sockets e hilos que los workers heredan al hacer fork) y hace que un
+MONGO_URI inválido tumbe hasta el health check. Acá cada cliente se crea la
+primera vez que se usa en un proceso y se vuelve a crear si el proceso es un
+fork del que lo creó (mismo patrón que ColaMensajes.iniciar).
+"""
+
+import os
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class PorProceso(Generic[T]):
+    """Valor creado por `fabrica` al primer uso en cada proceso: cliente = recurso()"""
+
+    def __init__(self, fabrica: Callable[[], T]):
+        self.fabrica = fabrica
+        self._lock = threading.Lock()
+        self._valor: Optional[T] = None
+        self._pid: Optional[int] = None
+
+    def __call__(self) -> T:
+        if self._pid == os.getpid():
+            return self._valor
+        with self._lock:
+            if self._pid != os.getpid():
+                # El del proceso padre (si lo hay) se descarta sin cerrarlo: sus
+                # sockets e hilos pertenecen al padre
+                self._valor = self.fabrica()
+                self._pid = os.getpid()
+        return self._valor
+
+    @property
+    def creado(self) -> bool:
+        """True si ya se creó en este proceso"""
+        return self._pid == os.getpid()
+
+
+class ColeccionPerezosa:
+    """Colección de MongoDB que resuelve su cliente al primer uso en cada proceso"""
+
+    def __init__(self, cliente: PorProceso, base: str, nombre: str):
+        self._cliente = cliente
+        self._base = base
+        self.name = nombre
+        self._coleccion = None
+        self._pid: Optional[int] = None
+
+    def resolver(self):
+        """Collection real del cliente de este proceso"""
+        if self._pid != os.getpid():
+            self._coleccion = self._cliente()[self._base][self.name]
+            self._pid = os.getpid()
+        return self._coleccion
+
+    def __getattr__(self, atributo: str):
+        return getattr(self.resolver(), atributo)
+
+    def __repr__(self) -> str:
+        return f"ColeccionPerezosa({self._base}.{self.name})"
+
+
+class BasePerezosa:
+    """Base de MongoDB cuyas colecciones (db["x"] o db.x) se resuelven al primer uso"""
+
+    def __init__(self, cliente: PorProceso, nombre: str):
+        self._cliente = cliente
+        self.name = nombre
+
+    def __getitem__(self, nombre: str) -> ColeccionPerezosa:
+        return ColeccionPerezosa(self._cliente, self.name, nombre)
+
+    def __getattr__(self, atributo: str):
+        if atributo.startswith("_"):
+            raise AttributeError(atributo)
+        return self[atributo]
+
+    def command(self, *args, **kwargs):
+        return self._cliente()[self.name].command(*args, **kwargs)
@@ -0,0 +1,142 @@
+"""
+Caché de respuestas para preguntas genéricas sin contexto
+("¿qué alquileres tienen?", "horarios de atención", "¿cómo agendo una visita?").
+La clave es el texto normalizado (minúsculas, sin acentos ni puntuación) más
+la versión del catálogo; opcionalmente una pregunta parecida (similitud de
+Jaccard entre palabras) también cuenta como acierto. Solo se consulta y se
+guarda cuando la conversación no tiene historial, y solo se guardan turnos que
+no ejecutaron herramientas con efectos (agendar una visita, guardar un lead).
+"""
+
+import threading
+from typing import Dict, FrozenSet, Iterable, Optional
+
+from cache import CacheLRU
+from catalogo import palabras
+
+# Herramientas que solo leen el catálogo: un turno que usó otras no se cachea
+HERRAMIENTAS_SOLO_LECTURA = {"buscar_propiedades", "buscar_por_descripcion", "obtener_detalle_propiedad"}
+
+
+def normalizar_pregunta(texto: str) -> str:
+    """Minúsculas, sin acentos, puntuación ni palabras vacías ("¿Horarios de atención?" → "horarios atencion")"""
+    return " ".join(palabras(texto))
+
+
+def similitud(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """Jaccard entre los conjuntos de palabras de dos preguntas"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class CacheRespuestas:
+    """Respuestas de Claude a primeros mensajes, por pregunta normalizada y versión del catálogo"""
+
+    def __init__(
+        self,
+        max_entradas: int = 500,
+        ttl: float = 3600.0,
+        umbral_similitud: float = 1.0,
+        max_palabras: int = 12,
+    ):
+        self.umbral_similitud = umbral_similitud
+        self.max_palabras = max_palabras
+        self.cache = CacheLRU("respuestas", max_entradas=max_entradas, max_bytes=8 * 1024 * 1024, ttl=ttl)
+
+        self._lock = threading.Lock()
+        # Palabras de cada clave guardada, para buscar preguntas parecidas
+        self._palabras: Dict[str, FrozenSet[str]] = {}
+
+        # Estadísticas
+        self._aciertos_similares = 0
+        self._omitidas = 0
+        self._llamadas_ahorradas = 0
+
+    def _clave(self, pregunta: str, version: Optional[int]) -> str:
+        return f"{version}:{pregunta}"
+
+    def _cacheable(self, pregunta: str) -> bool:
+        """Solo mensajes cortos: los largos casi nunca se repiten y suelen traer datos personales"""
+        return bool(pregunta) and len(pregunta.split()) <= self.max_palabras
+
+    def _parecida(self, pregunta: str, version: Optional[int]) -> Optional[str]:
+        """Clave guardada más parecida a la pregunta, si supera el umbral"""
+        actuales = frozenset(pregunta.split())
+        prefijo = f"{version}:"
+        mejor, puntaje = None, self.umbral_similitud
+        with self._lock:
+            candidatas = list(self._palabras.items())
+        for clave, otras in candidatas:
+            if clave.startswith(prefijo):
+                valor = similitud(actuales, otras)
+                if valor >= puntaje:
+                    mejor, puntaje = clave, valor
+        return mejor
+
+    def obtener(self, texto: str, version: Optional[int]) -> Optional[str]:
+        """Respuesta cacheada para la pregunta, o None"""
+        pregunta = normalizar_pregunta(texto)
+        if not self._cacheable(pregunta):
+            with self._lock:
+                self._omitidas += 1
+            return None
+
+        exacta = self._clave(pregunta, version)
+        clave = exacta
+        if self.umbral_similitud < 1.0:
+            clave = self._parecida(pregunta, version) or exacta
+        entrada = self.cache.obtener(clave)
+        if entrada is None:
+            return None
+        similar = clave != exacta
+
+        with self._lock:
+            self._llamadas_ahorradas += entrada["llamadas"]
+            self._aciertos_similares += similar
+        return entrada["respuesta"]
+
+    def guardar(
+        self,
+        texto: str,
+        version: Optional[int],
+        respuesta: str,
+        llamadas: int,
+        herramientas: Iterable[str] = (),
+    ):
+        """Guarda la respuesta de un turno sin historial (si no tuvo efectos)"""
+        pregunta = normalizar_pregunta(texto)
+        if not respuesta or not self._cacheable(pregunta):
+            return
+        if not set(herramientas) <= HERRAMIENTAS_SOLO_LECTURA:
+            return
+
+        clave = self._clave(pregunta, version)
+        self.cache.guardar(clave, {"respuesta": respuesta, "llamadas": llamadas})
+        with self._lock:
+            self._palabras[clave] = frozenset(pregunta.split())
+            # Las claves desalojadas de la caché salen del índice de similitud
+            if len(self._palabras) > 2 * self.cache.max_entradas:
+                vigentes = set(self.cache.claves())
+                self._palabras = {c: p for c, p in self._palabras.items() if c in vigentes}
+
+    def invalidar(self):
+        """Vacía la caché (lo llama VersionCatalogo al cambiar el catálogo)"""
+        self.cache.invalidar()
+        with self._lock:
+            self._palabras.clear()
+
+    def omitir(self):
+        """Registra un mensaje que no se buscó en la caché por tener historial"""
+        with self._lock:
+            self._omitidas += 1
+
+    def estadisticas(self) -> Dict:
+        """Aciertos, fallos, omitidas y llamadas a Claude ahorradas"""
+        with self._lock:
+            propias = {
+                "aciertos_similares": self._aciertos_similares,
+                "omitidas": self._omitidas,
+                "llamadas_claude_ahorradas": self._llamadas_ahorradas,
+            }
+        return {**self.cache.estadisticas(), **propias}
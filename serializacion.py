@@ -0,0 +1,95 @@
+"""
+Serialización de resultados de herramientas y de mensajes del turno
+- codificar_json: JSON compacto (sin espacios, claves ordenadas) que entiende
+  los tipos que devuelve pymongo (ObjectId, datetime y Decimal128, este como
+  número si no pierde dígitos). Un mismo resultado da siempre el mismo texto,
+  así que no rompe el prefijo del prompt caching al reenviarse. Usa un único
+  codificador (el de C de la stdlib) en lugar de armar uno por llamada como
+  json.dumps con argumentos.
+- contenido_plano: los bloques del SDK de Anthropic (TextBlock, ToolUseBlock)
+  pasan a dicts con solo los campos que acepta la API, listos para guardar en
+  `mensajes` y para reenviar a Claude.
+"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, List, Union
+
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+
+
+def _numero(decimal: Decimal):
+    """Decimal como número JSON si no pierde dígitos (hasta 15 significativos), si no como texto"""
+    if not decimal.is_finite():
+        return str(decimal)
+    if decimal == decimal.to_integral_value():
+        return int(decimal)
+    if len(decimal.as_tuple().digits) <= 15:
+        return float(decimal)
+    return str(decimal)
+
+
+@lru_cache(maxsize=4096)
+def _numero_decimal128(bid: bytes):
+    """Decimal128 convertido, memorizado: to_decimal() cuesta ~7 µs y los precios se repiten"""
+    return _numero(Decimal128.from_bid(bid).to_decimal())
+
+
+def _tipo_bson(valor: Any):
+    """Valor JSON de los tipos que json no conoce"""
+    if isinstance(valor, ObjectId):
+        return str(valor)
+    if isinstance(valor, datetime):
+        return valor.isoformat(timespec="seconds")
+    if isinstance(valor, date):
+        return valor.isoformat()
+    if isinstance(valor, Decimal128):
+        return _numero_decimal128(valor.bid)
+    if isinstance(valor, Decimal):
+        return _numero(valor)
+    if isinstance(valor, (set, frozenset)):
+        return sorted(valor, key=str)
+    return str(valor)
+
+
+_CODIFICADOR = json.JSONEncoder(
+    ensure_ascii=False,
+    separators=(",", ":"),
+    sort_keys=True,
+    default=_tipo_bson,
+)
+
+
+def codificar_json(valor: Any) -> str:
+    """{"b": 1, "a": ObjectId(...)} → '{"a":"65f...","b":1}'"""
+    return _CODIFICADOR.encode(valor)
+
+
+def bloque_plano(bloque) -> Dict:
+    """Bloque de contenido del SDK (o dict) → dict mínimo para la API"""
+    if isinstance(bloque, dict):
+        return bloque
+    tipo = bloque.type
+    if tipo == "text":
+        return {"type": "text", "text": bloque.text}
+    if tipo == "tool_use":
+        return {"type": "tool_use", "id": bloque.id, "name": bloque.name, "input": bloque.input}
+    if tipo == "thinking":
+        return {"type": "thinking", "thinking": bloque.thinking, "signature": bloque.signature}
+    if tipo == "redacted_thinking":
+        return {"type": "redacted_thinking", "data": bloque.data}
+    return bloque.model_dump(exclude_none=True)
+
+
+def contenido_plano(contenido: Union[str, List]) -> Union[str, List[Dict]]:
+    """Contenido de un mensaje con dicts en lugar de bloques del SDK; sin bloques de texto vacíos (la API los rechaza)"""
+    if isinstance(contenido, str):
+        return contenido
+    return [
+        bloque_plano(bloque)
+        for bloque in contenido
+        if not (getattr(bloque, "type", None) == "text" and not bloque.text)
+    ]
@@ -0,0 +1,6 @@
+"""Los tests importan los módulos de la app desde la raíz del repo"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,107 @@
+"""Lease por teléfono con fencing (bloqueo.py) sobre mongomock"""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from bloqueo import BloqueoConversaciones, BloqueoOcupado, filtro_fencing
+
+TELEFONO = "5493415551234"
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().inmobiliaria
+
+
+def nuevo_bloqueo(db, **kwargs):
+    opciones = {"duracion": 30, "espera_max": 30, "espera_inicial": 0.001, "espera_tope": 0.01}
+    opciones.update(kwargs)
+    bloqueos = BloqueoConversaciones(db.bloqueos, db.conversaciones, **opciones)
+    bloqueos.crear_indices()
+    return bloqueos
+
+
+def escribir_turno(db, telefono, token, turnos):
+    """La escritura de guardar_turno: condicionada por el token de fencing"""
+    db.conversaciones.update_one(
+        filtro_fencing(telefono, token),
+        {"$set": {"turnos": turnos, "token_bloqueo": token}},
+        upsert=True
+    )
+
+
+def test_martilleo_un_telefono(db):
+    bloqueos = nuevo_bloqueo(db)
+    hilos, turnos_por_hilo = 8, 25
+    tokens = []
+
+    def trabajar():
+        for _ in range(turnos_por_hilo):
+            with bloqueos.tomar(TELEFONO) as arrendamiento:
+                conversacion = db.conversaciones.find_one({"telefono": TELEFONO}) or {}
+                turnos = conversacion.get("turnos", 0)
+                # Lectura, trabajo y escritura: sin el lease otro hilo pisaría el turno
+                time.sleep(0.0005)
+                escribir_turno(db, TELEFONO, arrendamiento.token, turnos + 1)
+                tokens.append(arrendamiento.token)
+
+    trabajadores = [threading.Thread(target=trabajar) for _ in range(hilos)]
+    for trabajador in trabajadores:
+        trabajador.start()
+    for trabajador in trabajadores:
+        trabajador.join()
+
+    total = hilos * turnos_por_hilo
+    conversacion = db.conversaciones.find_one({"telefono": TELEFONO})
+    # Ningún turno se perdió y los tokens crecen en el orden de los turnos
+    assert conversacion["turnos"] == total
+    assert tokens == sorted(set(tokens)) and len(tokens) == total
+    assert conversacion["token_bloqueo"] == tokens[-1]
+    estadisticas = bloqueos.estadisticas()
+    assert estadisticas["tomados"] == total
+    assert estadisticas["perdidos"] == estadisticas["agotados"] == 0
+
+
+def test_lease_vencido_rechaza_la_escritura_vieja(db):
+    bloqueos = nuevo_bloqueo(db)
+    viejo = bloqueos.adquirir(TELEFONO)
+    # El dueño se demora más que el lease
+    db.bloqueos.update_one({"_id": TELEFONO}, {"$set": {"expira": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    nuevo = bloqueos.adquirir(TELEFONO)
+    assert nuevo.token > viejo.token
+    escribir_turno(db, TELEFONO, nuevo.token, 1)
+
+    with pytest.raises(DuplicateKeyError):
+        escribir_turno(db, TELEFONO, viejo.token, 99)
+    assert not bloqueos.renovar(viejo)
+    assert db.conversaciones.find_one({"telefono": TELEFONO})["turnos"] == 1
+
+
+def test_token_no_retrocede_sin_documento_del_lease(db):
+    bloqueos = nuevo_bloqueo(db)
+    for turnos in range(1, 4):
+        with bloqueos.tomar(TELEFONO) as arrendamiento:
+            escribir_turno(db, TELEFONO, arrendamiento.token, turnos)
+    ultimo = arrendamiento.token
+
+    # Un documento de lease borrado (p. ej. por el TTL de versiones anteriores)
+    db.bloqueos.delete_one({"_id": TELEFONO})
+    with bloqueos.tomar(TELEFONO) as arrendamiento:
+        assert arrendamiento.token > ultimo
+        escribir_turno(db, TELEFONO, arrendamiento.token, 4)
+
+
+def test_espera_acotada(db):
+    bloqueos = nuevo_bloqueo(db, espera_max=0.05)
+    with bloqueos.tomar(TELEFONO):
+        with pytest.raises(BloqueoOcupado):
+            bloqueos.adquirir(TELEFONO)
+    assert bloqueos.estadisticas()["agotados"] == 1
+    # Liberado, se toma sin esperar
+    with bloqueos.tomar(TELEFONO):
+        pass
@@ -0,0 +1,97 @@
+"""Tamaño de los requests a Claude a lo largo de una conversación larga (contexto.py)"""
+
+from contexto import GestorContexto, estimar_tokens
+
+TOPE_RESUMEN = 2000
+RESULTADO_LARGO = "x" * 5000
+
+
+def turno(i):
+    """Un turno con tool loop: mensaje, búsqueda con un resultado largo y respuesta"""
+    return [
+        {"role": "user", "content": f"mensaje {i} " * 20},
+        {"role": "assistant", "content": [
+            {"type": "tool_use", "id": f"t{i}", "name": "buscar_propiedades", "input": {"ubicacion": "centro"}}
+        ]},
+        {"role": "user", "content": [{"type": "tool_result", "tool_use_id": f"t{i}", "content": RESULTADO_LARGO}]},
+        {"role": "assistant", "content": f"respuesta {i} " * 30},
+    ]
+
+
+def resumir(resumen, transcripcion):
+    """Resumidor de prueba con un tope de tamaño, como el de Claude"""
+    return (resumen + "\n" + transcripcion)[-TOPE_RESUMEN:]
+
+
+def conversar(gestor, turnos):
+    """
+    Simula los turnos como el agente: solo lee lo que no está resumido y lo
+    plegado deja de leerse. Devuelve (tokens por request, mensajes leídos por turno).
+    """
+    pendientes, resumen = [], ""
+    tamanos, leidos = [], []
+    for i in range(turnos):
+        nuevo = turno(i)
+        leidos.append(len(pendientes))
+        mensajes, resumen, plegados = gestor.construir(pendientes + nuevo[:1], resumen)
+        tamanos.append(estimar_tokens(mensajes))
+        pendientes = (pendientes + nuevo)[plegados:]
+    return tamanos, leidos
+
+
+def test_request_plano_en_conversacion_larga():
+    gestor = GestorContexto(resumir, turnos_verbatim=4, lote_resumen=3, presupuesto_tokens=3000)
+    tamanos, leidos = conversar(gestor, 300)
+
+    assert max(tamanos) <= gestor.presupuesto_tokens + TOPE_RESUMEN // 4
+    # Después de llenarse la ventana el tamaño no crece con la conversación
+    assert max(tamanos[150:]) <= max(tamanos[20:150])
+    # Lo que se lee de MongoDB por turno tampoco
+    assert max(leidos) <= (gestor.turnos_verbatim + gestor.lote_resumen + 1) * len(turno(0))
+
+
+def test_resumen_en_lotes():
+    llamadas = []
+
+    def contar(resumen, transcripcion):
+        llamadas.append(transcripcion)
+        return resumir(resumen, transcripcion)
+
+    gestor = GestorContexto(contar, turnos_verbatim=4, lote_resumen=4, presupuesto_tokens=100000)
+    conversar(gestor, 40)
+
+    # Se pliega de a lote_resumen turnos, no en cada turno (el prefijo cacheado dura)
+    assert 0 < len(llamadas) <= 40 // gestor.lote_resumen
+
+
+def test_presupuesto_descarta_turnos_viejos():
+    gestor = GestorContexto(resumir, turnos_verbatim=10, lote_resumen=4, presupuesto_tokens=1200)
+    historial = []
+    for i in range(6):
+        historial += [
+            {"role": "user", "content": f"pregunta {i} " + "a" * 2000},
+            {"role": "assistant", "content": "b" * 2000},
+        ]
+    historial.append({"role": "user", "content": "última"})
+
+    mensajes, _, plegados = gestor.construir(historial)
+
+    assert estimar_tokens(mensajes) <= gestor.presupuesto_tokens + TOPE_RESUMEN // 4
+    assert plegados > 0
+    assert mensajes[-1]["content"] == "última"
+
+
+def test_resultados_viejos_recortados():
+    gestor = GestorContexto(resumir, turnos_verbatim=6, lote_resumen=4, max_resultado=400)
+    historial = turno(0) + turno(1) + turno(2)[:1]
+
+    mensajes, _, plegados = gestor.construir(historial)
+
+    assert plegados == 0
+    resultados = [
+        bloque["content"]
+        for mensaje in mensajes if isinstance(mensaje["content"], list)
+        for bloque in mensaje["content"] if bloque.get("type") == "tool_result"
+    ]
+    assert len(resultados) == 2
+    assert all(len(resultado) < 500 and resultado.endswith("[resultado recortado]") for resultado in resultados)